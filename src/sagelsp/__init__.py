@@ -1,4 +1,5 @@
 import pluggy
+from importlib.util import find_spec
 from platformdirs import user_cache_dir
 from ._version import __version__
 
@@ -8,14 +9,11 @@ CachePath = user_cache_dir(appname="sagelsp", appauthor="SeanDictionary")
 hookspec = pluggy.HookspecMarker(NAME)
 hookimpl = pluggy.HookimplMarker(NAME)
 
+# Only look for Sage here, importing it is deferred to the server's background loading
 try:
-    import sage # type: ignore
-    from sage.env import SAGE_VERSION, SAGE_DATE    # type: ignore
-    SageAvaliable = True
-    SageVersion = f"{SAGE_VERSION} ({SAGE_DATE})"
+    SageAvaliable = find_spec("sage.env") is not None
 except ImportError:
     SageAvaliable = False
-    SageVersion = ""
 
 LANGUAGE_ID = "sagemath"
 
@@ -29,3 +27,18 @@ __all__ = [
     "CachePath",
 ]
 
+
+def __getattr__(name: str):
+    # `SageVersion` is resolved lazily since it needs to import `sage.env`
+    if name == "SageVersion":
+        global SageVersion
+        SageVersion = ""
+        if SageAvaliable:
+            try:
+                from sage.env import SAGE_VERSION, SAGE_DATE    # type: ignore
+                SageVersion = f"{SAGE_VERSION} ({SAGE_DATE})"
+            except ImportError:
+                pass
+        return SageVersion
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
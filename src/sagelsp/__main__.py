@@ -1,9 +1,8 @@
 import argparse
 import sys
 import logging
-from sagelsp import SageAvaliable, SageVersion
+import sagelsp
 from ._version import __version__
-from .server import server
 
 
 log = logging.getLogger(__name__)
@@ -31,8 +30,7 @@ arguments = [
     {
         'flags': ['--sage'],
         'params': {
-            'action': 'version',
-            'version': f'Sage available: {SageAvaliable} {SageVersion}',
+            'action': 'store_true',
             'help': 'Check if Sage is available and exit.',
         },
     },
@@ -42,18 +40,92 @@ arguments = [
             'action': 'store_true',
             'help': 'Clear local symbols cache and exit.',
         },
-    }
+    },
+    {
+        'flags': ['--stats-file'],
+        'params': {
+            'type': str,
+            'default': None,
+            'help': 'Write per-plugin hook statistics as JSON to this file on shutdown.',
+        },
+    },
+    {
+        'flags': ['--profile-slow'],
+        'params': {
+            'type': float,
+            'default': 0,
+            'metavar': 'MS',
+            'help': 'Profile requests and keep the profiles of those slower than MS milliseconds.',
+        },
+    },
+    {
+        'flags': ['--tracemalloc'],
+        'params': {
+            'type': int,
+            'default': 0,
+            'metavar': 'FRAMES',
+            'help': 'Trace memory allocations from startup, keeping FRAMES frames per allocation.',
+        },
+    },
+    {
+        'flags': ['--trace-file'],
+        'params': {
+            'type': str,
+            'default': None,
+            'help': 'Write request spans to this file in Chrome Trace Event format (for Perfetto).',
+        },
+    },
+]
+
+cache_commands = [
+    {
+        'name': 'export',
+        'help': 'Export local symbols cache into a read-only artifact.',
+        'arguments': [
+            {
+                'flags': ['path'],
+                'params': {
+                    'type': str,
+                    'help': 'Path of the artifact to write.',
+                },
+            },
+        ],
+    },
+    {
+        'name': 'import',
+        'help': 'Import symbols from an artifact into local symbols cache.',
+        'arguments': [
+            {
+                'flags': ['path'],
+                'params': {
+                    'type': str,
+                    'help': 'Path of the artifact to read.',
+                },
+            },
+            {
+                'flags': ['--force'],
+                'params': {
+                    'action': 'store_true',
+                    'help': 'Import even if the artifact was built for another Sage version.',
+                },
+            },
+        ],
+    },
 ]
 
 def main():
     parser = argparse.ArgumentParser()
     add_arguments(parser)
     args = parser.parse_args()
+    if args.sage:
+        print(f"Sage available: {sagelsp.SageAvaliable} {sagelsp.SageVersion}")
+        return
+
     level = logging._nameToLevel.get(args.log.upper(), logging.INFO)
     _config_logging(level)
 
     log.info(f"Starting SageLSP {__version__} By SeanDictionary")
-    log.info(f"Sage available: {SageAvaliable} {SageVersion}")
+    log.info(f"Sage available: {sagelsp.SageAvaliable}")
     log.info(f"Logging level set to {args.log.upper()}")
     log.info("-" * 40)
 
@@ -62,7 +134,30 @@ def main():
         SymbolsCache.clear()
         return
 
-    server.start_io()
+    if args.command == "cache":
+        _run_cache_command(args)
+        return
+
+    if args.profile_slow > 0:
+        from .profiler import Profiler
+        Profiler.threshold = args.profile_slow
+        log.info(f"Profiling requests slower than {args.profile_slow}ms into {Profiler.directory}")
+
+    if args.tracemalloc > 0:
+        from .memory import Memory
+        Memory.start(args.tracemalloc)
+
+    if args.trace_file:
+        from .tracing import Tracer
+        Tracer.start(args.trace_file)
+
+    from .server import server
+    server.stats_file = args.stats_file
+    try:
+        server.start_io()
+    finally:
+        if args.trace_file:
+            Tracer.stop()
 
 
 def add_arguments(parser: argparse.ArgumentParser):
@@ -70,6 +165,23 @@ def add_arguments(parser: argparse.ArgumentParser):
     for arg in arguments:
         parser.add_argument(*arg['flags'], **arg['params'])
 
+    subparsers = parser.add_subparsers(dest="command")
+    cache_parser = subparsers.add_parser("cache", help="Manage local symbols cache.")
+    cache_subparsers = cache_parser.add_subparsers(dest="cache_command", required=True)
+    for command in cache_commands:
+        command_parser = cache_subparsers.add_parser(command['name'], help=command['help'])
+        for arg in command['arguments']:
+            command_parser.add_argument(*arg['flags'], **arg['params'])
+
+
+def _run_cache_command(args: argparse.Namespace):
+    from .symbols_cache import SymbolsCache
+
+    if args.cache_command == "export":
+        SymbolsCache.export_artifact(args.path)
+    elif args.cache_command == "import":
+        SymbolsCache.import_artifact(args.path, force=args.force)
+
 
 def _config_logging(level=logging.INFO):
     # TODO: Support custom config
@@ -1,7 +1,10 @@
+import argparse
 import configparser
+import hashlib
+import json
 import logging
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from pygls.workspace import Workspace
 
 import pycodestyle
@@ -10,7 +13,7 @@ log = logging.getLogger(__name__)
 
 
 class StyleConfig:
-    """Unified configuration for pycodestyle and autopep8."""
+    """Unified configuration for pycodestyle, autopep8 and the server itself."""
 
     SECTIONS_KEYS = {
         "pycodestyle": [
@@ -19,6 +22,7 @@ class StyleConfig:
             "exclude",
             "max_line_length",
             "indent_size",
+            "max_doc_length",
             "hang_closing",
             "experimental",
             "aggressive",
@@ -29,13 +33,30 @@ class StyleConfig:
             "exclude",
             "max_line_length",
             "indent_size",
+            "max_doc_length",
             "hang_closing",
             "experimental",
             "aggressive",
         ],
         "notebook": [
             "ignore",
-        ]
+        ],
+        "sagelsp": [
+            "symbols_artifact",
+            "max_documents",
+            "warmup",
+            "warmup_modules",
+            "disabled_plugins",
+            "hook_timeout",
+            "plugin_timeouts",
+            "breaker_threshold",
+            "breaker_cooldown",
+            "lag_warning",
+            "memory_budget",
+            "idle_trim",
+            "concurrent_lint",
+            "format_diff_max_lines",
+        ],
     }
     SECTIONS = list(SECTIONS_KEYS.keys())
 
@@ -43,6 +64,11 @@ class StyleConfig:
         self.workspace = workspace
         self.workspace_root = Path(workspace.root_path) if workspace.root_path else None
         self._config = self._load_config()
+        self.config_hash = hashlib.sha1(json.dumps(self._config, sort_keys=True, default=str).encode()).hexdigest()
+        # (config hash, notebook) -> StyleGuide, a new StyleConfig is created when the configuration changes
+        self._style_guides: Dict[Tuple[str, bool], pycodestyle.StyleGuide] = {}
+        # (config hash, notebook) -> parsed autopep8 options and the StyleGuide of their pycodestyle options
+        self._autopep8_options: Dict[Tuple[str, bool], Tuple[argparse.Namespace, pycodestyle.StyleGuide]] = {}
     
     def _merge_configs(self, *configs: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
         """Merge multiple configuration dictionaries, with later ones taking precedence."""
@@ -123,11 +149,32 @@ class StyleConfig:
     def _parse_config_value(self, key: str, value: str) -> Any:
         """Parse configuration value to appropriate type."""
         # List values (comma-separated)
-        if key in ["select", "ignore", "exclude"]:
+        if key in ["select", "ignore", "exclude", "warmup_modules", "disabled_plugins"]:
             return [item.strip() for item in value.split(",") if item.strip()]
         
+        # Mapping values (comma-separated name=value pairs)
+        if key in ["plugin_timeouts"]:
+            mapping = {}
+            for item in value.split(","):
+                if not item.strip():
+                    continue
+                name, _, number = item.partition("=")
+                try:
+                    mapping[name.strip()] = float(number)
+                except ValueError:
+                    log.warning(f"Invalid entry for {key}: {item.strip()}")
+            return mapping
+
+        # Float values
+        if key in ["hook_timeout", "breaker_cooldown", "lag_warning", "memory_budget", "idle_trim"]:
+            try:
+                return float(value)
+            except ValueError:
+                log.warning(f"Invalid float value for {key}: {value}")
+                return None
+
         # Integer values
-        if key in ["max_line_length", "indent_size", "aggressive"]:
+        if key in ["max_line_length", "max_doc_length", "indent_size", "aggressive", "max_documents", "breaker_threshold", "format_diff_max_lines"]:
             try:
                 return int(value)
             except ValueError:
@@ -135,7 +182,7 @@ class StyleConfig:
                 return None
         
         # Boolean values
-        if key in ["hang_closing", "experimental"]:
+        if key in ["hang_closing", "experimental", "warmup", "concurrent_lint"]:
             return value.lower() in ("true", "1", "yes", "on")
         
         # String values
@@ -147,19 +194,65 @@ class StyleConfig:
 
         return config
 
+    def get_pycodestyle_style(self, notebook: bool = False) -> pycodestyle.StyleGuide:
+        """Get the pycodestyle.StyleGuide of this configuration, built once and shared by all documents."""
+        key = (self.config_hash, notebook)
+        style = self._style_guides.get(key)
+        if style is None:
+            config = self.get_notebook_pycodestyle_config() if notebook else self.get_pycodestyle_config()
+            style = self._style_guides[key] = pycodestyle.StyleGuide(**config)
+        return style
+
     def get_autopep8_config(self, line_range: Optional[List[int]] = None) -> Dict[str, Any]:
         """Get configuration for autopep8.fix_code."""
-        config = self._config.get("autopep8", {}).copy()
-        if not config:
-            # Fallback to pycodestyle config if autopep8 config is not defined
-            config = self._config.get("pycodestyle", {}).copy()
-        
+        config = self._autopep8_section()
+        # autopep8 has no such option, only the StyleGuide of `get_autopep8_options` uses it
+        config.pop("max_doc_length", None)
+
         # Add line range if provided
         if line_range is not None:
             config["line_range"] = line_range
         
         return config
     
+    def _autopep8_section(self) -> Dict[str, Any]:
+        config = self._config.get("autopep8", {}).copy()
+        if not config:
+            # Fallback to pycodestyle config if autopep8 config is not defined
+            config = self._config.get("pycodestyle", {}).copy()
+        return config
+
+    def get_autopep8_options(self, notebook: bool = False) -> Tuple[argparse.Namespace, pycodestyle.StyleGuide]:
+        """Get autopep8 options parsed once instead of on every `autopep8.fix_code` call, with a StyleGuide checking what autopep8 fixes."""
+        key = (self.config_hash, notebook)
+        cached = self._autopep8_options.get(key)
+        if cached is None:
+            import autopep8
+
+            config = self.get_notebook_autopep8_config() if notebook else self.get_autopep8_config()
+            # Same normalization as `autopep8.fix_code`
+            try:
+                options = autopep8._get_options(config, False)
+            except AttributeError:
+                # Private helper removed, parse the same way with the public API
+                options = autopep8.parse_args([""], apply_config=False)
+                for name, value in config.items():
+                    setattr(options, name, value)
+            options.ignore = [code.upper() for code in options.ignore]
+            options.select = [code.upper() for code in options.select]
+            if not {"W50", "W503", "W504"} & set(options.ignore):
+                options.ignore.append("W50")
+            style = pycodestyle.StyleGuide(
+                ignore=options.ignore,
+                select=options.select,
+                max_line_length=options.max_line_length,
+                max_doc_length=self._autopep8_section().get("max_doc_length"),
+                indent_size=options.indent_size,
+                hang_closing=options.hang_closing,
+            )
+            cached = self._autopep8_options[key] = (options, style)
+        return cached
+
     def get_notebook_pycodestyle_config(self) -> Dict[str, Any]:
         """Get configuration for notebook formatting."""
         config = self.get_pycodestyle_config()
@@ -190,6 +283,12 @@ class StyleConfig:
 
         return config
 
+    def get_sagelsp_config(self) -> Dict[str, Any]:
+        """Get configuration for the server itself."""
+        config = self._config.get("sagelsp", {}).copy()
+
+        return config
+
     def get_config(self) -> Dict[str, Dict[str, Any]]:
         """Get raw merged configuration."""
         return self._config.copy()
\ No newline at end of file
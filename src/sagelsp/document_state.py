@@ -0,0 +1,198 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+import threading
+import logging
+import time
+
+from sagelsp.memory_budget import BudgetedCache, CacheBudget, approx_size
+
+log = logging.getLogger(__name__)
+
+
+MAX_DOCUMENTS = 128
+MAX_EDITS = 64          # line edits kept per document for incremental analysis
+
+
+@dataclass
+class DocumentState:
+    """Analysis state kept for one document (or notebook virtual document)."""
+    undefined_names: Dict[str, str] = field(default_factory=dict)         # sage symbols need to import
+    no_need_import_names: Dict[str, str] = field(default_factory=dict)    # sage symbols not need to import
+    imported_names: Dict[str, str] = field(default_factory=dict)          # already imported sage symbols
+    all_names: Dict[str, str] = field(default_factory=dict)               # all sage symbols above
+    edits: List[Tuple[int, Tuple[int, int, int]]] = field(default_factory=list)   # (version, (first line, last line, new line count))
+    edits_base: Optional[int] = None                                      # version since which all edits are known
+    analysis: Dict[str, Any] = field(default_factory=dict)                # per plugin incremental state
+
+    def update_names(self, undefined_names: Dict[str, str], no_need_import_names: Dict[str, str], imported_names: Dict[str, str]):
+        self.undefined_names = undefined_names
+        self.no_need_import_names = no_need_import_names
+        self.imported_names = imported_names
+        self.all_names = {**undefined_names, **no_need_import_names, **imported_names}
+
+    def reset_edits(self, version: Optional[int]):
+        """Forget the edits, e.g. when the document is opened or replaced as a whole."""
+        self.edits = []
+        self.edits_base = version
+
+    def record_changes(self, version: int, changes: Iterable[Any]):
+        """Record the lines replaced by `didChange` content changes, applied in order."""
+        for change in changes:
+            change_range = getattr(change, "range", None)
+            if change_range is None:
+                self.reset_edits(version)
+                continue
+            self.edits.append((version, (change_range.start.line, change_range.end.line, change.text.count("\n"))))
+
+        if len(self.edits) > MAX_EDITS:
+            dropped = self.edits[:-MAX_EDITS]
+            self.edits = self.edits[-MAX_EDITS:]
+            self.edits_base = dropped[-1][0]
+
+    def edits_since(self, version: Optional[int]) -> Optional[List[Tuple[int, int, int]]]:
+        """Line edits made after `version`, in order, or None if they are not all known.
+
+        Each edit replaces the lines `first..last` (inclusive) of the previous text with `new line count + 1` lines.
+        """
+        if version is None or self.edits_base is None or version < self.edits_base:
+            return None
+        return [edit for edit_version, edit in self.edits if edit_version > version]
+
+
+class DocumentStateStore(BudgetedCache):
+    """Per-URI analysis state, evicted when documents are closed and bounded with LRU.
+
+    States of open documents are never evicted by the LRU bound or the memory budget,
+    plugins rely on them until the document is closed. The size of a state is measured
+    again only if it was used since it was last measured.
+    """
+
+    def __init__(self, max_documents: int = MAX_DOCUMENTS):
+        self.max_documents = max_documents
+        self.evictions = 0
+        self._states: "OrderedDict[str, DocumentState]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._sizes: Dict[str, int] = {}        # uri -> approximate bytes of a state unused since measured
+        self._open: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, uri: str) -> bool:
+        return uri in self._states
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def get(self, uri: str) -> Optional[DocumentState]:
+        """Get the state of a document and mark it as recently used."""
+        with self._lock:
+            state = self._states.get(uri)
+            if state is not None:
+                self._states.move_to_end(uri)
+                self._last_used[uri] = time.monotonic()
+                self._sizes.pop(uri, None)
+            return state
+
+    def get_or_create(self, uri: str) -> DocumentState:
+        """Get the state of a document, creating an empty one if needed."""
+        with self._lock:
+            state = self._states.get(uri)
+            if state is None:
+                state = DocumentState()
+                self._states[uri] = state
+                self._shrink()
+            else:
+                self._states.move_to_end(uri)
+            self._last_used[uri] = time.monotonic()
+            self._sizes.pop(uri, None)
+            return state
+
+    def open(self, uri: str) -> DocumentState:
+        """Get or create the state of a document opened by the editor, kept until it is closed."""
+        with self._lock:
+            self._open.add(uri)
+        return self.get_or_create(uri)
+
+    def evict(self, uri: str) -> bool:
+        """Drop the state of a document, e.g. when it is closed. Return True if there was one."""
+        with self._lock:
+            self._open.discard(uri)
+            self._last_used.pop(uri, None)
+            self._sizes.pop(uri, None)
+            if self._states.pop(uri, None) is None:
+                return False
+            self.evictions += 1
+        log.debug(f"Evicted document state for {uri}, occupancy: {self.occupancy()}")
+        return True
+
+    def resize(self, max_documents: int):
+        """Change the maximum number of documents and evict the least recently used ones."""
+        with self._lock:
+            self.max_documents = max(1, max_documents)
+            self._shrink()
+
+    def clear(self):
+        with self._lock:
+            self.evictions += len(self._states)
+            self._states.clear()
+            self._last_used.clear()
+            self._sizes.clear()
+            self._open.clear()
+
+    def states(self) -> List[DocumentState]:
+        with self._lock:
+            return list(self._states.values())
+
+    def occupancy(self) -> Dict[str, int]:
+        """Report how many documents are held and how many were evicted so far."""
+        return {
+            "documents": len(self._states),
+            "open": len(self._open),
+            "max_documents": self.max_documents,
+            "evictions": self.evictions,
+        }
+
+    def budget_info(self) -> Dict[str, Any]:
+        with self._lock:
+            items = list(self._states.items())
+        return {
+            **self.occupancy(),
+            "entries": len(items),
+            "bytes": sum(self._size(uri, state) for uri, state in items),
+        }
+
+    def budget_entries(self) -> Iterable[Tuple[float, Hashable, int]]:
+        with self._lock:
+            items = [
+                (self._last_used.get(uri, 0.0), uri, state)
+                for uri, state in self._states.items() if uri not in self._open
+            ]
+        return [(last_used, uri, self._size(uri, state)) for last_used, uri, state in items]
+
+    def budget_evict(self, key: Hashable):
+        self.evict(key)
+
+    def _size(self, uri: str, state: DocumentState) -> int:
+        size = self._sizes.get(uri)
+        if size is None:
+            size = approx_size(state)
+            with self._lock:
+                if self._states.get(uri) is state:
+                    self._sizes[uri] = size
+        return size
+
+    def _shrink(self):
+        excess = len(self._states) - self.max_documents
+        if excess <= 0:
+            return
+        closed = [uri for uri in self._states if uri not in self._open][:excess]
+        for uri in closed:
+            del self._states[uri]
+            self._last_used.pop(uri, None)
+            self._sizes.pop(uri, None)
+            self.evictions += 1
+            log.debug(f"Evicted least recently used document state for {uri}")
+
+
+DocumentStates = DocumentStateStore()
+CacheBudget.register("document_states", DocumentStates)
@@ -0,0 +1,92 @@
+from typing import Any, Dict, List, Optional
+import gc
+import logging
+import os
+import sys
+import tracemalloc
+
+log = logging.getLogger(__name__)
+
+
+TOP_LIMIT = 20      # number of allocation sites reported from tracemalloc snapshots
+
+
+class MemoryInspector:
+    """Take `tracemalloc` snapshots and diff them against the previous one."""
+
+    def __init__(self):
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            log.info(f"tracemalloc started with {frames} frames")
+
+    def stop(self):
+        self.baseline = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            log.info("tracemalloc stopped")
+
+    def snapshot(self, limit: int = TOP_LIMIT) -> List[Dict[str, Any]]:
+        """Take a snapshot, keep it as the baseline and return the biggest allocation sites."""
+        snapshot = self._take()
+        self.baseline = snapshot
+        return [_format_stat(stat) for stat in snapshot.statistics("lineno")[:limit]]
+
+    def diff(self, limit: int = TOP_LIMIT) -> List[Dict[str, Any]]:
+        """Take a snapshot and return the allocation sites that grew most since the baseline."""
+        snapshot = self._take()
+        if self.baseline is None:
+            self.baseline = snapshot
+            return []
+        stats = snapshot.compare_to(self.baseline, "lineno")
+        self.baseline = snapshot
+        return [_format_stat(stat) for stat in stats[:limit]]
+
+    def report(self) -> Dict[str, Any]:
+        if not tracemalloc.is_tracing():
+            return {"tracing": False}
+        current, peak = tracemalloc.get_traced_memory()
+        return {"tracing": True, "traced_bytes": current, "peak_traced_bytes": peak}
+
+    def _take(self) -> tracemalloc.Snapshot:
+        self.start()
+        gc.collect()
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+
+def _format_stat(stat) -> Dict[str, Any]:
+    frame = stat.traceback[0]
+    result = {"location": f"{frame.filename}:{frame.lineno}", "size": stat.size, "count": stat.count}
+    if isinstance(stat, tracemalloc.StatisticDiff):
+        result["size_diff"] = stat.size_diff
+        result["count_diff"] = stat.count_diff
+    return result
+
+
+def process_memory() -> Dict[str, int]:
+    """Resident set size of the process, where the platform tells it."""
+    result = {}
+    try:
+        with open("/proc/self/statm") as f:
+            result["rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result["peak_rss_bytes"] = peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:     # Windows
+        pass
+    return result
+
+
+Memory = MemoryInspector()
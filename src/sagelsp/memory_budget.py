@@ -0,0 +1,344 @@
+from collections import OrderedDict, namedtuple
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+import functools
+import gc
+import logging
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+IDLE_TRIM = 300.0           # seconds without messages before caches are trimmed
+BUDGET_INTERVAL = 5.0       # seconds between two budget checks
+PARSO_BYTES_PER_CHAR = 12   # rough size of a parso tree per character of source
+
+
+def approx_size(obj: Any, limit: int = 100_000) -> int:
+    """Approximate deep size of an object in bytes, visiting at most `limit` objects."""
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack and len(seen) < limit:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj, 64)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, "__dict__"):
+            stack.append(obj.__dict__)
+    return size
+
+
+class BudgetedCache:
+    """Interface of caches registered with the memory budget.
+
+    Caches with evictable entries override `budget_entries` and `budget_evict`,
+    report-only caches just override `budget_info`.
+    """
+
+    def budget_info(self) -> Dict[str, Any]:
+        """Return at least `entries` and approximate `bytes`."""
+        return {"entries": 0, "bytes": 0}
+
+    def budget_entries(self) -> Iterable[Tuple[float, Hashable, int]]:
+        """Yield `(last used monotonic time, key, approximate bytes)` of evictable entries."""
+        return ()
+
+    def budget_evict(self, key: Hashable):
+        pass
+
+    def budget_trim(self, idle_since: float):
+        """Drop what is not worth keeping while the editor is idle, e.g. entries unused since `idle_since`."""
+        for last_used, key, _ in list(self.budget_entries()):
+            if last_used < idle_since:
+                self.budget_evict(key)
+
+
+class LRUCache(BudgetedCache):
+    """Thread safe LRU mapping bounded by entry count, registered with the memory budget."""
+
+    def __init__(self, name: str, maxsize: int = 128, sizeof: Callable[[Any], int] = approx_size, register: bool = True):
+        self.name = name
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, Tuple[Any, int, float]]" = OrderedDict()    # key -> (value, bytes, last used)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        if register:
+            CacheBudget.register(name, self)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data[key] = (item[0], item[1], time.monotonic())
+            self._data.move_to_end(key)
+            return item[0]
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None):
+        """Store a value, `size` is its approximate bytes if known, else it is measured with `sizeof`."""
+        if size is None:
+            size = self.sizeof(value)
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (value, size, time.monotonic())
+            self._bytes += size
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            self._remove(key)
+            return item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _remove(self, key: Hashable):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._bytes -= item[1]
+
+    def budget_info(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def budget_entries(self) -> Iterable[Tuple[float, Hashable, int]]:
+        with self._lock:
+            return [(last_used, key, size) for key, (_, size, last_used) in self._data.items()]
+
+    def budget_evict(self, key: Hashable):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+                self.evictions += 1
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+def cached(name: str, maxsize: int = 128, sizeof: Optional[Callable[..., int]] = None):
+    """Like `functools.lru_cache` for functions of hashable arguments, but accounted in the memory budget.
+
+    `sizeof(result, *args)` estimates the bytes of a result, by default it is measured with `approx_size`.
+    """
+    def decorator(func: Callable) -> Callable:
+        cache = LRUCache(name, maxsize)
+        missing = object()
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            result = cache.get(args, missing)
+            if result is missing:
+                result = func(*args)
+                cache.put(args, result, sizeof(result, *args) if sizeof is not None else None)
+            return result
+
+        wrapper.cache = cache
+        wrapper.cache_clear = cache.clear
+        wrapper.cache_info = lambda: CacheInfo(cache.hits, cache.misses, cache.maxsize, len(cache))
+        return wrapper
+    return decorator
+
+
+class MemoryBudget:
+    """Global byte budget shared by the caches of the server.
+
+    Above the budget, the least recently used entries of all caches are evicted first.
+    When no message arrived for `idle_trim` seconds, caches are trimmed once.
+    """
+
+    def __init__(self, max_bytes: int = 0, idle_trim: float = IDLE_TRIM):
+        self.max_bytes = max_bytes
+        self.idle_trim = idle_trim
+        self.evictions = 0
+        self.trims = 0
+        self.last_activity = time.monotonic()
+        self._trimmed = False
+        self._caches: Dict[str, BudgetedCache] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, cache: BudgetedCache):
+        with self._lock:
+            self._caches[name] = cache
+
+    def unregister(self, name: str):
+        with self._lock:
+            self._caches.pop(name, None)
+
+    def caches(self) -> Dict[str, BudgetedCache]:
+        with self._lock:
+            return dict(self._caches)
+
+    def touch(self):
+        """Record activity of the editor."""
+        self.last_activity = time.monotonic()
+        self._trimmed = False
+
+    def total_bytes(self) -> int:
+        return sum(cache.budget_info().get("bytes", 0) for cache in self.caches().values())
+
+    def enforce(self) -> int:
+        """Evict least recently used entries across caches until the total is under budget.
+
+        Return the number of evicted entries.
+        """
+        if self.max_bytes <= 0:
+            return 0
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return 0
+
+        candidates = []
+        for cache in self.caches().values():
+            candidates.extend((last_used, size, key, cache) for last_used, key, size in cache.budget_entries())
+        candidates.sort(key=lambda candidate: candidate[0])
+
+        evicted = 0
+        for _, size, key, cache in candidates:
+            if total <= self.max_bytes:
+                break
+            cache.budget_evict(key)
+            total -= size
+            evicted += 1
+
+        self.evictions += evicted
+        if evicted:
+            log.info(f"Memory budget exceeded, evicted {evicted} cache entries, ~{total} bytes left")
+        return evicted
+
+    def trim_if_idle(self) -> bool:
+        """Trim caches once if the editor has been idle long enough. Return True if trimmed."""
+        if self.idle_trim <= 0 or self._trimmed:
+            return False
+        if time.monotonic() - self.last_activity < self.idle_trim:
+            return False
+
+        self._trimmed = True
+        self.trims += 1
+        for name, cache in self.caches().items():
+            try:
+                cache.budget_trim(self.last_activity)
+            except Exception:
+                log.warning(f"Failed to trim cache {name}", exc_info=True)
+        gc.collect()
+        _malloc_trim()
+        log.info(f"Idle for {self.idle_trim:.0f}s, caches trimmed to ~{self.total_bytes()} bytes")
+        return True
+
+    async def run(self, interval: float = BUDGET_INTERVAL):
+        import asyncio
+
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.enforce()
+                self.trim_if_idle()
+            except Exception:
+                log.warning("Failed to apply memory budget", exc_info=True)
+
+    def report(self) -> Dict[str, Any]:
+        caches = {name: cache.budget_info() for name, cache in self.caches().items()}
+        return {
+            "max_bytes": self.max_bytes,
+            "total_bytes": sum(info.get("bytes", 0) for info in caches.values()),
+            "evictions": self.evictions,
+            "trims": self.trims,
+            "caches": caches,
+        }
+
+
+class ParsoCache(BudgetedCache):
+    """Parser cache of parso, shared with jedi. Sizes are estimated from the source length."""
+
+    def _items(self):
+        parso_cache = sys.modules.get("parso.cache")
+        if parso_cache is None:
+            return
+        for grammar, modules in list(parso_cache.parser_cache.items()):
+            for path, item in list(modules.items()):
+                yield (grammar, path), item
+
+    def budget_info(self) -> Dict[str, Any]:
+        entries = list(self._items())
+        return {
+            "entries": len(entries),
+            "bytes": sum(_parso_item_size(item) for _, item in entries),
+        }
+
+    def budget_entries(self) -> Iterable[Tuple[float, Hashable, int]]:
+        # parso records wall clock times
+        offset = time.monotonic() - time.time()
+        return [(item.last_used + offset, key, _parso_item_size(item)) for key, item in self._items()]
+
+    def budget_evict(self, key: Hashable):
+        parso_cache = sys.modules.get("parso.cache")
+        if parso_cache is not None:
+            grammar, path = key
+            parso_cache.parser_cache.get(grammar, {}).pop(path, None)
+
+
+class JediCache(BudgetedCache):
+    """Time caches of jedi, only trimmed when idle."""
+
+    def budget_info(self) -> Dict[str, Any]:
+        jedi_cache = sys.modules.get("jedi.cache")
+        entries = sum(len(cache) for cache in jedi_cache._time_caches.values()) if jedi_cache else 0
+        return {"entries": entries, "bytes": 0}
+
+    def budget_trim(self, idle_since: float):
+        jedi_cache = sys.modules.get("jedi.cache")
+        if jedi_cache is not None:
+            for cache in jedi_cache._time_caches.values():
+                cache.clear()
+
+
+def _parso_item_size(item) -> int:
+    return sum(len(line) for line in item.lines) * PARSO_BYTES_PER_CHAR
+
+
+def _malloc_trim():
+    """Return freed heap memory to the OS on glibc."""
+    if not sys.platform.startswith("linux"):
+        return
+    try:
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+CacheBudget = MemoryBudget()
+CacheBudget.register("parso", ParsoCache())
+CacheBudget.register("jedi", JediCache())
@@ -0,0 +1,136 @@
+from sagelsp.plugins.stats import LatencyStats
+
+from typing import Any, Callable, Dict, Optional
+import array
+import asyncio
+import functools
+import inspect
+import logging
+import sys
+import threading
+
+try:
+    import fcntl
+    import termios
+except ImportError:     # Windows
+    fcntl = termios = None
+
+log = logging.getLogger(__name__)
+
+
+MONITOR_INTERVAL = 0.5      # seconds between two samples
+LAG_WARNING = 250.0         # milliseconds of event loop lag logged as warning
+
+
+class LoopMonitor:
+    """Sample how long the event loop is blocked and how many messages wait to be handled.
+
+    Every handler runs synchronously on the event loop, so the lag of a periodic timer is the
+    time the loop was busy handling messages. Messages the client wrote to stdin that are not
+    read yet are measured in bytes. Messages read whose handler hasn't finished are counted by
+    the handlers wrapped with `track`, handlers running on the loop are also counted when they
+    finish, as the messages handled between two samples. Requests sent by the server to the
+    client that are not answered yet are counted separately.
+    """
+
+    def __init__(self, ls: Any, interval: float = MONITOR_INTERVAL, lag_warning: float = LAG_WARNING):
+        self.ls = ls
+        self.interval = interval
+        self.lag_warning = lag_warning
+        self.lag = LatencyStats()
+        self.pending_client_requests = 0
+        self.stdin_backlog = 0
+        self.max_stdin_backlog = 0
+        self.incoming = 0           # messages being handled
+        self.max_incoming = 0
+        self.handled = 0            # messages handled since the last sample
+        self._lock = threading.Lock()     # threaded handlers finish on other threads
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.sample(max(0.0, loop.time() - expected))
+
+    def track(self, handler: Callable) -> Callable:
+        """Wrap a message handler to count the messages being handled, generator handlers are returned as is."""
+        if inspect.isgeneratorfunction(handler):
+            return handler
+
+        if asyncio.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def async_wrapper(*args, **kwargs):
+                self._started()
+                try:
+                    return await handler(*args, **kwargs)
+                finally:
+                    self._finished()
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            self._started()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                self._finished()
+        return wrapper
+
+    def _started(self):
+        with self._lock:
+            self.incoming += 1
+            self.max_incoming = max(self.max_incoming, self.incoming)
+
+    def _finished(self):
+        with self._lock:
+            self.incoming -= 1
+            self.handled += 1
+
+    def sample(self, lag: float):
+        """Record one lag sample in seconds together with the current backlog."""
+        self.lag.record(lag)
+        self.pending_client_requests = sum(not future.done() for future in list(self.ls.protocol._request_futures.values()))
+        self.stdin_backlog = _stdin_backlog()
+        self.max_stdin_backlog = max(self.max_stdin_backlog, self.stdin_backlog)
+        with self._lock:
+            handled, self.handled = self.handled, 0
+
+        if self.lag_warning and lag * 1000 >= self.lag_warning:
+            log.warning(
+                f"Event loop blocked for {lag * 1000:.0f}ms, {handled} messages handled since the last sample, "
+                f"{self.incoming} still being handled, {self.stdin_backlog} bytes waiting on stdin, "
+                f"{self.pending_client_requests} requests to the client unanswered"
+            )
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "lag": self.lag.report(),
+            "incoming_in_flight": self.incoming,
+            "max_incoming_in_flight": self.max_incoming,
+            "pending_client_requests": self.pending_client_requests,
+            "stdin_backlog_bytes": self.stdin_backlog,
+            "max_stdin_backlog_bytes": self.max_stdin_backlog,
+        }
+
+
+def _stdin_backlog() -> int:
+    """Number of bytes waiting in the stdin pipe, 0 if it can't be known."""
+    if fcntl is None:
+        return 0
+    try:
+        buf = array.array("i", [0])
+        fcntl.ioctl(sys.stdin.fileno(), termios.FIONREAD, buf)
+        return buf[0]
+    except (OSError, ValueError, AttributeError):
+        return 0
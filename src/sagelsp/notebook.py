@@ -1,83 +1,169 @@
-from dataclasses import dataclass
-from sagelsp import LANGUAGE_ID
+from bisect import bisect_right
+from itertools import accumulate
+from sagelsp import LANGUAGE_ID, SageAvaliable
+from sagelsp.memory_budget import LRUCache
+from sagelsp.tracing import Tracer
 from pygls.lsp.server import LanguageServer
+from pygls.uris import from_fs_path
 from pygls.workspace import TextDocument
 from lsprotocol import types
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 
-@dataclass
-class CellLineMapping:
-    cell_uri: str
-    start_line: int
-    end_line: int
+MAX_NOTEBOOKS = 16
 
-    def contains_line(self, line: int) -> bool:
-        return self.start_line <= line <= self.end_line
+
+class VirtualDocument(TextDocument):
+    """Concatenation of the code cells of a notebook, its source is joined only when read."""
+
+    def __init__(self, notebook: "JupyterNotebook"):
+        super().__init__(uri=notebook.uri, version=notebook.version, language_id=LANGUAGE_ID)
+        self.notebook = notebook
+        self._preparsed_source: Optional[str] = None
+
+    @property
+    def source(self) -> str:
+        if self._source is None:
+            self._source = "\n".join(self.notebook.cell_texts) + "\n"
+        return self._source
+
+    @property
+    def preparsed_source(self) -> str:
+        """Preparsed source, joined from the preparsed cells so only changed cells are preparsed again."""
+        if self._preparsed_source is None:
+            self._preparsed_source = "\n".join(self.notebook.preparsed(i) for i in range(len(self.notebook.cell_uris))) + "\n"
+        return self._preparsed_source
+
+    def invalidate(self, version: int):
+        self.version = version
+        self._source = None
+        self._preparsed_source = None
 
 
 class JupyterNotebook:
+    """Virtual document of a notebook, patched in place when cells change.
+
+    `offsets[i]` is the first virtual line of the i-th code cell, so positions are mapped with `bisect`.
+    """
+
     def __init__(self, ls: LanguageServer, nb: types.NotebookDocument):
         self.ls = ls
-        self.nb = nb
+        self.uri = nb.uri
         self.notebook_type = nb.notebook_type
+        self.cell_uris: List[str] = []
+        self.cell_texts: List[str] = []
+        self.cell_versions: List[Optional[int]] = []
+        self.cell_line_counts: List[int] = []
+        self.offsets: List[int] = []
+        self.cell_index: Dict[str, int] = {}
+        self.preparse_cache: Dict[str, Tuple[Optional[int], str]] = {}      # cell uri -> (version, preparsed text)
+        self.style_cache: Dict[str, Tuple[Tuple[Optional[int], str], List[types.Diagnostic]]] = {}   # cell uri -> ((version, config hash), diagnostics)
+        self.analysis: Dict[str, Any] = {}     # per plugin incremental state, dropped with the notebook
         self.version = nb.version
+        self.virtual_document = VirtualDocument(self)
+        self.update(nb)
+
+    def update(self, nb: types.NotebookDocument) -> List[str]:
+        """Patch the virtual document with the cells that changed. Return the URIs of changed cells."""
+        self.nb = nb
         self.cells = nb.cells
-        self.uri = nb.uri
-        self._get_cell_sources()
-        self._build_virtual_document()
-    
-    def _get_cell_sources(self) -> Dict[str, TextDocument]:
-        """Get the source code of each cell by its document URI."""
-        cell_sources = {}
-        for cell in self.cells:
-            if cell.kind == types.NotebookCellKind.Code:
-                doc = self.ls.workspace.get_text_document(cell.document)
-                cell_sources[cell.document] = doc
-        self.cell_sources = cell_sources
-
-    def _build_virtual_document(self) -> Tuple[TextDocument, List[CellLineMapping]]:
-        """Build a virtual document by concatenating all code cells."""
-        virtual_lines: List[str] = []
-        cell_mappings: List[CellLineMapping] = []
-        for uri, doc in self.cell_sources.items():
-            if doc.language_id != LANGUAGE_ID:
-                continue
+        self.version = nb.version
 
-            source = doc.source
-            source_lines = source.splitlines() or [""]
-            start_line = len(virtual_lines)
-            virtual_lines.extend(source_lines)
-            end_line = len(virtual_lines) - 1
-
-            cell_mappings.append(
-                CellLineMapping(
-                    cell_uri=uri,
-                    start_line=start_line,
-                    end_line=end_line,
-                )
-            )
-
-        self.virtual_document = TextDocument(
-            uri=self.uri,
-            source="\n".join(virtual_lines) + "\n",
-            version=self.version,
-            language_id=LANGUAGE_ID,
-        )
-        self.cell_mappings = cell_mappings
+        cell_uris = []
+        for cell in nb.cells:
+            if cell.kind != types.NotebookCellKind.Code:
+                continue
+            doc = self.ls.workspace.get_text_document(cell.document)
+            if doc.language_id == LANGUAGE_ID:
+                cell_uris.append(cell.document)
+
+        structure_changed = cell_uris != self.cell_uris
+        if structure_changed:
+            old = {uri: i for i, uri in enumerate(self.cell_uris)}
+            self.cell_texts = [self.cell_texts[old[uri]] if uri in old else "" for uri in cell_uris]
+            self.cell_versions = [self.cell_versions[old[uri]] if uri in old else None for uri in cell_uris]
+            self.cell_line_counts = [self.cell_line_counts[old[uri]] if uri in old else 0 for uri in cell_uris]
+            self.cell_uris = cell_uris
+            self.cell_index = {uri: i for i, uri in enumerate(cell_uris)}
+            for cache in (self.style_cache, self.preparse_cache):
+                for uri in list(cache):
+                    if uri not in self.cell_index:
+                        del cache[uri]
+
+        changed = []
+        lines_changed = structure_changed
+        for i, uri in enumerate(cell_uris):
+            doc = self.ls.workspace.get_text_document(uri)
+            if doc.version == self.cell_versions[i] and doc.version is not None:
+                continue
+            source_lines = doc.source.splitlines() or [""]
+            self.cell_texts[i] = "\n".join(source_lines)
+            self.cell_versions[i] = doc.version
+            if len(source_lines) != self.cell_line_counts[i]:
+                self.cell_line_counts[i] = len(source_lines)
+                lines_changed = True
+            changed.append(uri)
+
+        if lines_changed:
+            self.offsets = list(accumulate(self.cell_line_counts, initial=0))[:-1]
+        if changed or structure_changed:
+            self.virtual_document.invalidate(self.version)
+        return changed
+
+    def preparsed(self, i: int) -> str:
+        """Preparsed text of the i-th code cell, cached until the cell changes."""
+        uri, version = self.cell_uris[i], self.cell_versions[i]
+        cached = self.preparse_cache.get(uri)
+        if cached is not None and cached[0] == version and version is not None:
+            return cached[1]
+
+        text = self.cell_texts[i]
+        if SageAvaliable:
+            from sage.repl.preparse import preparse  # type: ignore
+            with Tracer.span("preparse"):
+                text = preparse(text)
+        self.preparse_cache[uri] = (version, text)
+        return text
+
+    def style_diagnostics(
+        self,
+        cell_doc: TextDocument,
+        config_hash: str,
+        lint: Callable[[TextDocument], List[types.Diagnostic]],
+    ) -> List[types.Diagnostic]:
+        """Style diagnostics of a cell, `lint` only runs if the cell or the config changed since last time."""
+        key = (cell_doc.version, config_hash)
+        cached = self.style_cache.get(cell_doc.uri)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        diagnostics = lint(cell_doc)
+        self.style_cache[cell_doc.uri] = (key, diagnostics)
+        return diagnostics
+
+    def approx_size(self) -> int:
+        # Cell texts, the joined source and their preparsed copies
+        return sum(len(text) for text in self.cell_texts) * 4 + len(self.cell_uris) * 200
 
     def map_position(self, position: types.Position) -> Optional[Tuple[str, types.Position]]:
         """Map a virtual document position back to a notebook cell position."""
-        for mapping in self.cell_mappings:
-            if mapping.contains_line(position.line):
-                return (
-                    mapping.cell_uri,
-                    types.Position(
-                        line=position.line - mapping.start_line,
-                        character=position.character,
-                    ),
-                )
-        return None
+        i = bisect_right(self.offsets, position.line) - 1
+        if i < 0 or position.line >= self.offsets[i] + self.cell_line_counts[i]:
+            return None
+        return (
+            self.cell_uris[i],
+            types.Position(
+                line=position.line - self.offsets[i],
+                character=position.character,
+            ),
+        )
+
+    def to_virtual_position(self, cell_uri: str, position: types.Position) -> Optional[types.Position]:
+        """Map a position in a notebook cell to the virtual document."""
+        i = self.cell_index.get(cell_uri)
+        if i is None:
+            return None
+        return types.Position(line=self.offsets[i] + position.line, character=position.character)
 
     def map_range(self, virtual_range: types.Range) -> Optional[Tuple[str, types.Range]]:
         """Map a virtual document range back to a notebook cell range."""
@@ -98,6 +184,22 @@ class JupyterNotebook:
             types.Range(start=start, end=end),
         )
 
+    def map_locations(self, locations: List[types.Location]) -> List[types.Location]:
+        """Map locations in the virtual document back to notebook cells, other locations are kept."""
+        virtual_uris = {self.uri}
+        if self.virtual_document.path:
+            virtual_uris.add(from_fs_path(self.virtual_document.path))
+
+        mapped_locations = []
+        for location in locations:
+            if location.uri not in virtual_uris:
+                mapped_locations.append(location)
+                continue
+            mapped = self.map_range(location.range)
+            if mapped is not None:
+                mapped_locations.append(types.Location(uri=mapped[0], range=mapped[1]))
+        return mapped_locations
+
     def map_diagnostic(self, virtual_diagnostic: types.Diagnostic) -> Optional[Tuple[str, types.Diagnostic]]:
         """Map a single diagnostic from the virtual document back to a notebook cell."""
         mapped_range = self.map_range(virtual_diagnostic.range)
@@ -112,7 +214,7 @@ class JupyterNotebook:
     def map_diagnostics(self, virtual_diagnostics: List[types.Diagnostic]) -> Dict[str, List[types.Diagnostic]]:
         """Map diagnostics from the virtual document back to the original notebook cells."""
         diagnostics_by_cell: Dict[str, List[types.Diagnostic]] = {
-            mapping.cell_uri: [] for mapping in self.cell_mappings
+            cell_uri: [] for cell_uri in self.cell_uris
         }
 
         for diagnostic in virtual_diagnostics:
@@ -133,4 +235,18 @@ class JupyterNotebook:
                 if cell_uri not in merged:
                     merged[cell_uri] = []
                 merged[cell_uri].extend(diags)
-        return merged
\ No newline at end of file
+        return merged
+
+Notebooks = LRUCache("notebooks", maxsize=MAX_NOTEBOOKS, sizeof=lambda notebook: notebook.approx_size())
+
+
+def get_notebook(ls: LanguageServer, nb: types.NotebookDocument) -> JupyterNotebook:
+    """Get the persistent virtual document of a notebook, patched to its current cells."""
+    notebook = Notebooks.get(nb.uri)
+    if notebook is None:
+        notebook = JupyterNotebook(ls, nb)
+    else:
+        notebook.update(nb)
+    # Put it again to refresh its accounted size
+    Notebooks.put(nb.uri, notebook)
+    return notebook
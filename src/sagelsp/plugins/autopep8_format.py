@@ -1,14 +1,48 @@
+import argparse
 import autopep8
+import bisect
+import difflib
+import hashlib
+import json
 import logging
+import pycodestyle
+import re
+import tokenize
+from dataclasses import dataclass
 from sagelsp import hookimpl
 from sagelsp.config import StyleConfig
+from sagelsp.document_state import DocumentStates
+from sagelsp.memory_budget import LRUCache
 
 from pygls.workspace import TextDocument
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
 from lsprotocol import types
 
 log = logging.getLogger(__name__)
 
+
+FORMAT_DIFF_MAX_LINES = 20000       # above this many lines, the whole document is replaced instead of diffed
+DIFF_MATCHER_LIMIT = 250_000        # largest product of line counts of a block diffed with difflib
+FORMAT_CACHE_SIZE = 32              # formatting results kept
+
+# Unindented lines continuing the statement above
+CONTINUED_STATEMENT = re.compile(r"(else|elif|except|finally)\b")
+# Logical lines whose colon completes them
+BLOCK_HEADER = re.compile(r"\s*(async\s+)?(if|elif|else|for|while|try|except|finally|with|def|class|match|case)\b")
+
+
+# (source hash, options hash, notebook, line range) -> formatted source, None if unchanged
+FormatCache = LRUCache("autopep8.format", maxsize=FORMAT_CACHE_SIZE)
+_MISSING = object()
+
+
+@dataclass
+class TokenState:
+    """Logical line starts of a document version, kept in its `DocumentState`."""
+    version: Optional[int]
+    starts: List[int]
+
+
 @hookimpl
 def sagelsp_format_document(doc: TextDocument, config: StyleConfig, notebook: bool) -> List[types.TextEdit]:
     """Format the document using autopep8."""
@@ -21,27 +55,135 @@ def sagelsp_format_range(doc: TextDocument, start_line: int, end_line: int, conf
     return _format(doc, config, notebook=notebook, line_range=[start_line, end_line])
 
 
+@hookimpl
+def sagelsp_format_on_type(doc: TextDocument, position: types.Position, ch: str, config: StyleConfig, notebook: bool) -> List[types.TextEdit]:
+    """Format the logical line completed by a newline or by the colon of a block header.
+
+    Only that line is checked and fixed, with options parsed once, so the latency
+    doesn't depend on the size of the document.
+    """
+    source = doc.source.replace("\r\n", "\n").replace("\r", "\n")
+    lines = source.splitlines(keepends=True)
+    end = position.line - 1 if ch == "\n" else position.line
+    if not 0 <= end < len(lines) or not lines[end].strip():
+        return []
+    if ch == ":" and not lines[end].rstrip().endswith(":"):
+        return []
+
+    starts = _logical_starts(doc, lines)
+    i = bisect.bisect_right(starts, end) - 1 if starts is not None else -1
+    if i < 0:
+        return []
+    first = starts[i]
+    if ch == ":" and not BLOCK_HEADER.match(lines[first]):
+        return []
+
+    # Check the logical line alone, dedented
+    indent = lines[first][:len(lines[first]) - len(lines[first].lstrip())]
+    if any(line.strip() and not line.startswith(indent) for line in lines[first:end + 1]):
+        return []
+    text = "".join(lines[first:end + 1])
+    snippet = [line[len(indent):] if line.startswith(indent) else line for line in lines[first:end + 1]]
+    missing_newline = not snippet[-1].endswith("\n")
+    if missing_newline:
+        snippet[-1] += "\n"
+    if not _tokenizes(snippet):
+        # The line goes on, e.g. in brackets
+        return []
+
+    options, style = config.get_autopep8_options(notebook)
+    fixed = _fix_lines(snippet, options, style)
+    if fixed is None:
+        return []
+    new_text = "".join(indent + line if line.strip() else line for line in fixed)
+    if missing_newline:
+        new_text = new_text[:-1]
+
+    edits = []
+    for edit in minimal_edits(text, new_text):
+        edit.range.start.line += first
+        edit.range.end.line += first
+        edits.append(edit)
+    log.debug(f"Formatted line {first + 1} of {doc.uri} on type, {len(edits)} edits")
+    return edits
+
+
+def _fix_lines(lines: List[str], options: argparse.Namespace, style: pycodestyle.StyleGuide) -> Optional[List[str]]:
+    """Fix lines like `autopep8.fix_lines`, checking them with a prebuilt StyleGuide instead of one per pass.
+
+    Global fixes are skipped, as autopep8 does with a line range. Return None if nothing is reported.
+    """
+    source = "".join(lines)
+    try:
+        fixed = _fix_source(source, options, style)
+    except (AttributeError, TypeError):
+        # `FixPEP8._fix_source` is private, fall back to the public API if it changed
+        log.debug("autopep8 internals changed, fixing lines with autopep8.fix_lines", exc_info=True)
+        fixed = autopep8.fix_lines(lines, options)
+    if fixed == source:
+        return None
+    return fixed.splitlines(keepends=True)
+
+
+def _fix_source(source: str, options: argparse.Namespace, style: pycodestyle.StyleGuide) -> str:
+    checked = set()
+    long_line_ignore_cache = set()
+    while hash(source) not in checked:
+        checked.add(hash(source))
+        checker = pycodestyle.Checker(lines=source.splitlines(keepends=True), options=style.options, report=FixReport(style.options))
+        checker.check_all()
+        if not checker.report.results:
+            break
+        fixer = autopep8.FixPEP8("", options, contents=source, long_line_ignore_cache=long_line_ignore_cache)
+        fixer._fix_source(autopep8.filter_results(source=source, results=checker.report.results, aggressive=options.aggressive))
+        source = "".join(fixer.source)
+    return source
+
+
+class FixReport(pycodestyle.BaseReport):
+    """Collect errors in the form `autopep8.FixPEP8` fixes."""
+
+    def __init__(self, options) -> None:
+        super().__init__(options)
+        self.results = []
+
+    def error(self, line_number, offset, text, check):
+        code = super().error(line_number, offset, text, check)
+        if code:
+            self.results.append({"id": code, "line": line_number, "column": offset + 1, "info": text})
+        return code
+
+
 def _format(doc: TextDocument, config: StyleConfig, notebook: bool, line_range: List[int] = None) -> List[types.TextEdit]:
+    """Format the document, or only the lines of `line_range` (0-based, inclusive)."""
     if line_range:
         log.info(f"Formatting document {doc.uri} from line {line_range[0]} to {line_range[1]} with autopep8")
     else:
         log.info(f"Formatting document {doc.uri} with autopep8")
     source = doc.source
     source = source.replace("\r\n", "\n").replace("\r", "\n")
-    
-    # Load configuration from global and project sources
-    if notebook:
-        config = config.get_notebook_autopep8_config(line_range=line_range)
-    else:
-        config = config.get_autopep8_config(line_range=line_range)
+    sagelsp_config = config.get_sagelsp_config()
+
+    if line_range:
+        lines = source.splitlines(keepends=True)
+        start, end = line_range[0], min(line_range[1], len(lines) - 1)
+        starts = _statement_starts(doc, lines)
+        if starts is not None:
+            return _format_region(doc, lines, _enclosing_region(lines, starts, start, end), start, end, config, notebook)
+        # Statements are unknown, let autopep8 restrict its fixes on the whole document
+        line_range = [start + 1, end + 1]
 
-    new_source = autopep8.fix_code(source, options=config)
+    # Load configuration from global and project sources
+    options = _autopep8_options(config, notebook, line_range)
+    new_source = _fix_code(source, options, notebook)
 
     if new_source == source:
         log.info(f"No formatting changes needed for document {doc.uri}")
         return []
-    else:
-        log.info(f"Document {doc.uri} formatted with autopep8")
+
+    max_lines = sagelsp_config.get("format_diff_max_lines")
+    if len(doc.lines) > (FORMAT_DIFF_MAX_LINES if max_lines is None else max_lines):
+        log.info(f"Document {doc.uri} formatted with autopep8, replaced as a whole")
         return [types.TextEdit(
             range=types.Range(
                 start=types.Position(line=0, character=0),
@@ -49,3 +191,346 @@ def _format(doc: TextDocument, config: StyleConfig, notebook: bool, line_range:
             ),
             new_text=new_source
         )]
+
+    edits = minimal_edits(source, new_source)
+    log.info(f"Document {doc.uri} formatted with autopep8, {len(edits)} edits")
+    return edits
+
+
+def _fix_code(source: str, options: Dict[str, Any], notebook: bool) -> str:
+    """`autopep8.fix_code` with results cached by content, options, notebook flag and line range.
+
+    Unchanged results are stored as None, so formatting an already formatted text again costs a hash.
+    """
+    line_range = options.get("line_range")
+    key = (
+        hashlib.sha1(source.encode()).hexdigest(),
+        hashlib.sha1(json.dumps(options, sort_keys=True, default=str).encode()).hexdigest(),
+        notebook,
+        tuple(line_range) if line_range else None,
+    )
+    fixed = FormatCache.get(key, _MISSING)
+    if fixed is _MISSING:
+        fixed = autopep8.fix_code(source, options=options)
+        FormatCache.put(key, None if fixed == source else fixed)
+        return fixed
+    log.debug("Formatting result found in cache")
+    return source if fixed is None else fixed
+
+
+def _autopep8_options(config: StyleConfig, notebook: bool, line_range: Optional[List[int]]) -> Dict:
+    if notebook:
+        return config.get_notebook_autopep8_config(line_range=line_range)
+    return config.get_autopep8_config(line_range=line_range)
+
+
+def _format_region(doc: TextDocument, lines: List[str], region: Tuple[int, int, int], start: int, end: int, config: StyleConfig, notebook: bool) -> List[types.TextEdit]:
+    """Format the top level statements `lines[first:stop]` around the selected lines `start` to `end`.
+
+    The statement from line `context` before them is formatted too, so autopep8 sees the blank
+    lines above the selection (E301-E305). If autopep8 changes it, the statements are formatted
+    without it.
+    """
+    context, first, stop = region
+    end = min(end, stop - 1)
+    if start > end:
+        # Only blank lines between statements are selected
+        return []
+
+    if context < first:
+        gap = first
+        while gap > context + 1 and _blank_or_comment(lines[gap - 1]):
+            gap -= 1
+        edits = _fix_region(lines, context, gap, stop, start, end, config, notebook)
+        if edits is not None:
+            log.info(f"Lines {context} to {stop - 1} of {doc.uri} formatted with autopep8, {len(edits)} edits")
+            return edits
+        log.debug(f"autopep8 changed line {context} before the selection, formatting without it")
+
+    edits = _fix_region(lines, first, first, stop, start, end, config, notebook)
+    log.info(f"Lines {first} to {stop - 1} of {doc.uri} formatted with autopep8, {len(edits)} edits")
+    return edits
+
+
+def _fix_region(lines: List[str], first: int, gap: int, stop: int, start: int, end: int, config: StyleConfig, notebook: bool) -> Optional[List[types.TextEdit]]:
+    """Edits of autopep8 on `lines[first:stop]` fixing lines `start` to `end`.
+
+    The lines before `gap` are context, None if autopep8 changed them. The edits are not cut to
+    the selected lines, autopep8 already restricts its fixes to them and a diff of the region
+    may align a fix with the lines around it.
+    """
+    text = "".join(lines[first:stop])
+    options = _autopep8_options(config, notebook, [start - first + 1, end - first + 1])
+    new_lines = _fix_code(text, options, notebook).splitlines(keepends=True)
+    if new_lines[:gap - first] != lines[first:gap]:
+        return None
+
+    edits = minimal_edits("".join(lines[gap:stop]), "".join(new_lines[gap - first:]))
+    for edit in edits:
+        edit.range.start.line += gap
+        edit.range.end.line += gap
+    return edits
+
+
+def _statement_starts(doc: TextDocument, lines: List[str]) -> Optional[List[int]]:
+    """First lines (0-based) of the unindented logical lines, None if they are unknown.
+
+    The starts kept by pycodestyle are used when it checked this version already.
+    """
+    state = DocumentStates.get(doc.uri)
+    style_state = state.analysis.get("pycodestyle") if state is not None else None
+    if style_state is not None and style_state.version == doc.version:
+        return style_state.starts
+
+    starts = _logical_starts(doc, lines)
+    if starts is None:
+        return None
+    return [start for start in starts if _unindented(lines[start])]
+
+
+def _logical_starts(doc: TextDocument, lines: List[str]) -> Optional[List[int]]:
+    """First lines (0-based) of all logical lines, None if they are unknown.
+
+    They are kept in the document state and only the statements around the lines edited
+    since the last call are tokenized again.
+    """
+    state = DocumentStates.get(doc.uri)
+    previous = state.analysis.get("autopep8") if state is not None else None
+    if previous is not None and previous.version == doc.version:
+        return previous.starts
+
+    starts = None
+    if previous is not None:
+        edits = state.edits_since(previous.version)
+        if edits is not None:
+            starts = _tokenize_edited(lines, previous.starts, edits)
+    if starts is None:
+        starts = _tokenize_starts(lines, 0, len(lines))
+        log.debug(f"Tokenized all {len(lines)} lines of {doc.uri}")
+    if state is not None and starts is not None:
+        state.analysis["autopep8"] = TokenState(doc.version, starts)
+    return starts
+
+
+def _tokenize_edited(lines: List[str], starts: List[int], edits: List[Tuple[int, int, int]]) -> Optional[List[int]]:
+    """Shift logical line starts through line edits and tokenize the unindented statements around the edited lines again."""
+    lo = hi = None      # edited lines in the current text
+    for first, last, added in edits:
+        delta = added - (last - first)
+        starts = [start + delta if start > last else start for start in starts if not first <= start <= last]
+        if lo is None:
+            lo, hi = first, first + added
+        else:
+            lo = min(lo + delta if lo > last else lo, first)
+            hi = max(hi + delta if hi > last else hi, first + added)
+    if lo is None:
+        return starts
+    if starts and starts[-1] >= len(lines):
+        # Edits don't match the text
+        return None
+
+    i = bisect.bisect_right(starts, lo)
+    while i > 0 and not _unindented(lines[starts[i - 1]]):
+        i -= 1
+    first = starts[i - 1] if i > 0 else 0
+    j = bisect.bisect_right(starts, hi)
+    while j < len(starts) and not _unindented(lines[starts[j]]):
+        j += 1
+    stop = starts[j] if j < len(starts) else len(lines)
+
+    tokenized = _tokenize_starts(lines, first, stop)
+    if tokenized is None:
+        return None
+    return [start for start in starts if start < first] + tokenized + [start for start in starts if start >= stop]
+
+
+def _tokenize_starts(lines: List[str], first: int, stop: int) -> Optional[List[int]]:
+    """First lines of the logical lines in `lines[first:stop]`, None if they don't tokenize alone.
+
+    At the end of the document, the starts before an error are kept, e.g. while a bracket is open.
+    """
+    starts = []
+    at_start = True
+    depth = 0
+    try:
+        for token in tokenize.generate_tokens(iter(lines[first:stop]).__next__):
+            if token.type == tokenize.NEWLINE:
+                at_start = True
+            elif token.type == tokenize.OP and token.string in "([{}])":
+                # tokenize doesn't report unmatched closing brackets
+                depth += 1 if token.string in "([{" else -1
+                if depth < 0:
+                    raise tokenize.TokenError("unmatched bracket", token.start)
+            if at_start and token.type not in (tokenize.NEWLINE, tokenize.NL, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER):
+                starts.append(first + token.start[0] - 1)
+                at_start = False
+    except (tokenize.TokenError, SyntaxError):
+        return starts if stop == len(lines) else None
+    return starts
+
+
+def _tokenizes(lines: List[str]) -> bool:
+    try:
+        for _ in tokenize.generate_tokens(iter(lines).__next__):
+            pass
+    except (tokenize.TokenError, SyntaxError):
+        return False
+    return True
+
+
+def _blank_or_comment(line: str) -> bool:
+    return not line.strip() or line.startswith("#")
+
+
+def _unindented(line: str) -> bool:
+    return line[:1] not in (" ", "\t")
+
+
+def _enclosing_region(lines: List[str], starts: List[int], start: int, end: int) -> Tuple[int, int, int]:
+    """Lines `[first, stop)` of the top level statements enclosing lines `start` to `end`, and the
+    first line `context` of the statement before them, 0 if there is none.
+
+    Trailing blank lines are left out, as autopep8 would strip them at the end of the text.
+    """
+    i = bisect.bisect_right(starts, start) - 1
+    while i > 0 and CONTINUED_STATEMENT.match(lines[starts[i]]):
+        i -= 1
+    first = starts[i] if i >= 0 else 0
+
+    c = i - 1
+    while c > 0 and CONTINUED_STATEMENT.match(lines[starts[c]]):
+        c -= 1
+    context = starts[c] if c >= 0 else 0
+
+    j = bisect.bisect_right(starts, end)
+    while j < len(starts) and CONTINUED_STATEMENT.match(lines[starts[j]]):
+        j += 1
+    stop = starts[j] if j < len(starts) else len(lines)
+    if stop < len(lines):
+        while stop > first + 1 and not lines[stop - 1].strip():
+            stop -= 1
+    return context, first, stop
+
+
+def minimal_edits(source: str, new_source: str) -> List[types.TextEdit]:
+    """Edits turning `source` into `new_source`, diffed by lines then within the replaced lines."""
+    lines = source.splitlines(keepends=True)
+    new_lines = new_source.splitlines(keepends=True)
+
+    edits = []
+    for i1, i2, j1, j2 in _diff_lines(lines, new_lines):
+        if i2 - i1 == j2 - j1:
+            # Lines changed in place, e.g. by whitespace fixes: keep only the changed characters
+            for i, j in zip(range(i1, i2), range(j1, j2)):
+                edits.append(_line_edit(lines, i, new_lines[j]))
+            continue
+        edits.append(types.TextEdit(
+            range=types.Range(start=_position(lines, i1, 0), end=_position(lines, i2, 0)),
+            new_text="".join(new_lines[j1:j2]),
+        ))
+    return edits
+
+
+def _diff_lines(a: List[str], b: List[str]) -> List[Tuple[int, int, int, int]]:
+    """Changed blocks `(i1, i2, j1, j2)` where `a[i1:i2]` becomes `b[j1:j2]`, in order.
+
+    Patience diff: lines occurring once in both sides anchor the diff, the gaps between
+    anchors are diffed again. Gaps without anchors go to `difflib` if small enough, which
+    is quadratic on files with many repeated lines, and are replaced as a whole otherwise.
+    """
+    blocks = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        a0, a1, b0, b1 = stack.pop()
+        while a0 < a1 and b0 < b1 and a[a0] == b[b0]:
+            a0, b0 = a0 + 1, b0 + 1
+        while a0 < a1 and b0 < b1 and a[a1 - 1] == b[b1 - 1]:
+            a1, b1 = a1 - 1, b1 - 1
+        if a0 == a1 or b0 == b1:
+            if a0 < a1 or b0 < b1:
+                blocks.append((a0, a1, b0, b1))
+            continue
+
+        anchors = _unique_anchors(a, b, a0, a1, b0, b1)
+        if anchors:
+            # Gaps are pushed last to first, so blocks come out in order
+            gaps = []
+            for i, j in anchors:
+                gaps.append((a0, i, b0, j))
+                a0, b0 = i + 1, j + 1
+            gaps.append((a0, a1, b0, b1))
+            stack.extend(reversed(gaps))
+        elif (a1 - a0) * (b1 - b0) <= DIFF_MATCHER_LIMIT:
+            matcher = difflib.SequenceMatcher(None, a[a0:a1], b[b0:b1], autojunk=False)
+            blocks.extend(
+                (a0 + i1, a0 + i2, b0 + j1, b0 + j2)
+                for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"
+            )
+        else:
+            blocks.append((a0, a1, b0, b1))
+    return blocks
+
+
+def _unique_anchors(a: List[str], b: List[str], a0: int, a1: int, b0: int, b1: int) -> List[Tuple[int, int]]:
+    """Longest increasing sequence of `(i, j)` where `a[i] == b[j]` occurs once in both ranges."""
+    counts: Dict[str, List[int]] = {}
+    for i in range(a0, a1):
+        entry = counts.setdefault(a[i], [0, 0, i, 0])
+        entry[0] += 1
+    for j in range(b0, b1):
+        entry = counts.get(b[j])
+        if entry is not None:
+            entry[1] += 1
+            entry[3] = j
+    pairs = sorted((i, j) for count_a, count_b, i, j in counts.values() if count_a == 1 and count_b == 1)
+
+    # Patience sorting on j, keeping the predecessor of each pair
+    tails: List[int] = []
+    tail_indexes: List[int] = []
+    previous: List[int] = []
+    for index, (_, j) in enumerate(pairs):
+        k = bisect.bisect_left(tails, j)
+        if k == len(tails):
+            tails.append(j)
+            tail_indexes.append(index)
+        else:
+            tails[k] = j
+            tail_indexes[k] = index
+        previous.append(tail_indexes[k - 1] if k else -1)
+
+    anchors = []
+    index = tail_indexes[-1] if tail_indexes else -1
+    while index >= 0:
+        anchors.append(pairs[index])
+        index = previous[index]
+    anchors.reverse()
+    return anchors
+
+
+def _line_edit(lines: List[str], i: int, new_line: str) -> types.TextEdit:
+    """Edit of the characters that differ between line `i` and `new_line`, keeping common prefix and suffix."""
+    line = lines[i]
+    size = min(len(line), len(new_line))
+    prefix = 0
+    while prefix < size and line[prefix] == new_line[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < size - prefix and line[-1 - suffix] == new_line[-1 - suffix]:
+        suffix += 1
+    return types.TextEdit(
+        range=types.Range(start=_position(lines, i, prefix), end=_position(lines, i, len(line) - suffix)),
+        new_text=new_line[prefix:len(new_line) - suffix],
+    )
+
+
+def _position(lines: List[str], i: int, offset: int) -> types.Position:
+    """Position of the character `offset` of line `i`, in UTF-16 code units."""
+    if i < len(lines) and offset == len(lines[i]) and lines[i].endswith("\n"):
+        i, offset = i + 1, 0
+    if i >= len(lines):
+        # End of the document, after its last line if that has no newline
+        if not lines or lines[-1].endswith("\n"):
+            return types.Position(line=len(lines), character=0)
+        i, offset = len(lines) - 1, len(lines[-1])
+    text = lines[i][:offset]
+    return types.Position(line=i, character=len(text.encode("utf-16-le")) // 2)
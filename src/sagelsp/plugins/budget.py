@@ -0,0 +1,80 @@
+from typing import Dict, Optional, Tuple
+import threading
+import time
+
+
+BREAKER_THRESHOLD = 3       # consecutive timeouts before a hook implementation is tripped off
+BREAKER_COOLDOWN = 60.0     # seconds a tripped hook implementation stays disabled
+
+
+class TimeBudget:
+    """Deadlines of hook implementations in seconds, 0 means no deadline.
+
+    Overrides are keyed by `plugin.hook`, `plugin` or `hook`, looked up in this order.
+    """
+
+    def __init__(self, default: float = 0.0, overrides: Optional[Dict[str, float]] = None):
+        self.default = default
+        self.overrides = overrides or {}
+
+    def get(self, hook_name: str, plugin_name: str) -> float:
+        for key in (f"{plugin_name}.{hook_name}", plugin_name, hook_name):
+            if key in self.overrides:
+                return self.overrides[key]
+        return self.default
+
+    @property
+    def enabled(self) -> bool:
+        return self.default > 0 or any(timeout > 0 for timeout in self.overrides.values())
+
+
+class CircuitBreaker:
+    """Disable hook implementations that keep exceeding their budget for a cooldown period."""
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures: Dict[Tuple[str, str], int] = {}
+        self._opened: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, hook_name: str, plugin_name: str) -> bool:
+        """Return False while the breaker of a hook implementation is open.
+
+        After the cooldown one more call is let through, another timeout trips it again right away.
+        """
+        key = (hook_name, plugin_name)
+        with self._lock:
+            opened = self._opened.get(key)
+            if opened is None:
+                return True
+            if time.monotonic() - opened < self.cooldown:
+                return False
+            del self._opened[key]
+            self._failures[key] = self.threshold - 1
+            return True
+
+    def success(self, hook_name: str, plugin_name: str):
+        with self._lock:
+            self._failures.pop((hook_name, plugin_name), None)
+
+    def failure(self, hook_name: str, plugin_name: str) -> bool:
+        """Count a timeout. Return True if it tripped the breaker."""
+        key = (hook_name, plugin_name)
+        with self._lock:
+            failures = self._failures.get(key, 0) + 1
+            self._failures[key] = failures
+            if failures < self.threshold:
+                return False
+            self._opened[key] = time.monotonic()
+            return True
+
+    def report(self) -> Dict[str, float]:
+        """Return remaining cooldown seconds of open breakers, keyed by `plugin.hook`."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                f"{plugin_name}.{hook_name}": round(self.cooldown - (now - opened), 3)
+                for (hook_name, plugin_name), opened in self._opened.items()
+                if now - opened < self.cooldown
+            }
@@ -2,6 +2,7 @@ import jedi
 import logging
 
 from sagelsp import hookimpl, SageAvaliable
+from sagelsp.tracing import Tracer
 from .sage_utils import _sage_preparse
 from .jedi_utils import _doc_prase
 
@@ -49,8 +50,10 @@ def sagelsp_completion(doc: TextDocument, position: types.Position) -> List[type
     line = position.line
     character = position.character
 
-    script = jedi.Script(code=source, path=path)  # Jedi uses 1-based indexing
-    completions: List[Completion] = script.complete(line=line + 1, column=character)
+    with Tracer.span("jedi.Script", "jedi"):
+        script = jedi.Script(code=source, path=path)  # Jedi uses 1-based indexing
+    with Tracer.span("jedi.complete", "jedi"):
+        completions: List[Completion] = script.complete(line=line + 1, column=character)
 
     completion_items = []
     for c in completions:
@@ -1,8 +1,9 @@
 from lsprotocol import types
 from typing import List, Tuple
-from functools import lru_cache
 
 from pygls.uris import from_fs_path
+from sagelsp.tracing import Tracer
+from sagelsp.memory_budget import cached
 import inspect
 import json
 import logging
@@ -11,6 +12,17 @@ import os
 log = logging.getLogger(__name__)
 
 
+TREE_BYTES_PER_CHAR = 50    # rough size of a parsed tree per character of source
+
+
+def _tree_size(tree: dict, file_path: str) -> int:
+    """Approximate size of the parse tree of a file, estimated from the file size."""
+    try:
+        return os.path.getsize(file_path) * TREE_BYTES_PER_CHAR
+    except OSError:
+        return 0
+
+
 class JSONEncoder(json.JSONEncoder):
     # Only include whitelisted attributes to avoid excessive data
     WHITELIST = {
@@ -46,7 +58,8 @@ class JSONEncoder(json.JSONEncoder):
         return str(obj)
 
 
-@lru_cache()
+@cached("cython_utils.cython_prase", sizeof=_tree_size)
+@Tracer.traced("cython.cython_prase", "cython")
 def cython_prase(file_path: str) -> dict:
     """Parse a Cython file into a JSON-like dict structure"""
     from types import SimpleNamespace
@@ -173,7 +186,8 @@ def locate_symbol(tree: dict, node: dict, symbol_name: str, file_path: str) -> T
     return None, None
 
 
-@lru_cache()
+@cached("cython_utils.definition")
+@Tracer.traced("cython.definition", "cython")
 def definition(file_path: str, symbol_name: str) -> List[types.Location]:
     """Find the definition location of a symbol from .pyx file"""
     tree = cython_prase(file_path)
@@ -189,7 +203,8 @@ def definition(file_path: str, symbol_name: str) -> List[types.Location]:
     return locations
 
 
-@lru_cache()
+@cached("cython_utils.signature")
+@Tracer.traced("cython.signature", "cython")
 def signature(file_path: str, symbol_name: str) -> str:
     """Find the signature of a symbol from .pyx file"""
     tree = cython_prase(file_path)
@@ -262,7 +277,8 @@ def signature(file_path: str, symbol_name: str) -> str:
         return f"cdef {func_base_type} {node_name}({', '.join(args)})"
 
 
-@lru_cache()
+@cached("cython_utils.docstring")
+@Tracer.traced("cython.docstring", "cython")
 def docstring(file_path: str, symbol_name: str) -> str:
     """Find the docstring of a symbol from .pyx file"""
     tree = cython_prase(file_path)
@@ -277,7 +293,8 @@ def docstring(file_path: str, symbol_name: str) -> str:
     return ""
 
 
-@lru_cache()
+@cached("cython_utils.docstring_module")
+@Tracer.traced("cython.docstring_module", "cython")
 def docstring_module(file_path: str) -> str:
     """Find the module docstring from .pyx file"""
     tree = cython_prase(file_path)
@@ -3,6 +3,7 @@ from jedi.api import classes
 import logging
 
 from sagelsp import hookimpl, SageAvaliable
+from sagelsp.tracing import Tracer
 from .cython_utils import (
     pyx_path,
     definition as cython_definition
@@ -25,12 +26,13 @@ def _resolve_definition(name: classes.Name, script: jedi.Script) -> classes.Name
         if name.is_definition():
             break
 
-        defs = script.goto(
-            line=name.line,
-            column=name.column,
-            follow_imports=True,
-            follow_builtin_imports=True,
-        )
+        with Tracer.span("jedi.goto", "jedi"):
+            defs = script.goto(
+                line=name.line,
+                column=name.column,
+                follow_imports=True,
+                follow_builtin_imports=True,
+            )
 
         if len(defs) != 1:
             break
@@ -63,13 +65,15 @@ def sagelsp_definition(doc: TextDocument, position: types.Position) -> List[type
     character = position.character
 
     try:
-        script = jedi.Script(code=source, path=path)
-        names = script.goto(
-            line=line + 1,          # Jedi is 1-based
-            column=character,
-            follow_imports=True,
-            follow_builtin_imports=True,
-        )
+        with Tracer.span("jedi.Script", "jedi"):
+            script = jedi.Script(code=source, path=path)
+        with Tracer.span("jedi.goto", "jedi"):
+            names = script.goto(
+                line=line + 1,          # Jedi is 1-based
+                column=character,
+                follow_imports=True,
+                follow_builtin_imports=True,
+            )
     except Exception as e:
         log.error(f"jedi.Script.goto failed for {doc.uri} at line {line + 1}, char {character}: {e}")
         return []
@@ -94,10 +98,11 @@ def sagelsp_definition(doc: TextDocument, position: types.Position) -> List[type
                 symbol_name = m.group()
                 break
 
-        from sagelsp.plugins.pyflakes_lint import ALL_NAMES_URI  # type: ignore
+        from sagelsp.document_state import DocumentStates
 
-        if doc.uri in ALL_NAMES_URI and symbol_name is not None:
-            undefined_names = ALL_NAMES_URI[doc.uri]
+        state = DocumentStates.get(doc.uri)
+        if state is not None and symbol_name is not None:
+            undefined_names = state.all_names
             if symbol_name in undefined_names:
                 path = pyx_path(undefined_names[symbol_name])
                 if path:
@@ -132,11 +137,13 @@ def sagelsp_type_definition(doc: TextDocument, position: types.Position) -> List
     character = position.character
 
     try:
-        script = jedi.Script(code=source, path=path)
-        inferred_names: List[classes.Name] = script.infer(
-            line=line + 1,
-            column=character,
-        )
+        with Tracer.span("jedi.Script", "jedi"):
+            script = jedi.Script(code=source, path=path)
+        with Tracer.span("jedi.infer", "jedi"):
+            inferred_names: List[classes.Name] = script.infer(
+                line=line + 1,
+                column=character,
+            )
     except Exception as e:
         log.error(f"jedi.Script.infer failed for {doc.uri} at line {line + 1}, char {character}: {e}")
         return []
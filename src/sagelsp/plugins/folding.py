@@ -4,6 +4,7 @@ import parso
 import parso.python.tree as tree_nodes
 
 from sagelsp import hookimpl, SageAvaliable, LANGUAGE_ID
+from sagelsp.tracing import Tracer
 
 from pygls.workspace import TextDocument
 from typing import List
@@ -20,7 +21,8 @@ def sagelsp_folding_range(doc: TextDocument) -> List[types.FoldingRange]:
     program = doc.source + "\n"
     if SageAvaliable and (doc.uri.endswith(".sage") or doc.language_id == LANGUAGE_ID):
         from sage.repl.preparse import preparse  # type: ignore
-        program = preparse(program)
+        with Tracer.span("preparse"):
+            program = preparse(program)
     lines = program.splitlines()
     tree = parso.parse(program)
     ranges = __compute_folding_ranges(tree, lines)
@@ -34,6 +34,12 @@ def sagelsp_format_range(doc: TextDocument, start_line: int, end_line: int, conf
     pass
 
 
+@hookspec
+def sagelsp_format_on_type(doc: TextDocument, position: types.Position, ch: str, config: StyleConfig, notebook: bool) -> List[types.TextEdit]:
+    """Format the logical line completed by typing `ch` before `position`."""
+    pass
+
+
 @hookspec
 def sagelsp_definition(doc: TextDocument, position: types.Position) -> List[types.Location]:
     """Provide definition for a symbol."""
@@ -2,6 +2,7 @@ import jedi
 import logging
 
 from sagelsp import hookimpl, SageAvaliable
+from sagelsp.tracing import Tracer
 from .cython_utils import (
     pyx_path,
     docstring as cython_docstring,
@@ -92,15 +93,18 @@ def sagelsp_hover(doc: TextDocument, position: types.Position) -> types.Hover:
     character = position.character
 
     try:
-        script = jedi.Script(code=source, path=path)
-        names: List[classes.Name] = script.infer(
-            line=line + 1,          # Jedi is 1-based
-            column=character
-        )
-        definitions = script.goto(
-            line=line + 1,
-            column=character,
-        )
+        with Tracer.span("jedi.Script", "jedi"):
+            script = jedi.Script(code=source, path=path)
+        with Tracer.span("jedi.infer", "jedi"):
+            names: List[classes.Name] = script.infer(
+                line=line + 1,          # Jedi is 1-based
+                column=character
+            )
+        with Tracer.span("jedi.goto", "jedi"):
+            definitions = script.goto(
+                line=line + 1,
+                column=character,
+            )
     except Exception as e:
         log.error(f"jedi.Script.infer failed for {doc.uri} at line {line + 1}, char {character}: {e}")
         return None
@@ -110,10 +114,11 @@ def sagelsp_hover(doc: TextDocument, position: types.Position) -> types.Hover:
     if not names:
         # Handling for Cython definitions in Sage 10.8-
         if SageAvaliable:
-            from sagelsp.plugins.pyflakes_lint import ALL_NAMES_URI  # type: ignore
+            from sagelsp.document_state import DocumentStates
 
-            if doc.uri in ALL_NAMES_URI and symbol_name is not None:
-                undefined_names = ALL_NAMES_URI[doc.uri]
+            state = DocumentStates.get(doc.uri)
+            if state is not None and symbol_name is not None:
+                undefined_names = state.all_names
                 if symbol_name in undefined_names:
                     hover_info = sage_cython_hover(undefined_names[symbol_name], symbol_name)
                     if hover_info is not None:
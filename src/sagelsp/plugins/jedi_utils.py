@@ -5,6 +5,7 @@ import logging
 import docstring_to_markdown
 
 from sagelsp import SageAvaliable
+from sagelsp.tracing import Tracer
 from .cython_utils import (
     pyx_path,
     definition as cython_definition
@@ -68,6 +69,7 @@ def _to_location(name: classes.Name, doc: TextDocument, lines_orig: List[str] =
     )
 
 
+@Tracer.traced("markdown")
 def _doc_prase(docstring: str) -> str:
     """
     Using docstring-to-markdown to convert docstring to markdown format for hover display.
@@ -109,9 +111,11 @@ def _type_hints(source: str, pos: types.Position) -> tuple[str, List[types.Locat
         log.debug(f"ast.parse failed to parse AST for type hints at line {line + 1}, char {character}: {e}")
 
     code += f"var: {type_name}"
-    script = jedi.Script(code=code)
+    with Tracer.span("jedi.Script", "jedi"):
+        script = jedi.Script(code=code)
     try:
-        inferred_names: List[classes.Name] = script.infer(line=len(code.splitlines()), column=0)
+        with Tracer.span("jedi.infer", "jedi"):
+            inferred_names: List[classes.Name] = script.infer(line=len(code.splitlines()), column=0)
     except Exception as e:
         log.error(f"jedi.Script.infer failed for type hints at line {line + 1}, char {character}: {e}")
     
@@ -1,16 +1,77 @@
 from collections.abc import Mapping, Sequence
+from importlib import metadata
+from importlib.util import find_spec, resolve_name
 from pluggy._hooks import HookImpl
-from typing import Union
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+import ast
+import concurrent.futures
+import importlib
+import inspect
 import logging
+import queue
+import threading
+import time
 import pluggy
 
-from sagelsp import NAME
+from sagelsp import NAME, hookimpl
 from sagelsp.plugins import hookspecs
+from sagelsp.plugins.budget import TimeBudget, CircuitBreaker, BREAKER_THRESHOLD, BREAKER_COOLDOWN
+from sagelsp.plugins.stats import HookStats
+from sagelsp.tracing import Tracer
 
 log = logging.getLogger(__name__)
 
 
+CONCURRENT_WORKERS = 4      # threads running hook implementations of a concurrent call
+# Plugins calling jedi, which is not thread safe, all run on one worker thread
+SHARED_WORKERS = {name: "jedi" for name in ("completion", "definition", "hover", "references")}
+
+
 class PluginManager(pluggy.PluginManager):
+    def __init__(self, project_name: str):
+        super().__init__(project_name)
+        self.stats = HookStats()
+        self.budget = TimeBudget()
+        self.breaker = CircuitBreaker()
+        self._workers: Dict[str, PluginWorker] = {}
+        self._workers_lock = threading.Lock()
+        self._stuck: Dict[str, concurrent.futures.Future] = {}     # worker name -> call still running after its deadline
+        self._pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._lazy_lock = threading.Lock()     # lazy plugins are replaced one at a time
+
+    def call_concurrent(
+        self,
+        hook_name: str,
+        kwargs: Mapping[str, object],
+        on_result: Optional[Callable[[str, object], None]] = None,
+    ) -> List[object]:
+        """Call the implementations of a hook at the same time on a thread pool and merge their results.
+
+        `on_result(plugin_name, result)` is called on the calling thread as soon as an implementation
+        returns a result, so callers can use it before the slower ones finish. Results are returned in
+        the order of a normal hook call. Hooks with wrappers or a single implementation are called as usual.
+        """
+        hookimpls = getattr(self.hook, hook_name).get_hookimpls()
+        if len(hookimpls) < 2 or any(method.wrapper or method.hookwrapper for method in hookimpls):
+            return self._hookexec(hook_name, hookimpls, kwargs, False)
+        methods = list(reversed(hookimpls))
+
+        with self._workers_lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=CONCURRENT_WORKERS, thread_name_prefix=f"{NAME}-concurrent",
+                )
+            pool = self._pool
+
+        futures = {pool.submit(self._call_hookimpl, hook_name, method, kwargs): i for i, method in enumerate(methods)}
+        results: List[object] = [None] * len(methods)
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            if on_result is not None and results[i] is not None:
+                on_result(methods[i].plugin_name, results[i])
+        return [result for result in results if result is not None]
+
     def _hookexec(
         self,
         hook_name: str,
@@ -20,15 +81,310 @@ class PluginManager(pluggy.PluginManager):
     ) -> Union[object, list[object]]:
         # called from all hookcaller instances.
         # enable_tracing will set its own wrapping function at self._inner_hookexec
+        if any(method.wrapper or method.hookwrapper for method in methods):
+            # Wrappers need the whole call chain, they can't be timed separately
+            try:
+                return self._inner_hookexec(hook_name, methods, kwargs, firstresult)
+            except Exception as e:
+                log.warning(f"Failed to load hook {hook_name}: {e}", exc_info=True)
+                return None if firstresult else []
+
+        # Call each implementation separately (in pluggy's LIFO order), so that every one is timed
+        # and a failing plugin doesn't drop the results of the others
+        results = []
+        for method in reversed(methods):
+            result = self._call_hookimpl(hook_name, method, kwargs)
+            if result is not None:
+                results.append(result)
+                if firstresult:
+                    return result
+        return None if firstresult else results
+
+    def _call_hookimpl(self, hook_name: str, method: HookImpl, kwargs: Mapping[str, object]) -> object:
+        """Call a single hook implementation, record its latency and isolate its failure."""
+        plugin_name = method.plugin_name
+        timeout = self.budget.get(hook_name, plugin_name)
+        if timeout > 0 and not self.breaker.allow(hook_name, plugin_name):
+            log.debug(f"Plugin {plugin_name} is tripped off in hook {hook_name}, skipping")
+            return None
+        if timeout > 0 and self._is_stuck(plugin_name):
+            log.debug(f"Plugin {plugin_name} is still running a timed out call, skipping hook {hook_name}")
+            return None
+
+        start = time.perf_counter()
+        future = None
         try:
-            return self._inner_hookexec(hook_name, methods, kwargs, firstresult)
+            if timeout > 0 or plugin_name in SHARED_WORKERS:
+                future = self._worker(plugin_name).submit(self._run_hookimpl, hook_name, method, kwargs)
+                result = future.result(timeout=timeout or None)
+            else:
+                result = self._run_hookimpl(hook_name, method, kwargs)
+        except concurrent.futures.TimeoutError as e:
+            if future is None or (future.done() and future.exception() is e):
+                # Raised by the plugin itself
+                self.stats.record(hook_name, plugin_name, time.perf_counter() - start, error=True)
+                log.warning(f"Plugin {plugin_name} failed in hook {hook_name}: {e}", exc_info=True)
+                return None
+            self.stats.record(hook_name, plugin_name, time.perf_counter() - start, error=True, timeout=True)
+            log.warning(f"Plugin {plugin_name} timed out after {timeout}s in hook {hook_name}")
+            # The plugins of the worker are skipped until the stuck call returns, so they never run twice at once
+            if not future.cancel():
+                self._stuck[SHARED_WORKERS.get(plugin_name, plugin_name)] = future
+            if self.breaker.failure(hook_name, plugin_name):
+                log.warning(f"Plugin {plugin_name} tripped off in hook {hook_name} for {self.breaker.cooldown}s")
+            return None
         except Exception as e:
-            log.warning(f"Failed to load hook {hook_name}: {e}", exc_info=True)
-            return []
+            self.stats.record(hook_name, plugin_name, time.perf_counter() - start, error=True)
+            log.warning(f"Plugin {plugin_name} failed in hook {hook_name}: {e}", exc_info=True)
+            return None
+        self.stats.record(hook_name, plugin_name, time.perf_counter() - start)
+        if timeout > 0:
+            self.breaker.success(hook_name, plugin_name)
+        return result[0] if result else None
+
+    def _run_hookimpl(self, hook_name: str, method: HookImpl, kwargs: Mapping[str, object]) -> list:
+        with Tracer.span(f"{method.plugin_name}.{hook_name}", "plugin"):
+            return self._inner_hookexec(hook_name, [method], kwargs, False)
+
+    def configure_timeouts(
+        self,
+        hook_timeout: float = 0.0,
+        plugin_timeouts: Optional[Dict[str, float]] = None,
+        breaker_threshold: int = BREAKER_THRESHOLD,
+        breaker_cooldown: float = BREAKER_COOLDOWN,
+    ):
+        """Set deadlines of hook implementations. Implementations with a deadline run on worker threads."""
+        self.budget = TimeBudget(hook_timeout, plugin_timeouts)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        if self.budget.enabled:
+            log.info(f"Plugin timeouts: default {hook_timeout}s, overrides {plugin_timeouts or {}}")
+
+    def load_lazy_plugins(self):
+        """Import the modules of all `LazyPlugin` stand-ins still registered."""
+        for plugin in self.get_plugins():
+            if isinstance(plugin, LazyPlugin):
+                try:
+                    plugin.load()
+                except Exception:
+                    log.warning(f"Failed to load plugin {plugin.name}", exc_info=True)
+
+    def submit(self, worker_name: str, fn: Callable, *args) -> concurrent.futures.Future:
+        """Run `fn(*args)` on the worker thread of a plugin or of a `SHARED_WORKERS` group, e.g. "jedi"."""
+        return self._worker(worker_name).submit(fn, *args)
+
+    def _worker(self, plugin_name: str) -> "PluginWorker":
+        """Single thread worker of a plugin, so a plugin never runs concurrently with itself.
+
+        Plugins listed in `SHARED_WORKERS` share the worker of their group.
+        """
+        name = SHARED_WORKERS.get(plugin_name, plugin_name)
+        with self._workers_lock:
+            worker = self._workers.get(name)
+            if worker is None:
+                worker = self._workers[name] = PluginWorker(f"{NAME}-{name}")
+            return worker
+
+    def _is_stuck(self, plugin_name: str) -> bool:
+        name = SHARED_WORKERS.get(plugin_name, plugin_name)
+        future = self._stuck.get(name)
+        if future is None:
+            return False
+        if not future.done():
+            return True
+        self._stuck.pop(name, None)
+        log.info(f"Worker {name} returned from its timed out call")
+        return False
+
+
+class PluginWorker:
+    """Daemon thread running the calls submitted for one plugin in order.
+
+    Unlike `ThreadPoolExecutor` threads, a call stuck forever doesn't block the exit of the server.
+    """
+
+    def __init__(self, name: str):
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, fn: Callable, *args) -> concurrent.futures.Future:
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._queue.put((future, fn, args))
+        return future
+
+    def _run(self):
+        while True:
+            future, fn, args = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+class LazyPlugin:
+    """Stand-in registered for an entry point plugin.
+
+    It exposes the hooks found in the plugin's source without importing it. The first call of
+    one of them imports the real module, which then replaces the stand-in in the plugin manager.
+    """
+
+    def __init__(self, pm: PluginManager, name: str, module_name: str, hooks: Dict[str, Dict]):
+        self.pm = pm
+        self.name = name
+        self.module_name = module_name
+        self.module = None
+
+        for hook_name, hook in hooks.items():
+            setattr(self, hook_name, self._make_proxy(hook_name, hook["argnames"], hook["opts"]))
+
+    def _make_proxy(self, hook_name: str, argnames: List[str], opts: Dict):
+        def proxy(*args):
+            return getattr(self.load(), hook_name)(*args)
+
+        # pluggy reads the argument names from the signature
+        proxy.__signature__ = inspect.Signature([
+            inspect.Parameter(argname, inspect.Parameter.POSITIONAL_OR_KEYWORD)
+            for argname in argnames
+        ])
+        proxy.__name__ = hook_name
+        return hookimpl(**opts)(proxy)
+
+    def load(self):
+        """Import the real module and register it in place of this stand-in.
+
+        Plugins loaded from concurrent hook calls are registered one after another.
+        """
+        with self.pm._lazy_lock:
+            if self.module is None:
+                log.info(f"Loading plugin {self.name} from {self.module_name}")
+                module = importlib.import_module(self.module_name)
+                if self.pm.get_plugin(self.name) is self:
+                    self.pm.unregister(self)
+                    self.pm.register(module, name=self.name)
+                self.module = module
+        return self.module
+
+
+def _hookimpl_bindings(tree: ast.Module, package: str) -> Optional[Tuple[Set[str], Set[str]]]:
+    """Return the module level names bound to `sagelsp.hookimpl` and to the `sagelsp` package by imports.
+
+    Returns None if they can't be told from the imports alone (star or nested imports, rebinding).
+    """
+    markers, modules = set(), set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            bound = {alias.asname or NAME for alias in node.names
+                     if alias.name == NAME or not alias.asname and alias.name.startswith(f"{NAME}.")}
+            target = modules
+        elif isinstance(node, ast.ImportFrom):
+            try:
+                module = resolve_name("." * node.level + (node.module or ""), package)
+            except (ImportError, ValueError):
+                return None
+            if module != NAME:
+                continue
+            if any(alias.name == "*" for alias in node.names):
+                return None
+            bound = {alias.asname or alias.name for alias in node.names if alias.name == "hookimpl"}
+            target = markers
+        else:
+            continue
+        if bound and node not in tree.body:
+            return None
+        target |= bound
+
+    if any(isinstance(node, ast.Name) and node.id in markers | modules and not isinstance(node.ctx, ast.Load)
+           for node in ast.walk(tree)):
+        return None
+    return markers, modules
+
+
+def _scan_hookimpls(module_name: str) -> Optional[Dict[str, Dict]]:
+    """Find functions decorated with `hookimpl` in a module's source without importing it.
+
+    Decorators are resolved against the module's imports of `sagelsp`. Returns None if the source
+    can't be analysed, has no hooks or uses `hookimpl` in a way not recognised here (outside
+    function decorators, async functions), so the plugin is imported.
+    """
+    try:
+        spec = find_spec(module_name)
+    except (ImportError, ValueError):
+        return None
+    if spec is None or not spec.origin or not spec.origin.endswith(".py"):
+        return None
+
+    try:
+        with open(spec.origin, "r", encoding="utf-8") as f:
+            tree = ast.parse(f.read(), filename=spec.origin)
+    except (OSError, SyntaxError):
+        return None
+
+    package = module_name if spec.submodule_search_locations is not None else module_name.rpartition(".")[0]
+    bindings = _hookimpl_bindings(tree, package)
+    if bindings is None:
+        return None
+    markers, modules = bindings
+
+    def is_hookimpl(expr: ast.expr) -> bool:
+        if isinstance(expr, ast.Name):
+            return expr.id in markers
+        return (isinstance(expr, ast.Attribute) and expr.attr == "hookimpl"
+                and isinstance(expr.value, ast.Name) and expr.value.id in modules)
+
+    def uses_hookimpl(node: ast.AST) -> bool:
+        return any(is_hookimpl(child) for child in ast.walk(node))
+
+    hooks = {}
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            if uses_hookimpl(node):
+                return None
+            continue
+        for decorator in node.decorator_list:
+            if is_hookimpl(decorator):
+                opts = {}
+            elif isinstance(decorator, ast.Call) and is_hookimpl(decorator.func) and not decorator.args:
+                try:
+                    opts = {kw.arg: ast.literal_eval(kw.value) for kw in decorator.keywords}
+                except ValueError:
+                    return None
+            elif uses_hookimpl(decorator):
+                return None
+            else:
+                continue
+            if isinstance(node, ast.AsyncFunctionDef):
+                return None
+            hooks[node.name] = {
+                "argnames": [arg.arg for arg in node.args.posonlyargs + node.args.args],
+                "opts": opts,
+            }
+    return hooks or None
+
+
+def load_lazy_entrypoints(pm: PluginManager, group: str) -> int:
+    """Register entry point plugins as `LazyPlugin` stand-ins. Return the number of plugins registered."""
+    count = 0
+    for ep in metadata.entry_points(group=group):
+        if pm.get_plugin(ep.name) is not None or pm.is_blocked(ep.name):
+            continue
+
+        hooks = _scan_hookimpls(ep.module) if not ep.attr else None
+        if hooks is None:
+            log.debug(f"Can't load plugin {ep.name} lazily, importing {ep.value}")
+            pm.register(ep.load(), name=ep.name)
+        else:
+            pm.register(LazyPlugin(pm, ep.name, ep.module, hooks), name=ep.name)
+        count += 1
+    return count
 
 
-def create_plugin_manager():
+def create_plugin_manager(disabled_plugins: Iterable[str] = ()):
     pm = PluginManager(NAME)
     pm.add_hookspecs(hookspecs)
-    pm.load_setuptools_entrypoints(NAME)
-    return pm
\ No newline at end of file
+    for name in disabled_plugins:
+        log.info(f"Plugin {name} is disabled")
+        pm.set_blocked(name)
+    load_lazy_entrypoints(pm, NAME)
+    return pm
@@ -1,10 +1,15 @@
+import bisect
+import copy
 import pycodestyle
 import logging
+import re
+from dataclasses import dataclass
 from sagelsp import hookimpl
 from sagelsp.config import StyleConfig
+from sagelsp.document_state import DocumentStates
 
 from pygls.workspace import TextDocument
-from typing import List
+from typing import List, Optional, Tuple
 from lsprotocol import types
 from lsprotocol.types import DiagnosticSeverity, DiagnosticTag
 
@@ -16,6 +21,41 @@ log = logging.getLogger(__name__)
 pycodestyle_patch()
 
 
+FULL_PASS_EVERY = 20    # incremental passes before the whole document is checked again
+
+# Indentation with a tab, the indent char of E101 then depends on all the lines above
+TAB_INDENT = re.compile(r"^ *\t", re.MULTILINE)
+
+
+class RegionChecker(pycodestyle.Checker):
+    """Checker also recording the first line (0-based) of each unindented logical line, and of imports."""
+
+    def __init__(self, *args, **kwargs):
+        self.starts = []
+        self.imports = []
+        super().__init__(*args, **kwargs)
+
+    def build_tokens_line(self):
+        mapping = super().build_tokens_line()
+        if mapping and self.logical_line and mapping[0][1][1] == 0:
+            self.starts.append(mapping[0][1][0] - 1)
+            if self.logical_line.startswith(("import ", "from ")):
+                self.imports.append(mapping[0][1][0] - 1)
+        return mapping
+
+
+@dataclass
+class StyleState:
+    """Result of the last check of a document, kept in its `DocumentState`."""
+    version: Optional[int]
+    style: pycodestyle.StyleGuide
+    diagnostics: List[types.Diagnostic]
+    starts: List[int]           # first lines of unindented logical lines
+    last_import: int            # first line of the last unindented import, -1 if none
+    passes: int = 0             # incremental passes since the last full pass
+    tab_indent: bool = False    # some lines are indented with tabs, only full passes are exact
+
+
 @hookimpl
 def sagelsp_lint(doc: TextDocument, config: StyleConfig, notebook: bool) -> List[types.Diagnostic]:
     """Lint the document using pycodestyle."""
@@ -25,27 +65,157 @@ def sagelsp_lint(doc: TextDocument, config: StyleConfig, notebook: bool) -> List
     source = source.replace("\r\n", "\n").replace("\r", "\n")
     lines = source.splitlines(keepends=True)
 
-    # Load configuration from global and project sources
-    if notebook:
-        config = config.get_notebook_pycodestyle_config()
-    else:
-        config = config.get_pycodestyle_config()
+    # Options are parsed once per configuration
+    style = config.get_pycodestyle_style(notebook)
+
+    # Notebook cells are small and cached per cell already
+    state = None if notebook else DocumentStates.get(doc.uri)
+    previous = state.analysis.get("pycodestyle") if state is not None else None
+    tab_indent = TAB_INDENT.search(source) is not None
+    result = None
+    if previous is not None and previous.style is style and previous.passes < FULL_PASS_EVERY and not (tab_indent or previous.tab_indent):
+        edits = state.edits_since(previous.version)
+        if edits is not None:
+            result = _check_edited(doc, lines, style, previous, edits)
 
-    style = pycodestyle.StyleGuide(**config)
+    if result is None:
+        diagnostics, starts, imports = _check(doc.uri, lines, style)
+        result = StyleState(doc.version, style, diagnostics, starts, imports[-1] if imports else -1, tab_indent=tab_indent)
+        log.debug(f"pycodestyle checked all {len(lines)} lines of {doc.uri}")
+    if state is not None:
+        state.analysis["pycodestyle"] = result
 
-    checker = pycodestyle.Checker(
-        filename=doc.uri,
+    diagnostics = result.diagnostics
+    log.info(f"pycodestyle found {len(diagnostics)} issues in {doc.uri}")
+    for diag in diagnostics:
+        log.debug(f"- {diag.code} at line {diag.range.start.line + 1}, char {diag.range.start.character}: {diag.message}")
+
+    return diagnostics
+
+
+def _check(uri: str, lines: List[str], style: pycodestyle.StyleGuide, line_offset: int = 0) -> Tuple[List[types.Diagnostic], List[int], List[int]]:
+    """Check lines, return their diagnostics, unindented logical line starts and imports shifted by `line_offset`."""
+    checker = RegionChecker(
+        filename=uri,
         lines=lines,
         options=style.options,
         report=PyCodeStyleReport(style.options),
     )
     checker.check_all()
-    diagnostics = checker.report.diagnostics
-    log.info(f"pycodestyle found {len(diagnostics)} issues in {doc.uri}")
-    for diag in diagnostics:
-        log.debug(f"- {diag.code} at line {diag.range.start.line + 1}, char {diag.range.start.character}: {diag.message}")
+    diagnostics = sorted(checker.report.diagnostics, key=_position)
+    if line_offset:
+        diagnostics = [_shift(diag, line_offset) for diag in diagnostics]
+    return diagnostics, [start + line_offset for start in checker.starts], [start + line_offset for start in checker.imports]
 
-    return diagnostics
+
+def _check_edited(
+    doc: TextDocument,
+    lines: List[str],
+    style: pycodestyle.StyleGuide,
+    previous: StyleState,
+    edits: List[Tuple[int, int, int]],
+) -> Optional[StyleState]:
+    """Check again only the unindented statements around edited lines, shifting the other diagnostics.
+
+    Return None when the edit can't be checked locally, e.g. it opened a string or a bracket,
+    or it may change which imports are at the top of the file (E402).
+    """
+    if any(first <= previous.last_import for first, _, _ in edits):
+        return None
+
+    diagnostics = previous.diagnostics
+    starts = previous.starts
+    lo = hi = None      # edited lines in the current text
+    for first, last, added in edits:
+        delta = added - (last - first)
+        diagnostics = [
+            _shift(diag, delta) if diag.range.start.line > last else diag
+            for diag in diagnostics
+            if not first <= diag.range.start.line <= last
+        ]
+        starts = [start + delta if start > last else start for start in starts if not first <= start <= last]
+        if lo is None:
+            lo, hi = first, first + added
+        else:
+            lo = min(lo + delta if lo > last else lo, first)
+            hi = max(hi + delta if hi > last else hi, first + added)
+
+    if lo is None:
+        return StyleState(doc.version, style, diagnostics, starts, previous.last_import, previous.passes)
+
+    # Statements from the one before the edited lines (for blank lines rules) to the one after them
+    i = bisect.bisect_right(starts, min(lo, _blank_lines_lookbehind(lines, lo)))
+    first = starts[i - 1] if i > 0 else 0
+    context = starts[i - 2] if i > 1 else 0
+    j = bisect.bisect_right(starts, hi)
+    last = starts[j] if j < len(starts) else len(lines)
+    end = starts[j + 1] if j + 1 < len(starts) else len(lines)
+    lookahead = _blank_lines_lookahead(lines, first, last)
+    if lookahead >= end:
+        k = bisect.bisect_right(starts, lookahead)
+        end = starts[k] if k < len(starts) else len(lines)
+
+    checked, checked_starts, checked_imports = _check(doc.uri, lines[context:end], style, context)
+    if end == len(lines):
+        last = float("inf")     # checks at the end of file
+    if any(first <= start <= last for start in checked_imports) or any(diag.code.startswith("E9") for diag in checked):
+        return None
+
+    diagnostics = sorted(
+        [diag for diag in diagnostics if not first <= diag.range.start.line <= last]
+        + [diag for diag in checked if first <= diag.range.start.line <= last],
+        key=_position,
+    )
+    starts = [start for start in starts if start < context] + checked_starts + [start for start in starts if start >= end]
+    log.debug(f"pycodestyle checked lines {context + 1}-{end} of {doc.uri}")
+    return StyleState(doc.version, style, diagnostics, starts, previous.last_import, previous.passes + 1)
+
+
+def _blank_lines_lookahead(lines: List[str], first: int, last: int) -> int:
+    """Last line read by the blank lines checks (E30x) of the definitions and decorators in `lines[first:last + 1]`.
+
+    A group of one-liners is allowed, which pycodestyle finds by reading from a decorator down
+    to the next definition and the next non-blank line after it.
+    """
+    last = min(last, len(lines) - 1)
+    if not any(pycodestyle.STARTSWITH_TOP_LEVEL_REGEX.match(line.lstrip()) for line in lines[first:last + 1]):
+        return -1
+    i = last
+    while i < len(lines) and (lines[i].lstrip().startswith("@") or not pycodestyle.STARTSWITH_TOP_LEVEL_REGEX.match(lines[i].lstrip())):
+        i += 1
+    i += 1
+    while i < len(lines) and not lines[i].strip():
+        i += 1
+    return i
+
+
+def _blank_lines_lookbehind(lines: List[str], lo: int) -> int:
+    """First decorator or definition whose blank lines checks (E30x) read line `lo`, `lo` if none."""
+    first = lo
+    blank = True        # only blank lines between the current line and `lo`
+    for i in range(min(lo, len(lines)) - 1, -1, -1):
+        line = lines[i].lstrip()
+        if line.startswith("@"):
+            first = i
+        elif pycodestyle.STARTSWITH_TOP_LEVEL_REGEX.match(line):
+            if not blank:
+                break
+            first = i
+        blank = blank and not line
+    return first
+
+
+def _position(diag: types.Diagnostic) -> Tuple[int, int]:
+    return diag.range.start.line, diag.range.start.character
+
+
+def _shift(diag: types.Diagnostic, delta: int) -> types.Diagnostic:
+    diag = copy.copy(diag)
+    diag.range = types.Range(
+        start=types.Position(line=diag.range.start.line + delta, character=diag.range.start.character),
+        end=types.Position(line=diag.range.end.line + delta, character=diag.range.end.character),
+    )
+    return diag
 
 
 @hookimpl
@@ -1,12 +1,15 @@
-from pyflakes import api, reporter
+from pyflakes import checker, reporter
 from pyflakes import messages
 import logging
 import ast
 from sagelsp import hookimpl, SageAvaliable, LANGUAGE_ID
 from sagelsp.config import StyleConfig
+from sagelsp.document_state import DocumentState, DocumentStates
+from sagelsp.notebook import VirtualDocument
+from sagelsp.plugins.pyflakes_notebook import NotebookSemantics
 
 from pygls.workspace import TextDocument
-from typing import List, Dict
+from typing import List, Dict, Optional
 from lsprotocol import types
 from lsprotocol.types import DiagnosticSeverity
 
@@ -14,39 +17,73 @@ if SageAvaliable:
     from sagelsp.symbols_cache import SymbolsCache, SymbolStatus
 
 log = logging.getLogger(__name__)
-UNDEFINED_NAMES_URI: Dict[str, Dict[str, str]] = {}         # this dict is used to store sage symbols(need to import) for different uris
-NO_NEED_IMPORT_NAMES_URI: Dict[str, Dict[str, str]] = {}    # this dict is used to store sage symbols(not need to import) for different uris
-IMPORTED_NAMES_URI: Dict[str, Dict[str, str]] = {}          # this dict is used to store already imported sage symbols for different uris
-ALL_NAMES_URI: Dict[str, Dict[str, str]] = {}               # this dict is used to store all sage symbols for different uris (including both need to import and not need to import)
 
 
-def get_imported_names(source: str) -> Dict[str, str]:
-    """Get already imported names from the source code.
+def check(source: str, filename: str, reporter: reporter.Reporter) -> Optional[ast.Module]:
+    """Like `pyflakes.api.check`, but return the parsed tree (None on syntax errors) to reuse it."""
+    try:
+        tree = ast.parse(source, filename=filename)
+    except SyntaxError as e:
+        reporter.syntaxError(filename, e.args[0], e.lineno, e.offset, e.text)
+        return None
+    except Exception:
+        reporter.unexpectedError(filename, 'problem decoding source')
+        return None
+
+    w = checker.Checker(tree, filename=filename)
+    w.messages.sort(key=lambda m: m.lineno)
+    for warning in w.messages:
+        reporter.flake(warning)
+    return tree
+
+
+def imported_names(tree: ast.AST) -> Dict[str, str]:
+    """Get already imported names from a parsed tree.
     Returns a dict where key is the imported name and value is the full import path.
     Only handles `from sage.xxx import yyy` and `import sage.xxx.yyy` style.
     """
+    names = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom):
+            # Handle: from sage.xxx.yyy import zzz (or as alias)
+            module = node.module
+            if module and module.startswith('sage'):
+                for alias in node.names:
+                    if alias.name == '*' or alias.asname:
+                        continue
+                    names[alias.name] = module
+        elif isinstance(node, ast.Import):
+            # pass import sage.xxx.yyy (or as alias)
+            pass
+    return names
+
+
+def get_imported_names(source: str) -> Dict[str, str]:
+    """Get already imported names from the source code, see `imported_names`."""
     from sage.repl.preparse import preparse  # type: ignore
-    source_prep = preparse(source)
-    imported_names = {}
     try:
-        tree = ast.parse(source_prep)
-        for node in ast.walk(tree):
-            if isinstance(node, ast.ImportFrom):
-                # Handle: from sage.xxx.yyy import zzz (or as alias)
-                module = node.module
-                if module and module.startswith('sage'):
-                    for alias in node.names:
-                        if alias.name == '*' or alias.asname:
-                            continue
-                        imported_names[alias.name] = module
-            elif isinstance(node, ast.Import):
-                # pass import sage.xxx.yyy (or as alias)
-                pass
-
+        return imported_names(ast.parse(preparse(source)))
     except SyntaxError:
         # If syntax error, return empty dict
-        pass
-    return imported_names
+        return {}
+
+
+def _cached_imported_names(state: DocumentState, tree: Optional[ast.Module]) -> Dict[str, str]:
+    """Imported names of the document, reused while its import statements are unchanged.
+
+    The last names are kept while the document doesn't parse.
+    """
+    cached = state.analysis.get("pyflakes")
+    if tree is None:
+        return cached[1] if cached is not None else {}
+
+    key = tuple(ast.dump(node) for node in ast.walk(tree) if isinstance(node, (ast.Import, ast.ImportFrom)))
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    names = imported_names(tree)
+    state.analysis["pyflakes"] = (key, names)
+    return names
 
 
 @hookimpl
@@ -59,22 +96,16 @@ def sagelsp_lint(doc: TextDocument, config: StyleConfig, notebook: bool) -> List
         from sage.repl.preparse import preparse  # type: ignore
         source = preparse(source)
 
+    # The tree checked by pyflakes is reused to find imported names
     reporter = DiagnosticReporter(doc.lines)
-    api.check(source, doc.uri, reporter=reporter)
+    tree = check(source, doc.uri, reporter)
 
     # Store sage symbols
+    state = DocumentStates.get_or_create(doc.uri)
     if SageAvaliable:
-        UNDEFINED_NAMES_URI[doc.uri] = reporter.UNDEFINED_NAMES
-        NO_NEED_IMPORT_NAMES_URI[doc.uri] = reporter.NO_NEED_IMPORT_NAMES
-        IMPORTED_NAMES_URI[doc.uri] = get_imported_names(doc.source)
+        state.update_names(reporter.UNDEFINED_NAMES, reporter.NO_NEED_IMPORT_NAMES, _cached_imported_names(state, tree))
     else:
-        UNDEFINED_NAMES_URI[doc.uri] = {}
-        NO_NEED_IMPORT_NAMES_URI[doc.uri] = {}
-        IMPORTED_NAMES_URI[doc.uri] = {}
-
-    # log.debug(f"\n\n{UNDEFINED_NAMES_URI}\n\n{NO_NEED_IMPORT_NAMES_URI}\n\n{IMPORTED_NAMES_URI}\n\n")
-
-    ALL_NAMES_URI[doc.uri] = {**UNDEFINED_NAMES_URI[doc.uri], **NO_NEED_IMPORT_NAMES_URI[doc.uri], **IMPORTED_NAMES_URI[doc.uri]}
+        state.update_names({}, {}, {})
 
     diagnostics = reporter.diagnostics
     log.info(f"pyflakes found {len(diagnostics)} issues in {doc.uri}")
@@ -86,7 +117,20 @@ def sagelsp_lint(doc: TextDocument, config: StyleConfig, notebook: bool) -> List
 
 @hookimpl
 def sagelsp_semantic_lint(doc: TextDocument, config: StyleConfig, notebook: bool) -> List[types.Diagnostic]:
-    return sagelsp_lint(doc, config, notebook)
+    if not isinstance(doc, VirtualDocument):
+        return sagelsp_lint(doc, config, notebook)
+
+    # Check only the cells that changed instead of the whole virtual document
+    engine = NotebookSemantics.of(doc.notebook)
+    diagnostics = engine.virtual_diagnostics(engine.lint())
+    state = DocumentStates.get_or_create(doc.uri)
+    if SageAvaliable:
+        state.update_names(*engine.names())
+    else:
+        state.update_names({}, {}, {})
+
+    log.info(f"pyflakes found {len(diagnostics)} issues in {doc.uri}, {len(engine.checked)} cells checked")
+    return diagnostics
 
 
 """
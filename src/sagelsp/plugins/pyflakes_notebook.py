@@ -0,0 +1,541 @@
+import ast
+import copy
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from pyflakes import checker, messages
+from lsprotocol import types
+
+from sagelsp import SageAvaliable
+from sagelsp.notebook import JupyterNotebook
+from sagelsp.tracing import Tracer
+
+log = logging.getLogger(__name__)
+
+
+FREE_MESSAGES = (messages.UndefinedName, messages.ImportStarUsage)
+REDEFINITION_MESSAGES = (messages.RedefinedWhileUnused, messages.ImportShadowedByLoopVar)
+
+_serial = itertools.count()
+
+
+class Load(NamedTuple):
+    """A lookup that reached the module scope, resolved in the cell or not."""
+    name: str
+    node: ast.AST
+    scope: Any
+    postponed: bool         # in a postponed annotation, where bare annotations define names
+    suppressed: bool        # under a `NameError` handler
+
+
+class Bind(NamedTuple):
+    """A binding of a name looked up in the module scope."""
+    value: Any
+    node: ast.AST
+    existing: Any           # binding replaced in the cell
+    forks: bool             # `existing` is on another branch of an if/try
+    module_level: bool
+    loop: bool              # bound by a for loop
+    dead_loop: bool         # `node` is a for loop, checked when the module ends
+    used: Any               # used before being bound, like `__future__` imports
+    stored: bool            # stored in the module scope
+    names: List[str]        # names added to `__all__`
+
+
+class Delete(NamedTuple):
+    name: str
+    node: ast.AST
+
+
+class Global(NamedTuple):
+    node: ast.AST
+
+
+class Future(NamedTuple):
+    """A `__future__` import allowed in the cell, or None once the cell disallows them."""
+    node: Optional[ast.AST]
+
+
+class Report(NamedTuple):
+    """A message of the cell that a `global` statement of another cell may remove."""
+    message: Any
+
+
+class Local(NamedTuple):
+    """A name bound in a function, undefined if the function looked it up in the module scope before."""
+    name: str
+    scope: Any
+    declared_global: bool
+    reported: bool          # reported for an enclosing function
+
+
+class CellChecker(checker.Checker):
+    """Pyflakes checker of one cell, recording what the cell does with the module scope.
+
+    Lookups, bindings and deletions reaching the module scope depend on the other cells, so
+    they are recorded instead of reported, grouped by generation of deferred functions since
+    pyflakes runs the functions of all cells after the module level code.
+    """
+
+    def __init__(self, tree: ast.Module, annotations_future: Tuple[bool, bool] = (False, False)):
+        self.events: List[List[Any]] = [[]]
+        self.generation = 0
+        self.loaded = set()             # bindings of the cell a module level lookup already recorded
+        # `from __future__ import annotations` of the cells above, and of the whole notebook for deferred functions
+        self.annotations_future = annotations_future
+        self.enables_annotations = False
+        super().__init__(tree)
+
+    @property
+    def module(self) -> checker.ModuleScope:
+        return self.scopeStack[0]
+
+    def record(self, event):
+        while len(self.events) <= self.generation:
+            self.events.append([])
+        self.events[self.generation].append(event)
+
+    def deferFunction(self, callable):
+        generation = self.generation + 1
+
+        def run():
+            self.generation = generation
+            callable()
+        super().deferFunction(run)
+
+    def handleNodeLoad(self, node, parent):
+        name = checker.getNodeName(node)
+        handlers = self.exceptHandlers[-1]
+        self.exceptHandlers[-1] = ()
+        count = len(self.messages)
+        try:
+            super().handleNodeLoad(node, parent)
+        finally:
+            self.exceptHandlers[-1] = handlers
+
+        load = Load(name, node, self.scope, self._in_postponed_annotation, "NameError" in handlers)
+        if len(self.messages) > count and isinstance(self.messages[-1], FREE_MESSAGES):
+            self.messages.pop()
+            self.record(load)
+            return
+        binding = self.module.get(name)
+        if binding is not None and binding.used and binding.used[1] is node:
+            # Before functions run, a binding of the cell is the one of the notebook too, so
+            # only its first lookup matters. Builtins may be rebound or deleted by other cells.
+            if self.generation or isinstance(binding, checker.Builtin) or binding not in self.loaded:
+                self.loaded.add(binding)
+                self.record(load)
+
+    def addBinding(self, node, value):
+        if isinstance(value, checker.Builtin):
+            return super().addBinding(node, value)
+        for scope in self.scopeStack[::-1]:
+            if value.name in scope:
+                break
+        if scope is not self.module:
+            return super().addBinding(node, value)
+
+        module = self.module
+        existing = module.get(value.name)
+        if isinstance(existing, checker.Builtin):
+            existing = None
+        forks = existing is not None and self.differentForks(node, existing.source)
+        names = list(getattr(value, "names", ()))
+        if isinstance(value, checker.ExportBinding) and isinstance(existing, checker.ExportBinding) \
+                and isinstance(value.source, ast.AugAssign):
+            names = names[len(existing.names):]
+        used = value.used
+        module_level = self.scope is module
+        count = len(self.messages)
+        super().addBinding(node, value)
+        self.messages[count:] = [m for m in self.messages[count:] if not isinstance(m, REDEFINITION_MESSAGES)]
+        self.record(Bind(
+            value, node, existing, forks, module_level,
+            isinstance(self.getParent(value.source), checker.FOR_TYPES),
+            isinstance(self.getParent(node), checker.FOR_TYPES),
+            used, module.get(value.name) is value, names,
+        ))
+
+    def handleNodeDelete(self, node):
+        name = checker.getNodeName(node)
+        if not name or self.scope is not self.module:
+            count = len(self.messages)
+            super().handleNodeDelete(node)
+            if len(self.messages) > count:
+                self.record(Report(self.messages.pop()))
+            return
+        bound = name in self.module
+        count = len(self.messages)
+        super().handleNodeDelete(node)
+        if bound and name not in self.module:
+            self.record(Delete(name, node))
+        elif not bound and len(self.messages) > count:
+            self.messages.pop()
+            self.record(Delete(name, node))
+
+    def handleNodeStore(self, node):
+        name = checker.getNodeName(node)
+        scope = self.scope
+        if not name or not isinstance(scope, checker.FunctionScope) or name in scope:
+            return super().handleNodeStore(node)
+        binding = self.module.get(name)
+        declared_global = name in scope.globals
+        from_module = bool(binding is not None and binding.used and binding.used[0] is scope and not declared_global)
+        count = len(self.messages)
+        super().handleNodeStore(node)
+        reported = [m for m in self.messages[count:] if isinstance(m, messages.UndefinedLocal)]
+        if from_module:
+            self.messages.remove(reported[0])
+        self.record(Local(name, scope, declared_global, bool(reported) and not from_module))
+
+    @property
+    def annotationsFutureEnabled(self):
+        if not isinstance(self.scopeStack[0], checker.ModuleScope):
+            return False
+        return self.scopeStack[0]._annotations_future_enabled or self.annotations_future[1 if self.generation else 0]
+
+    @annotationsFutureEnabled.setter
+    def annotationsFutureEnabled(self, value):
+        checker.Checker.annotationsFutureEnabled.fset(self, value)
+        self.enables_annotations = True
+
+    def IMPORTFROM(self, node):
+        if node.module == "__future__" and self.futuresAllowed:
+            self.record(Future(node))
+        super().IMPORTFROM(node)
+
+    def _run_deferred(self):
+        if not self.module._futures_allowed:
+            self.record(Future(None))
+        super()._run_deferred()
+
+    def GLOBAL(self, node):
+        if self.scope is not self.module:
+            self.record(Global(node))
+        super().GLOBAL(node)
+
+    NONLOCAL = GLOBAL
+
+    def checkDeadScopes(self):
+        # The module scope is checked for the whole notebook by `NotebookScope.finish`
+        self.deadScopes = [scope for scope in self.deadScopes if not isinstance(scope, checker.ModuleScope)]
+        super().checkDeadScopes()
+
+
+class NotebookScope:
+    """The module scope of a notebook, built by replaying the events of its cells in order."""
+
+    def __init__(self, cells: int):
+        self.bindings: Dict[str, Any] = {name: checker.Builtin(name) for name in checker.Checker.builtIns}
+        self.stars: Dict[str, Any] = {}
+        self.used: Dict[Any, Any] = {}          # binding -> (scope, node, cell) of its last lookup
+        self.owner: Dict[Any, int] = {}         # binding -> cell binding it
+        self.redefined: Dict[Any, List[Tuple[int, ast.AST, bool]]] = {}
+        self.exports: Dict[Any, List[str]] = {}
+        self.futures_allowed = True
+        self.messages: List[List[Any]] = [[] for _ in range(cells)]
+
+    def report(self, cell: int, message_class, *args):
+        self.messages[cell].append(message_class(None, *args))
+
+    def replay(self, cell: int, event):
+        if isinstance(event, Load):
+            self.load(cell, event)
+        elif isinstance(event, Bind):
+            self.bind(cell, event)
+        elif isinstance(event, Delete):
+            if event.name in self.bindings:
+                del self.bindings[event.name]
+            else:
+                self.report(cell, messages.UndefinedName, event.node, event.name)
+        elif isinstance(event, Global):
+            self.declare_global(cell, event.node)
+        elif isinstance(event, Future):
+            if event.node is None:
+                self.futures_allowed = False
+            elif not self.futures_allowed:
+                self.report(cell, messages.LateFutureImport, event.node)
+        elif isinstance(event, Report):
+            self.messages[cell].append(event.message)
+        else:
+            self.local(cell, event)
+
+    def load(self, cell: int, event: Load):
+        binding = self.bindings.get(event.name)
+        mark = (event.scope, event.node, cell)
+        annotated = isinstance(binding, checker.Annotation) and not event.postponed
+        if annotated:
+            # Like pyflakes, a bare annotation hides the star imports
+            self.used[binding] = mark
+        elif binding is not None:
+            self.used[binding] = mark
+            if isinstance(binding, checker.Importation) and binding._has_alias() and binding.fullName in self.bindings:
+                self.used[self.bindings[binding.fullName]] = mark
+            return
+        if self.stars and not annotated:
+            for star in self.stars.values():
+                self.used[star] = mark
+            from_list = ", ".join(sorted(star.fullName for star in self.stars.values()))
+            self.report(cell, messages.ImportStarUsage, event.node, event.name, from_list)
+        elif not event.suppressed:
+            self.report(cell, messages.UndefinedName, event.node, event.name)
+
+    def bind(self, cell: int, event: Bind):
+        value = event.value
+        name = value.name
+        existing = self.bindings.get(name)
+        if (existing is not None and not isinstance(existing, checker.Builtin)
+                and not (existing is event.existing and event.forks)):
+            if isinstance(existing, checker.Importation) and event.loop:
+                self.report(cell, messages.ImportShadowedByLoopVar, event.node, name, existing.source)
+            elif event.module_level:
+                if (not self.used.get(existing) and value.redefines(existing)
+                        and (name != "_" or isinstance(existing, checker.Importation))
+                        and not checker.is_typing_overload(existing, [self.bindings])):
+                    self.report(cell, messages.RedefinedWhileUnused, event.node, name, existing.source)
+            elif isinstance(existing, checker.Importation) and value.redefines(existing):
+                self.redefined.setdefault(existing, []).append((cell, event.node, event.dead_loop))
+
+        if event.module_level and existing is not None:
+            self.used[value] = self.used.get(existing, False)
+        else:
+            self.used[value] = event.used
+        if not event.stored or (existing is not None and isinstance(value, checker.Annotation)):
+            return
+
+        self.bindings[name] = value
+        self.owner[value] = cell
+        if isinstance(value, checker.ExportBinding):
+            names = event.names
+            if isinstance(value.source, ast.AugAssign) and isinstance(existing, checker.ExportBinding):
+                names = self.exports[existing] + names
+            self.exports[value] = names
+        elif isinstance(value, checker.StarImportation):
+            self.stars[name] = value
+
+    def declare_global(self, cell: int, node: ast.Global):
+        for name in node.names:
+            for cell_messages in self.messages:
+                cell_messages[:] = [
+                    m for m in cell_messages
+                    if not isinstance(m, messages.UndefinedName) or m.message_args[0] != name
+                ]
+            value = checker.Assignment(name, node)
+            self.used[value] = (None, node, cell)
+            if name not in self.bindings:
+                self.bindings[name] = value
+                self.owner[value] = cell
+
+    def local(self, cell: int, event: Local):
+        if event.reported or event.declared_global:
+            return
+        binding = self.bindings.get(event.name)
+        used = self.used.get(binding) if binding is not None else None
+        if used and used[0] is event.scope:
+            self.report(used[2], messages.UndefinedLocal, used[1], event.name, binding.source)
+
+    def finish(self):
+        """Report what pyflakes reports when the module ends."""
+        all_binding = self.bindings.get("__all__")
+        if isinstance(all_binding, checker.ExportBinding):
+            all_names = self.exports[all_binding]
+            undefined = [name for name in all_names if name not in self.bindings]
+            cell = self.owner[all_binding]
+            if undefined and not self.stars:
+                for name in undefined:
+                    self.report(cell, messages.UndefinedExport, all_binding.source, name)
+            elif undefined:
+                for star in self.stars.values():
+                    self.used[star] = (None, all_binding.source, cell)
+                from_list = ", ".join(sorted(star.fullName for star in self.stars.values()))
+                for name in undefined:
+                    self.report(cell, messages.ImportStarUsage, all_binding.source, name, from_list)
+        else:
+            all_names = []
+
+        for binding in self.bindings.values():
+            if not isinstance(binding, checker.Importation):
+                continue
+            used = self.used.get(binding) or binding.name in all_names
+            if not used:
+                self.report(self.owner[binding], messages.UnusedImport, binding.source, str(binding))
+            for cell, node, loop in self.redefined.get(binding, ()):
+                if loop:
+                    self.report(cell, messages.ImportShadowedByLoopVar, node, binding.name, binding.source)
+                elif not used:
+                    self.report(cell, messages.RedefinedWhileUnused, node, binding.name, binding.source)
+
+
+@dataclass
+class CellAnalysis:
+    """Pyflakes result of one cell checked alone, with what it does with the module scope."""
+    version: Optional[int]
+    text: str
+    source: str                                                         # preparsed text
+    events: List[List[Any]] = field(default_factory=list)               # module scope events of each generation
+    messages: List[Any] = field(default_factory=list)                   # messages that don't depend on other cells
+    syntax_error: Optional[Tuple[str, int, int, str]] = None
+    imported_names: Dict[str, str] = field(default_factory=dict)        # already imported sage symbols
+    annotations_future: Tuple[bool, bool] = (False, False)              # see `CellChecker`
+    enables_annotations: bool = False                                   # imports `annotations` from `__future__`
+    serial: int = field(default_factory=lambda: next(_serial))
+
+
+@dataclass
+class CellResult:
+    key: Tuple
+    diagnostics: List[types.Diagnostic]
+    undefined_names: Dict[str, str]
+    no_need_import_names: Dict[str, str]
+
+
+class NotebookSemantics:
+    """Pyflakes diagnostics of a notebook, updated cell by cell.
+
+    Each cell is checked alone when its version changes, recording what it does with the
+    module scope. The events of all cells are then replayed in the order pyflakes would see
+    them in the whole notebook, which is cheap compared to checking it, and only the cells
+    whose messages changed are converted to diagnostics again.
+    """
+    def __init__(self, notebook: JupyterNotebook):
+        self.notebook = notebook
+        self.analyses: Dict[str, CellAnalysis] = {}
+        self.results: Dict[str, CellResult] = {}
+        self.checked: List[str] = []        # cells checked again by the last `lint`
+        self.relinted: List[str] = []       # cells whose diagnostics were rebuilt by the last `lint`
+
+    @classmethod
+    def of(cls, notebook: JupyterNotebook) -> "NotebookSemantics":
+        engine = notebook.analysis.get("pyflakes")
+        if engine is None:
+            engine = notebook.analysis["pyflakes"] = cls(notebook)
+        return engine
+
+    def lint(self) -> Dict[str, List[types.Diagnostic]]:
+        """Return the diagnostics of each cell, in cell coordinates."""
+        notebook = self.notebook
+        self.checked = []
+        self.relinted = []
+
+        analyses = []
+        for i, (uri, text, version) in enumerate(zip(notebook.cell_uris, notebook.cell_texts, notebook.cell_versions)):
+            analysis = self.analyses.get(uri)
+            if analysis is None or analysis.version != version or analysis.text != text:
+                flags = analysis.annotations_future if analysis is not None else (False, False)
+                analysis = check_cell(text, notebook.preparsed(i), version, previous=analysis, annotations_future=flags)
+                self.checked.append(uri)
+            analyses.append(analysis)
+
+        # Annotations are postponed below a `from __future__ import annotations`, and in all functions
+        # if any cell has one. Cells are checked again when that changes for them.
+        enabled, enabled_anywhere = False, any(analysis.enables_annotations for analysis in analyses)
+        for i, (uri, analysis) in enumerate(zip(notebook.cell_uris, analyses)):
+            flags = (enabled, enabled_anywhere)
+            if analysis.annotations_future != flags:
+                analysis = analyses[i] = check_cell(analysis.text, analysis.source, analysis.version, previous=analysis, annotations_future=flags)
+                if uri not in self.checked:
+                    self.checked.append(uri)
+            enabled = enabled or analysis.enables_annotations
+        self.analyses = dict(zip(notebook.cell_uris, analyses))
+
+        results = {}
+        for uri, analysis, cell_messages in zip(notebook.cell_uris, analyses, resolve(analyses)):
+            key = (analysis.serial, tuple((type(m), m.lineno, m.col, m.message_args) for m in cell_messages))
+            result = self.results.get(uri)
+            if result is None or result.key != key:
+                result = build_result(key, analysis, cell_messages)
+                self.relinted.append(uri)
+            results[uri] = result
+        self.results = results
+
+        log.debug(f"pyflakes checked {len(self.checked)} and relinted {len(self.relinted)} of {len(analyses)} cells in {notebook.uri}")
+        return {uri: result.diagnostics for uri, result in results.items()}
+
+    def names(self) -> Tuple[Dict[str, str], Dict[str, str], Dict[str, str]]:
+        """Sage symbols of the notebook as `(undefined, no need to import, imported)`."""
+        undefined, no_need_import, imported = {}, {}, {}
+        for uri, result in self.results.items():
+            undefined.update(result.undefined_names)
+            no_need_import.update(result.no_need_import_names)
+            imported.update(self.analyses[uri].imported_names)
+        return undefined, no_need_import, imported
+
+    def virtual_diagnostics(self, diagnostics_by_cell: Dict[str, List[types.Diagnostic]]) -> List[types.Diagnostic]:
+        """Shift cell diagnostics to the virtual document, copying them since the cached ones are kept."""
+        virtual = []
+        for uri, diagnostics in diagnostics_by_cell.items():
+            offset = self.notebook.offsets[self.notebook.cell_index[uri]]
+            for diag in diagnostics:
+                diag = copy.copy(diag)
+                diag.range = types.Range(
+                    start=types.Position(line=diag.range.start.line + offset, character=diag.range.start.character),
+                    end=types.Position(line=diag.range.end.line + offset, character=diag.range.end.character),
+                )
+                virtual.append(diag)
+        return virtual
+
+
+@Tracer.traced("pyflakes.check_cell", "plugin")
+def check_cell(
+    text: str,
+    source: str,
+    version: Optional[int],
+    previous: Optional[CellAnalysis] = None,
+    annotations_future: Tuple[bool, bool] = (False, False),
+) -> CellAnalysis:
+    """Check one cell alone, `source` is its preparsed text."""
+    analysis = CellAnalysis(version=version, text=text, source=source, annotations_future=annotations_future)
+    try:
+        tree = ast.parse(source)
+    except SyntaxError as e:
+        analysis.syntax_error = (e.args[0], e.lineno, e.offset, e.text)
+        # Keep the names of the last valid text, so cells below don't flicker while typing
+        if previous is not None:
+            analysis.events = previous.events
+            analysis.enables_annotations = previous.enables_annotations
+        return analysis
+
+    if SageAvaliable:
+        from sagelsp.plugins.pyflakes_lint import imported_names
+        analysis.imported_names = imported_names(tree)
+
+    w = CellChecker(tree, annotations_future)
+    analysis.events = w.events
+    analysis.messages = w.messages
+    analysis.enables_annotations = w.enables_annotations
+    return analysis
+
+
+def resolve(analyses: List[CellAnalysis]) -> List[List[Any]]:
+    """Replay the module scope events of the cells, return the messages of each cell they cause.
+
+    Module level code of all cells runs first, then the functions deferred by each generation.
+    """
+    scope = NotebookScope(len(analyses))
+    for generation in range(max((len(analysis.events) for analysis in analyses), default=0)):
+        for cell, analysis in enumerate(analyses):
+            if generation < len(analysis.events):
+                for event in analysis.events[generation]:
+                    scope.replay(cell, event)
+    scope.finish()
+
+    # Cells with syntax errors still define names, but only report the error
+    return [[] if analysis.syntax_error else cell_messages for analysis, cell_messages in zip(analyses, scope.messages)]
+
+
+def build_result(key: Tuple, analysis: CellAnalysis, replayed: List[Any]) -> CellResult:
+    """Convert the messages of a cell to diagnostics."""
+    from sagelsp.plugins.pyflakes_lint import DiagnosticReporter
+
+    reporter = DiagnosticReporter(analysis.text.split("\n"))
+    if analysis.syntax_error is not None:
+        reporter.syntaxError(None, *analysis.syntax_error)
+    else:
+        cell_messages = analysis.messages + replayed
+        cell_messages.sort(key=lambda m: m.lineno)
+        for message in cell_messages:
+            reporter.flake(message)
+
+    return CellResult(key, reporter.diagnostics, reporter.UNDEFINED_NAMES, reporter.NO_NEED_IMPORT_NAMES)
@@ -3,6 +3,7 @@ import re
 
 from pygls.workspace import TextDocument
 from lsprotocol import types
+from sagelsp.tracing import Tracer
 
 log = logging.getLogger(__name__)
 
@@ -10,17 +11,19 @@ log = logging.getLogger(__name__)
 SYMBOL = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
 
 
+@Tracer.traced("_sage_add_import_path")
 def _sage_add_import_path(doc: TextDocument):
     """Add import path for Sage symbols to help jedi definition resolution"""
-    from sagelsp.plugins.pyflakes_lint import ALL_NAMES_URI
+    from sagelsp.document_state import DocumentStates
 
     import_path_list = []
-    if doc.uri not in ALL_NAMES_URI:
+    state = DocumentStates.get(doc.uri)
+    if state is None:
         # In theory this should not happen
-        log.error(f"No sage symbols found for {doc.uri} in UNDEFINED_NAME_URI")
+        log.error(f"No sage symbols found for {doc.uri} in DocumentStates")
         return "", 0
 
-    undefined_names = ALL_NAMES_URI[doc.uri]
+    undefined_names = state.all_names
     log.debug(f"Detected sage symbols in {doc.uri}: {undefined_names}")
     for name, import_path in undefined_names.items():
         import_path_list.append(f"from {import_path} import {name}\n")
@@ -32,8 +35,15 @@ def _sage_preparse(doc: TextDocument, position: types.Position):
     """Trace column offest for sage-preparse code"""
     from sage.repl.preparse import preparse  # type: ignore
 
+    from sagelsp.notebook import VirtualDocument
+
     source_orig = doc.source
-    source_prep = preparse(source_orig)
+    if isinstance(doc, VirtualDocument):
+        # Reuse the cells preparsed by the notebook
+        source_prep = doc.preparsed_source
+    else:
+        with Tracer.span("preparse"):
+            source_prep = preparse(source_orig)
 
     # Add import paths for undefined sage symbols
     # And offset the line number accordingly
@@ -0,0 +1,76 @@
+from collections import deque
+from typing import Dict, Tuple
+import threading
+import math
+
+
+WINDOW_SIZE = 1000     # number of latest samples kept for percentiles
+
+
+class LatencyStats:
+    """Rolling latency samples and counters of one hook implementation."""
+
+    def __init__(self, window: int = WINDOW_SIZE):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def record(self, seconds: float, error: bool = False, timeout: bool = False):
+        self.samples.append(seconds)
+        self.count += 1
+        if error:
+            self.errors += 1
+        if timeout:
+            self.timeouts += 1
+
+    def report(self) -> Dict[str, float]:
+        """Return count, errors, timeouts and p50/p95/p99/max latency in milliseconds."""
+        samples = sorted(self.samples)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "p50": _percentile(samples, 50) * 1000,
+            "p95": _percentile(samples, 95) * 1000,
+            "p99": _percentile(samples, 99) * 1000,
+            "max": (samples[-1] if samples else 0.0) * 1000,
+        }
+
+
+class HookStats:
+    """Latency statistics per hook per plugin."""
+
+    def __init__(self, window: int = WINDOW_SIZE):
+        self.window = window
+        self._stats: Dict[Tuple[str, str], LatencyStats] = {}
+        self._lock = threading.Lock()
+
+    def get(self, hook_name: str, plugin_name: str) -> LatencyStats:
+        key = (hook_name, plugin_name)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = LatencyStats(self.window)
+            return stats
+
+    def record(self, hook_name: str, plugin_name: str, seconds: float, error: bool = False, timeout: bool = False):
+        stats = self.get(hook_name, plugin_name)
+        with self._lock:
+            stats.record(seconds, error, timeout)
+
+    def report(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Return `{hook_name: {plugin_name: stats}}`."""
+        result: Dict[str, Dict[str, Dict[str, float]]] = {}
+        with self._lock:
+            for (hook_name, plugin_name), stats in sorted(self._stats.items()):
+                result.setdefault(hook_name, {})[plugin_name] = stats.report()
+        return result
+
+
+def _percentile(samples: list, percent: float) -> float:
+    """Nearest-rank percentile of sorted samples."""
+    if not samples:
+        return 0.0
+    rank = max(0, math.ceil(percent / 100 * len(samples)) - 1)
+    return samples[rank]
@@ -0,0 +1,113 @@
+from sagelsp import CachePath
+
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+import asyncio
+import cProfile
+import functools
+import inspect
+import json
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+MAX_PROFILES = 100      # number of latest profiles kept on disk
+
+
+class RequestProfiler:
+    """Profile handlers with cProfile and keep the profiles of the slow ones.
+
+    Disabled while `threshold` (milliseconds) is 0.
+    """
+
+    def __init__(self, directory: Path, threshold: float = 0.0, max_profiles: int = MAX_PROFILES):
+        self.directory = directory
+        self.threshold = threshold
+        self.max_profiles = max_profiles
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def wrap(self, method: str, handler: Callable, ls: Any = None) -> Callable:
+        """Wrap a synchronous handler, asynchronous and generator handlers are returned as is."""
+        if asyncio.iscoroutinefunction(handler) or inspect.isgeneratorfunction(handler):
+            return handler
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return handler(*args, **kwargs)
+
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is active
+                return handler(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                profile.disable()
+                elapsed = (time.perf_counter() - start) * 1000
+                if elapsed >= self.threshold:
+                    self.save(profile, method, elapsed, args[-1] if args else None, ls)
+
+        return wrapper
+
+    def save(self, profile: cProfile.Profile, method: str, elapsed: float, params: Any = None, ls: Any = None) -> Optional[Path]:
+        """Write a profile and its request metadata, return the path of the profile."""
+        info = {
+            "method": method,
+            "duration_ms": round(elapsed, 3),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            **_document_info(params, ls),
+        }
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}-{method.replace('/', '_').replace('$', '')}"
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / f"{name}.prof"
+            profile.dump_stats(str(path))
+            path.with_suffix(".json").write_text(json.dumps(info, indent=2), encoding="utf-8")
+        except OSError:
+            log.warning(f"Failed to write profile of {method}", exc_info=True)
+            return None
+
+        log.info(f"Slow request {method} took {elapsed:.0f}ms, profile written to {path}")
+        self._prune()
+        return path
+
+    def _prune(self):
+        profiles = sorted(self.directory.glob("*.prof"))
+        for path in profiles[:-self.max_profiles]:
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+
+
+def _document_info(params: Any, ls: Any) -> Dict[str, Any]:
+    """Find the URI, size and version of the document a request is about."""
+    document = getattr(params, "text_document", None) or getattr(params, "notebook_document", None)
+    uri = getattr(document, "uri", None)
+    info = {"uri": uri, "size": None, "version": getattr(document, "version", None)}
+    if uri is None or ls is None:
+        return info
+
+    try:
+        notebook = ls.workspace.get_notebook_document(notebook_uri=uri)
+        if notebook is not None:
+            info["version"] = notebook.version
+            info["size"] = sum(len(ls.workspace.get_text_document(cell.document).source) for cell in notebook.cells)
+        else:
+            doc = ls.workspace.get_text_document(uri)
+            info["version"] = doc.version
+            info["size"] = len(doc.source)
+    except Exception:
+        log.debug(f"Failed to get document info of {uri}", exc_info=True)
+    return info
+
+
+Profiler = RequestProfiler(Path(CachePath) / "profiles")
@@ -1,32 +1,316 @@
-from sagelsp import NAME, __version__, LANGUAGE_ID
+from sagelsp import NAME, __version__, LANGUAGE_ID, SageAvaliable
 from sagelsp.plugins.manager import create_plugin_manager
+from sagelsp.plugins.budget import BREAKER_THRESHOLD, BREAKER_COOLDOWN
 from sagelsp.config import StyleConfig
-from sagelsp.notebook import JupyterNotebook
+from sagelsp.notebook import JupyterNotebook, Notebooks, get_notebook
+from sagelsp.document_state import DocumentStates, MAX_DOCUMENTS
+from sagelsp.profiler import Profiler
+from sagelsp.tracing import Tracer
+from sagelsp.monitor import LoopMonitor, LAG_WARNING
+from sagelsp.memory import Memory, TOP_LIMIT, process_memory
+from sagelsp.memory_budget import BudgetedCache, CacheBudget, IDLE_TRIM
 
 from pygls.lsp.server import LanguageServer
+from pygls.protocol import LanguageServerProtocol
 from pygls.workspace import TextDocument
 from lsprotocol import types
-from typing import Union, List
+from typing import Dict, Hashable, Union, List, Optional, Tuple
+from pathlib import Path
+from enum import Enum
+import asyncio
+import importlib
+import json
 import logging
+import time
+import uuid
 
 log = logging.getLogger(__name__)
 
 
+# Most used Sage modules preloaded by jedi during warm-up
+WARMUP_MODULES = [
+    "sage.rings.integer_ring",
+    "sage.rings.rational_field",
+    "sage.rings.real_mpfr",
+    "sage.rings.finite_rings.finite_field_constructor",
+    "sage.rings.polynomial.polynomial_ring_constructor",
+    "sage.matrix.constructor",
+    "sage.modules.free_module",
+    "sage.schemes.elliptic_curves.constructor",
+    "sage.arith.misc",
+]
+
+
+class ServerState(str, Enum):
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+
+class SageLanguageServerProtocol(LanguageServerProtocol):
+    """Record receive, handling and serialization spans of messages when tracing is enabled."""
+
+    def structure_message(self, data: dict):
+        # Called for every JSON object of a message, only the outermost one is a message
+        if not Tracer.enabled or "jsonrpc" not in data:
+            return super().structure_message(data)
+        with Tracer.span("receive", "lsp", method=data.get("method"), id=data.get("id")):
+            return super().structure_message(data)
+
+    def handle_message(self, message):
+        CacheBudget.touch()
+        method = getattr(message, "method", None)
+        if not Tracer.enabled or method is None:
+            return super().handle_message(message)
+        with Tracer.span(method, "lsp", id=getattr(message, "id", None)):
+            return super().handle_message(message)
+
+    def _send_data(self, data):
+        if not Tracer.enabled:
+            return super()._send_data(data)
+        with Tracer.span("serialize", "lsp", method=getattr(data, "method", None), id=getattr(data, "id", None)):
+            return super()._send_data(data)
+
+
+class WorkspaceDocuments(BudgetedCache):
+    """Documents synced by the editor, reported but never evicted."""
+
+    def __init__(self, ls: LanguageServer):
+        self.ls = ls
+
+    def budget_info(self) -> dict:
+        workspace = self.ls.workspace
+        text_documents = list(workspace.text_documents.values())
+        source_bytes = sum(len(doc.source) for doc in text_documents)
+        return {
+            "entries": len(text_documents),
+            "bytes": source_bytes,
+            "text_documents": len(text_documents),
+            "notebook_documents": len(workspace.notebook_documents),
+            "source_bytes": source_bytes,
+        }
+
+
 class SageLanguageServer(LanguageServer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.pm = create_plugin_manager()
+        self.pm = None
+        self.state = ServerState.LOADING
         self.log = log
         self.StyleConfig = None
+        self.stats_file = None
+        self.published: Dict[str, Hashable] = {}     # uri -> fingerprint of the last published diagnostics
+        self.skipped_publishes = 0
+        self.concurrent_lint = False
+        self.plugin_diagnostics: Dict[str, Dict[str, List[types.Diagnostic]]] = {}   # uri -> plugin -> last diagnostics
+        self.monitor = LoopMonitor(self)
+        self.memory_budget = CacheBudget
+        self.memory_budget.register("workspace", WorkspaceDocuments(self))
+
+    def feature(self, feature_name: str, options=None):
+        """Register a feature, its handler is profiled when slow request profiling is enabled
+        and counted by the loop monitor while it runs."""
+        register = super().feature(feature_name, options)
+
+        def decorator(f):
+            register(self.monitor.track(Profiler.wrap(feature_name, f, self)))
+            return f
+        return decorator
+
+    @property
+    def ready(self) -> bool:
+        return self.state == ServerState.READY
 
     def refresh_styleconfig(self):
         """Refresh style configuration from workspace."""
         self.StyleConfig = StyleConfig(self.workspace)
+        config = self.StyleConfig.get_sagelsp_config()
+        DocumentStates.resize(config.get("max_documents") or MAX_DOCUMENTS)
+        lag_warning = config.get("lag_warning")
+        self.monitor.lag_warning = LAG_WARNING if lag_warning is None else lag_warning
+        idle_trim = config.get("idle_trim")
+        self.memory_budget.max_bytes = int((config.get("memory_budget") or 0) * 1024 * 1024)
+        self.memory_budget.idle_trim = IDLE_TRIM if idle_trim is None else idle_trim
+        self.concurrent_lint = bool(config.get("concurrent_lint", False))
+        if self.pm is not None:
+            self.configure_plugin_timeouts(self.pm)
+
+    def configure_plugin_timeouts(self, pm):
+        """Apply the timeouts and circuit breaker settings of `[sagelsp]` to the plugin manager."""
+        config = self.StyleConfig.get_sagelsp_config()
+        pm.configure_timeouts(
+            hook_timeout=config.get("hook_timeout") or 0.0,
+            plugin_timeouts=config.get("plugin_timeouts"),
+            breaker_threshold=config.get("breaker_threshold") or BREAKER_THRESHOLD,
+            breaker_cooldown=config.get("breaker_cooldown") or BREAKER_COOLDOWN,
+        )
+
+    def load_symbols_artifact(self):
+        """Load the prebuilt symbols cache artifact configured in `[sagelsp]`, if any."""
+        path = self.StyleConfig.get_sagelsp_config().get("symbols_artifact")
+        if not path or not SageAvaliable:
+            return
+
+        from sagelsp.symbols_cache import SymbolsCache
+        SymbolsCache.import_artifact(Path(path).expanduser())
+
+    def load(self):
+        """Load Sage and register the plugins. Runs on a background thread after `initialize`.
+
+        Plugin modules themselves are imported during the warm-up, or on the first call of one
+        of their hooks if it comes earlier or warm-up is disabled.
+        """
+        start = time.perf_counter()
+        pm = create_plugin_manager(self.StyleConfig.get_sagelsp_config().get("disabled_plugins") or [])
+        self.configure_plugin_timeouts(pm)
+
+        if SageAvaliable:
+            from sagelsp import SageVersion
+            importlib.import_module("sage.repl.preparse")
+            log.info(f"Sage {SageVersion} loaded")
+            self.load_symbols_artifact()
+
+        self.pm = pm
+        log.info(f"Plugins registered in {time.perf_counter() - start:.2f}s")
+
+    def publish_diagnostics(self, uri: str, diagnostics: List[types.Diagnostic], version: Optional[int] = None):
+        """Publish diagnostics of a document, unless they are identical to the last ones sent for it."""
+        fingerprint = tuple(_diagnostic_key(diagnostic) for diagnostic in diagnostics)
+        if self.published.get(uri) == fingerprint:
+            self.skipped_publishes += 1
+            return
+        self.published[uri] = fingerprint
+        self.text_document_publish_diagnostics(types.PublishDiagnosticsParams(
+            uri=uri,
+            diagnostics=diagnostics,
+            version=version,
+        ))
+
+    def stats(self) -> dict:
+        """Collect runtime statistics of the server."""
+        return {
+            "state": self.state.value,
+            "hooks": self.pm.stats.report() if self.pm is not None else {},
+            "tripped": self.pm.breaker.report() if self.pm is not None else {},
+            "documents": DocumentStates.occupancy(),
+            "loop": self.monitor.report(),
+            "skipped_publishes": self.skipped_publishes,
+        }
+
+    def memory(self, action: Optional[str] = None, limit: int = TOP_LIMIT) -> dict:
+        """Report process memory and cache sizes, optionally driving `tracemalloc`.
+
+        `action` is one of `start`, `stop`, `snapshot` (top allocation sites) and
+        `diff` (allocation sites that grew since the previous snapshot).
+        """
+        budget = CacheBudget.report()
+        result = {"process": process_memory(), "caches": budget.pop("caches"), "budget": budget}
+        if action == "start":
+            Memory.start()
+        elif action == "stop":
+            Memory.stop()
+        elif action == "snapshot":
+            result["top"] = Memory.snapshot(limit)
+        elif action == "diff":
+            result["top"] = Memory.diff(limit)
+        elif action is not None:
+            log.warning(f"Unknown tracemalloc action: {action}")
+        result["tracemalloc"] = Memory.report()
+        return result
+
+    def dump_stats(self):
+        """Write runtime statistics to `stats_file`, if set."""
+        if not self.stats_file:
+            return
+        try:
+            path = Path(self.stats_file).expanduser()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(self.stats(), indent=2), encoding="utf-8")
+            log.info(f"Stats written to {path}")
+        except OSError:
+            log.warning(f"Failed to write stats to {self.stats_file}", exc_info=True)
+
+    def on_loaded(self, future: asyncio.Future):
+        """Switch to ready state and lint documents opened while loading."""
+        if future.exception() is not None:
+            self.state = ServerState.FAILED
+            log.error("Failed to load plugins", exc_info=future.exception())
+            return
+
+        self.state = ServerState.READY
+        asyncio.ensure_future(self.warm_up())
+
+    def lint_open_documents(self):
+        """Lint documents that are already open, e.g. opened while loading."""
+        for nb in list(self.workspace.notebook_documents.values()):
+            lint_notebook(self, nb)
+        for doc in list(self.workspace.text_documents.values()):
+            if self.workspace.get_notebook_document(cell_uri=doc.uri) is None:
+                lint_document(self, doc)
+
+    async def warm_up(self):
+        """Warm up Sage and jedi caches so the first hover or completion is not slower than later ones.
+
+        Each step yields to pending requests before the next one starts.
+        """
+        config = self.StyleConfig.get_sagelsp_config()
+
+        # (title, function, where it runs: "loop", "executor" or a plugin worker)
+        steps = [("Linting open documents", self.lint_open_documents, "loop")]
+        if config.get("warmup", True):
+            steps.append(("Importing plugins", self.pm.load_lazy_plugins, "executor"))
+        if config.get("warmup", True) and SageAvaliable:
+            import jedi
+
+            steps.append(("Importing sage.all", _import_sage_all, "executor"))
+            for module in config.get("warmup_modules") or WARMUP_MODULES:
+                # jedi is not thread safe, preload on the worker thread of the plugins using it
+                steps.append((f"Preloading {module}", lambda module=module: jedi.preload_module(module), "jedi"))
+
+        token = await self._create_work_done_progress()
+        if token is not None:
+            self.work_done_progress.begin(token, types.WorkDoneProgressBegin(title="SageLSP warm-up", percentage=0))
+
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        for i, (title, func, where) in enumerate(steps):
+            if token is not None:
+                self.work_done_progress.report(token, types.WorkDoneProgressReport(message=title, percentage=i * 100 // len(steps)))
+            log.debug(f"Warm-up: {title}")
+            try:
+                if where == "loop":
+                    func()
+                elif where == "executor":
+                    await loop.run_in_executor(None, func)
+                else:
+                    await asyncio.wrap_future(self.pm.submit(where, func))
+            except Exception:
+                log.warning(f"Warm-up step failed: {title}", exc_info=True)
+            await asyncio.sleep(0)
+
+        if token is not None:
+            self.work_done_progress.end(token, types.WorkDoneProgressEnd(message="Done"))
+        log.info(f"Warm-up finished in {time.perf_counter() - start:.2f}s")
+
+    async def _create_work_done_progress(self):
+        """Create a server initiated progress token if the client supports it."""
+        window = self.client_capabilities.window
+        if window is None or not window.work_done_progress:
+            return None
+
+        token = f"sagelsp-warmup-{uuid.uuid4()}"
+        try:
+            await self.work_done_progress.create_async(token)
+        except Exception:
+            log.warning("Failed to create work done progress", exc_info=True)
+            return None
+        return token
 
 
 server = SageLanguageServer(
     name=NAME,
     version=__version__,
+    protocol_cls=SageLanguageServerProtocol,
     text_document_sync_kind=types.TextDocumentSyncKind.Incremental,
     notebook_document_sync=types.NotebookDocumentSyncOptions(
         notebook_selector=[
@@ -42,13 +326,76 @@ server = SageLanguageServer(
 )
 
 
+def _diagnostic_key(diagnostic: types.Diagnostic) -> Hashable:
+    start, end = diagnostic.range.start, diagnostic.range.end
+    return (
+        start.line, start.character, end.line, end.character,
+        diagnostic.severity, diagnostic.code, diagnostic.source, diagnostic.message,
+        tuple(diagnostic.tags or ()),
+        json.dumps(diagnostic.data, sort_keys=True, default=str) if diagnostic.data is not None else None,
+    )
+
+
+def _import_sage_all():
+    importlib.import_module("sage.all")
+
+
 def notebook_check(ls: SageLanguageServer, params) -> bool:
     return ls.workspace.get_notebook_document(cell_uri=params.text_document.uri) is not None
 
 
+def document_position(ls: SageLanguageServer, params) -> Tuple[TextDocument, types.Position, Optional[JupyterNotebook]]:
+    """Document and position of a request, notebook cells are answered on the virtual document of their notebook."""
+    uri = params.text_document.uri
+    nb = ls.workspace.get_notebook_document(cell_uri=uri)
+    if nb is not None:
+        notebook = get_notebook(ls, nb)
+        position = notebook.to_virtual_position(uri, params.position)
+        if position is not None:
+            return notebook.virtual_document, position, notebook
+    return ls.workspace.get_text_document(uri), params.position, None
+
+
+def ready_check(ls: SageLanguageServer, feature: str) -> bool:
+    """Requests arriving before plugins are loaded get degraded (empty) answers instead of blocking."""
+    if not ls.ready:
+        log.info(f"Server is {ls.state.value}, answering {feature} in degraded mode")
+        return False
+    return True
+
+
 @server.feature(types.INITIALIZE)
 def initialize(ls: SageLanguageServer, params):
     ls.refresh_styleconfig()
+    ls.monitor.start()
+    asyncio.ensure_future(ls.memory_budget.run())
+    loading = asyncio.get_running_loop().run_in_executor(None, ls.load)
+    loading.add_done_callback(ls.on_loaded)
+
+
+@server.feature("sagelsp/status")
+def status(ls: SageLanguageServer, params) -> dict:
+    """Report the readiness state of the server."""
+    return {"state": ls.state.value}
+
+
+@server.feature("sagelsp/stats")
+def stats(ls: SageLanguageServer, params) -> dict:
+    """Report per-plugin hook latencies and other runtime statistics."""
+    return ls.stats()
+
+
+@server.feature("sagelsp/memory")
+def memory(ls: SageLanguageServer, params) -> dict:
+    """Report memory usage. `params` may hold a `tracemalloc` action and a `limit` of reported sites."""
+    return ls.memory(getattr(params, "tracemalloc", None), getattr(params, "limit", None) or TOP_LIMIT)
+
+
+@server.feature(types.SHUTDOWN)
+def shutdown(ls: SageLanguageServer, params):
+    ls.monitor.stop()
+    ls.dump_stats()
+    Tracer.stop()
 
 
 @server.feature(types.WORKSPACE_DID_CHANGE_CONFIGURATION)
@@ -64,8 +411,17 @@ def notebook_open_change(ls: SageLanguageServer, params: Union[types.DidOpenNote
     log.info(f"[notebook] uri={params.notebook_document.uri} version={params.notebook_document.version}")
     if nb is None:
         return
+    if isinstance(params, types.DidOpenNotebookDocumentParams):
+        DocumentStates.open(nb.uri)
+    if not ready_check(ls, "notebook lint"):
+        return
+
+    lint_notebook(ls, nb)
 
-    notebook = JupyterNotebook(ls, nb)
+
+def lint_notebook(ls: SageLanguageServer, nb: types.NotebookDocument):
+    """Lint a notebook and publish diagnostics for its cells."""
+    notebook = get_notebook(ls, nb)
     doc = notebook.virtual_document
 
     # Handle semantic linting for notebook in virtual document
@@ -73,30 +429,22 @@ def notebook_open_change(ls: SageLanguageServer, params: Union[types.DidOpenNote
     virtual_diagnostics = [diag for plugin_diags in all_diagnostics for diag in plugin_diags]
     diagnostics_semantic = notebook.map_diagnostics(virtual_diagnostics)
 
-    # Handle style linting for notebook in original cell documents
-    diagnostics_style: dict[str, List[types.Diagnostic]] = {}
-    for cell in notebook.cells:
-        if cell.kind != types.NotebookCellKind.Code:
-            continue
-        cell_doc = ls.workspace.get_text_document(cell.document)
-        if cell_doc.language_id != LANGUAGE_ID:
-            continue
+    # Handle style linting for notebook in original cell documents, only for cells changed since last time
+    def style_lint(cell_doc: TextDocument) -> List[types.Diagnostic]:
         all_diagnostics: List[List[types.Diagnostic]] = ls.pm.hook.sagelsp_style_lint(doc=cell_doc, config=ls.StyleConfig, notebook=True)
-        diagnostics = [diag for plugin_diags in all_diagnostics for diag in plugin_diags]
+        return [diag for plugin_diags in all_diagnostics for diag in plugin_diags]
 
-        diagnostics_style[cell.document] = diagnostics
+    diagnostics_style: dict[str, List[types.Diagnostic]] = {}
+    for cell_uri in notebook.cell_uris:
+        cell_doc = ls.workspace.get_text_document(cell_uri)
+        diagnostics_style[cell_uri] = notebook.style_diagnostics(cell_doc, ls.StyleConfig.config_hash, style_lint)
 
     # publish diagnostics with semantic and style diagnostics
     diagnostics_all = notebook.merge_diagnostics(diagnostics_semantic, diagnostics_style)
 
     for cell_uri, diagnostics in diagnostics_all.items():
         cell_doc = ls.workspace.get_text_document(cell_uri)
-        params = types.PublishDiagnosticsParams(
-            uri=cell_uri,
-            diagnostics=diagnostics,
-            version=cell_doc.version,
-        )
-        ls.text_document_publish_diagnostics(params)
+        ls.publish_diagnostics(cell_uri, diagnostics, cell_doc.version)
 
 
 @server.feature(types.TEXT_DOCUMENT_DID_OPEN)
@@ -105,21 +453,80 @@ def open_change(ls: SageLanguageServer, params: Union[types.DidOpenTextDocumentP
     """Handle document open and change events to trigger linting."""
     if notebook_check(ls, params):   # Seems that it'll not appear
         return
+
+    # Edited lines let plugins re-check only part of the document
+    if isinstance(params, types.DidChangeTextDocumentParams):
+        state = DocumentStates.get_or_create(params.text_document.uri)
+        state.record_changes(params.text_document.version, params.content_changes)
+    else:
+        state = DocumentStates.open(params.text_document.uri)
+        state.reset_edits(params.text_document.version)
+
+    if not ready_check(ls, "lint"):
+        return
     doc: TextDocument = ls.workspace.get_text_document(doc_uri=params.text_document.uri)
-    all_diagnostics: List[List[types.Diagnostic]] = ls.pm.hook.sagelsp_lint(doc=doc, config=ls.StyleConfig)
+    lint_document(ls, doc)
+
+
+def lint_document(ls: SageLanguageServer, doc: TextDocument):
+    """Lint a text document and publish its diagnostics."""
+    if ls.concurrent_lint:
+        lint_document_concurrently(ls, doc)
+        return
+    all_diagnostics: List[List[types.Diagnostic]] = ls.pm.hook.sagelsp_lint(doc=doc, config=ls.StyleConfig, notebook=False)
     diagnostics = [diag for plugin_diags in all_diagnostics for diag in plugin_diags]
+    ls.publish_diagnostics(doc.uri, diagnostics, doc.version)
 
-    params = types.PublishDiagnosticsParams(
-        uri=doc.uri,
-        diagnostics=diagnostics,
-        version=doc.version,
-    )
-    ls.text_document_publish_diagnostics(params)
+
+def lint_document_concurrently(ls: SageLanguageServer, doc: TextDocument):
+    """Run the lint plugins concurrently and publish as soon as each one finishes.
+
+    Plugins still running keep their diagnostics of the previous run until their new ones arrive.
+    Diagnostics of plugins that failed or were skipped are dropped once all plugins are done.
+    """
+    latest = ls.plugin_diagnostics.setdefault(doc.uri, {})
+    reported = set()
+
+    def publish(plugin_name: str, diagnostics: List[types.Diagnostic]):
+        reported.add(plugin_name)
+        latest[plugin_name] = diagnostics
+        merged = [diag for name in sorted(latest) for diag in latest[name]]
+        ls.publish_diagnostics(doc.uri, merged, doc.version)
+
+    ls.pm.call_concurrent("sagelsp_lint", dict(doc=doc, config=ls.StyleConfig, notebook=False), publish)
+
+    stale = set(latest) - reported
+    if stale:
+        for name in stale:
+            del latest[name]
+        ls.publish_diagnostics(doc.uri, [diag for name in sorted(latest) for diag in latest[name]], doc.version)
+
+
+@server.feature(types.TEXT_DOCUMENT_DID_CLOSE)
+def close(ls: SageLanguageServer, params: types.DidCloseTextDocumentParams):
+    """Handle document close events to drop per-document state."""
+    DocumentStates.evict(params.text_document.uri)
+    ls.published.pop(params.text_document.uri, None)
+    ls.plugin_diagnostics.pop(params.text_document.uri, None)
+    log.info(f"Closed {params.text_document.uri}, document states: {DocumentStates.occupancy()}")
+
+
+@server.feature(types.NOTEBOOK_DOCUMENT_DID_CLOSE)
+def notebook_close(ls: SageLanguageServer, params: types.DidCloseNotebookDocumentParams):
+    """Handle notebook close events to drop per-document state of the notebook and its cells."""
+    DocumentStates.evict(params.notebook_document.uri)
+    Notebooks.pop(params.notebook_document.uri)
+    for cell in params.cell_text_documents:
+        DocumentStates.evict(cell.uri)
+        ls.published.pop(cell.uri, None)
+    log.info(f"[notebook] Closed {params.notebook_document.uri}, document states: {DocumentStates.occupancy()}")
 
 
 @server.feature(types.TEXT_DOCUMENT_FORMATTING)
 def format_document(ls: SageLanguageServer, params: types.DocumentFormattingParams) -> List[types.TextEdit]:
     """Format the entire document."""
+    if not ready_check(ls, "formatting"):
+        return []
     doc: TextDocument = ls.workspace.get_text_document(params.text_document.uri)
     all_edits: List[List[types.TextEdit]] = ls.pm.hook.sagelsp_format_document(doc=doc, config=ls.StyleConfig, notebook=notebook_check(ls, params))
     edits = [edit for plugin_edits in all_edits for edit in plugin_edits]
@@ -130,6 +537,8 @@ def format_document(ls: SageLanguageServer, params: types.DocumentFormattingPara
 @server.feature(types.TEXT_DOCUMENT_RANGE_FORMATTING)
 def format_range(ls: SageLanguageServer, params: types.DocumentRangeFormattingParams) -> List[types.TextEdit]:
     """Format a range of the document."""
+    if not ready_check(ls, "range formatting"):
+        return []
     doc: TextDocument = ls.workspace.get_text_document(params.text_document.uri)
     start_line = params.range.start.line
     end_line = params.range.end.line
@@ -139,59 +548,93 @@ def format_range(ls: SageLanguageServer, params: types.DocumentRangeFormattingPa
     return edits
 
 
+@server.feature(
+    types.TEXT_DOCUMENT_ON_TYPE_FORMATTING,
+    types.DocumentOnTypeFormattingOptions(
+        first_trigger_character="\n",
+        more_trigger_character=[":"],
+    )
+)
+def format_on_type(ls: SageLanguageServer, params: types.DocumentOnTypeFormattingParams) -> List[types.TextEdit]:
+    """Format the line completed by a newline or the colon of a block header."""
+    if not ready_check(ls, "on type formatting"):
+        return []
+    doc: TextDocument = ls.workspace.get_text_document(params.text_document.uri)
+    all_edits: List[List[types.TextEdit]] = ls.pm.hook.sagelsp_format_on_type(doc=doc, position=params.position, ch=params.ch, config=ls.StyleConfig, notebook=notebook_check(ls, params))
+    edits = [edit for plugin_edits in all_edits for edit in plugin_edits]
+
+    return edits
+
+
 @server.feature(types.TEXT_DOCUMENT_DEFINITION)
 def definition(ls: SageLanguageServer, params: types.DefinitionParams) -> List[types.Location]:
     """Provide definition for a symbol."""
-    doc: TextDocument = ls.workspace.get_text_document(params.text_document.uri)
-    position: types.Position = params.position
+    if not ready_check(ls, "definition"):
+        return []
+    doc, position, notebook = document_position(ls, params)
     all_locations: List[List[types.Location]] = ls.pm.hook.sagelsp_definition(doc=doc, position=position)
     locations = [loc for plugin_locs in all_locations for loc in plugin_locs]
 
+    if notebook is not None:
+        locations = notebook.map_locations(locations)
     return locations
 
 
 @server.feature(types.TEXT_DOCUMENT_TYPE_DEFINITION)
 def type_definition(ls: SageLanguageServer, params: types.TypeDefinitionParams) -> List[types.Location]:
     """Provide type definition for a symbol."""
-    doc: TextDocument = ls.workspace.get_text_document(params.text_document.uri)
-    position: types.Position = params.position
+    if not ready_check(ls, "type definition"):
+        return []
+    doc, position, notebook = document_position(ls, params)
     all_locations: List[List[types.Location]] = ls.pm.hook.sagelsp_type_definition(doc=doc, position=position)
     locations = [loc for plugin_locs in all_locations for loc in plugin_locs]
 
+    if notebook is not None:
+        locations = notebook.map_locations(locations)
     return locations
 
 
 @server.feature(types.TEXT_DOCUMENT_REFERENCES)
 def references(ls: SageLanguageServer, params: types.ReferenceParams) -> List[types.Location]:
     """Provide reference for a symbol."""
-    doc: TextDocument = ls.workspace.get_text_document(params.text_document.uri)
-    position: types.Position = params.position
+    if not ready_check(ls, "references"):
+        return []
+    doc, position, notebook = document_position(ls, params)
     all_locations: List[List[types.Location]] = ls.pm.hook.sagelsp_references(doc=doc, position=position)
     locations = [loc for plugin_locs in all_locations for loc in plugin_locs]
 
+    if notebook is not None:
+        locations = notebook.map_locations(locations)
     return locations
 
 
 @server.feature(types.TEXT_DOCUMENT_HOVER)
 def hover(ls: SageLanguageServer, params: types.HoverParams) -> types.Hover:
     """Provide hover information for symbols."""
-    doc: TextDocument = ls.workspace.get_text_document(params.text_document.uri)
-    position: types.Position = params.position
+    if not ready_check(ls, "hover"):
+        return None
+    doc, position, notebook = document_position(ls, params)
     hover_info = ls.pm.hook.sagelsp_hover(doc=doc, position=position)
 
     # In theory, there should be only one hover result, just check for safety
     if len(hover_info) > 1:
         log.warning(f"Multiple hover results for {doc.uri} at line {position.line + 1}, char {position.character}: {len(hover_info)} results")
 
-    if hover_info:
-        return hover_info[0]
-    else:
+    if not hover_info:
         return None
 
+    hover = hover_info[0]
+    if notebook is not None and hover.range is not None:
+        mapped = notebook.map_range(hover.range)
+        hover.range = mapped[1] if mapped is not None else None
+    return hover
+
 
 @server.feature(types.TEXT_DOCUMENT_FOLDING_RANGE)
 def folding_range(ls: SageLanguageServer, params: types.FoldingRangeParams) -> List[types.FoldingRange]:
     """Provide folding ranges for the document."""
+    if not ready_check(ls, "folding range"):
+        return []
     doc: TextDocument = ls.workspace.get_text_document(params.text_document.uri)
     all_folding_ranges: List[List[types.FoldingRange]] = ls.pm.hook.sagelsp_folding_range(doc=doc)
     folding_ranges = [fr for plugin_frs in all_folding_ranges for fr in plugin_frs]
@@ -209,6 +652,8 @@ def folding_range(ls: SageLanguageServer, params: types.FoldingRangeParams) -> L
 )
 def code_actions(params: types.CodeActionParams) -> List[types.CodeAction]:
     """Provide code actions for a given range."""
+    if not ready_check(server, "code actions"):
+        return []
     diagnostics: List[types.Diagnostic] = params.context.diagnostics
     uri: str = params.text_document.uri
     all_code_actions: List[List[types.CodeAction]] = server.pm.hook.sagelsp_code_actions(uri=uri, diagnostics=diagnostics)
@@ -226,8 +671,9 @@ def code_actions(params: types.CodeActionParams) -> List[types.CodeAction]:
 )
 def completion(params: types.CompletionParams) -> List[types.CompletionItem]:
     """Provide completion for a symbol."""
-    doc: TextDocument = server.workspace.get_text_document(params.text_document.uri)
-    position: types.Position = params.position
+    if not ready_check(server, "completion"):
+        return []
+    doc, position, _ = document_position(server, params)
     all_completions: List[List[types.CompletionItem]] = server.pm.hook.sagelsp_completion(doc=doc, position=position)
     completions = [comp for plugin_comps in all_completions for comp in plugin_comps]
 
@@ -1,17 +1,21 @@
 from sagelsp import CachePath, SageAvaliable
-from typing import Optional
+from typing import Optional, Tuple
 from pathlib import Path
 from enum import IntEnum
 import sqlite3
 import logging
+import json
+import gzip
+import os
+import sagelsp
 
-if SageAvaliable:
-    from sage.misc.dev_tools import import_statements   # type: ignore
+from sagelsp.memory_budget import BudgetedCache, CacheBudget
 
 log = logging.getLogger(__name__)
 
 
 CACHE_VERSION = 1
+ARTIFACT_FORMAT = 1     # version of the exported artifact layout, independent from CACHE_VERSION
 
 
 class SymbolStatus(IntEnum):
@@ -27,7 +31,17 @@ class Symbol:
         self.import_path = import_path
 
 
-class SymbolsCacheBase:
+def _artifact_row(row) -> Tuple[str, str, int]:
+    """Check one `[name, import_path, status]` row of an artifact, raise ValueError if it is malformed."""
+    name, import_path, status = row
+    if not isinstance(name, str) or not isinstance(import_path, str):
+        raise ValueError(f"symbol {row!r} has a name or import path that is not a string")
+    if type(status) is not int or status not in {member.value for member in SymbolStatus}:
+        raise ValueError(f"symbol {row!r} has an unknown status")
+    return name, import_path, status
+
+
+class SymbolsCacheBase(BudgetedCache):
     def __init__(self, cachePath: Path):
         self.cachePath = Path(cachePath)
         self.cachePath.parent.mkdir(parents=True, exist_ok=True)
@@ -102,8 +116,118 @@ class SymbolsCacheBase:
             self.conn.rollback()
             raise
 
+    def occupancy(self) -> dict:
+        """Report the number of symbols and the size of the database."""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM symbols")
+        symbols = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_count")
+        page_count = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_size")
+        page_size = cursor.fetchone()[0]
+        return {"entries": symbols, "db_bytes": page_count * page_size}
+
+    def budget_info(self) -> dict:
+        # Only the page cache of the connection lives in memory, SQLite keeps it under 2 MiB by default
+        occupancy = self.occupancy()
+        return {**occupancy, "bytes": min(occupancy["db_bytes"], 2 * 1024 * 1024)}
+
+    def budget_trim(self, idle_since: float):
+        self.conn.execute("PRAGMA shrink_memory")
+
+    def export_artifact(self, path: Path) -> int:
+        """Export the whole symbol table into a compact read-only artifact.
+
+        The artifact is a gzip compressed JSON document that can be loaded in one pass.
+        Returns the number of exported symbols.
+        """
+        path = Path(path)
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT name, import_path, status FROM symbols ORDER BY name")
+        rows = cursor.fetchall()
+
+        artifact = {
+            "format": ARTIFACT_FORMAT,
+            "cache_version": CACHE_VERSION,
+            "sage_version": sagelsp.SageVersion,
+            "symbols": [[name, import_path or "", status] for name, import_path, status in rows],
+        }
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        # A read-only leftover of an interrupted export can't be opened for writing
+        tmp_path.unlink(missing_ok=True)
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(artifact, f, separators=(",", ":"))
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, path)
+
+        log.info(f"Exported {len(rows)} symbols to {path}")
+        return len(rows)
+
+    def import_artifact(self, path: Path, force: bool = False) -> int:
+        """Import symbols from an artifact created by `export_artifact`.
+
+        Symbols already resolved locally are kept. An artifact built for another Sage version
+        is refused unless `force` is set. A malformed artifact is skipped. Returns the number of
+        newly inserted symbols.
+        """
+        path = Path(path)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                artifact = json.load(f)
+        except (OSError, ValueError) as e:
+            log.error(f"Failed to read symbols artifact {path}: {e}")
+            return 0
+        if not isinstance(artifact, dict):
+            log.error(f"Symbols artifact {path} is not a JSON object, skipped")
+            return 0
+
+        if artifact.get("format") != ARTIFACT_FORMAT or artifact.get("cache_version") != CACHE_VERSION:
+            log.error(
+                "Symbols artifact %s has format=%s cache_version=%s, expected format=%s cache_version=%s",
+                path,
+                artifact.get("format"),
+                artifact.get("cache_version"),
+                ARTIFACT_FORMAT,
+                CACHE_VERSION,
+            )
+            return 0
+
+        if artifact.get("sage_version") != sagelsp.SageVersion and not force:
+            log.warning(
+                "Symbols artifact %s was built for Sage %r but current Sage is %r, skipped",
+                path,
+                artifact.get("sage_version"),
+                sagelsp.SageVersion,
+            )
+            return 0
+
+        cursor = self.conn.cursor()
+        try:
+            rows = [_artifact_row(row) for row in artifact.get("symbols", [])]
+            before = self.conn.total_changes
+            cursor.executemany("""
+            INSERT OR IGNORE INTO symbols (name, import_path, status)
+            VALUES (?, ?, ?)
+            """, rows)
+            self.conn.commit()
+            inserted = self.conn.total_changes - before
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self.conn.rollback()
+            log.error(f"Symbols artifact {path} has malformed symbols, skipped: {e}")
+            return 0
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        log.info(f"Imported {inserted} symbols from {path}")
+        return inserted
+
     def _check_and_cache(self, name: str) -> Symbol:
         if SageAvaliable:
+            from sage.misc.dev_tools import import_statements   # type: ignore
+
             try:
                 import_str = import_statements(name, answer_as_str=True)
                 import_path = self._parse_import_str(import_str)
@@ -161,3 +285,4 @@ class SymbolsCacheBase:
 
 DBPath = Path(CachePath) / "symbols_cache.db"
 SymbolsCache = SymbolsCacheBase(DBPath)
+CacheBudget.register("symbols_cache", SymbolsCache)
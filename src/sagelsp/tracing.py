@@ -0,0 +1,122 @@
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer: "SpanTracer", name: str, category: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.emit(self.name, self.category, self.start, time.perf_counter() - self.start, self.args)
+        return False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class SpanTracer:
+    """Write spans as Chrome Trace Event JSON, viewable in Perfetto or chrome://tracing.
+
+    Events are streamed to the file as they end, so a trace survives a crash
+    (the closing bracket of the array is optional in this format).
+    """
+
+    def __init__(self):
+        self.path: Optional[Path] = None
+        self._file = None
+        self._threads = set()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._file is not None
+
+    def start(self, path: Union[str, Path]):
+        path = Path(path).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._file = open(path, "w", encoding="utf-8")
+            self._file.write("[\n")
+            self._threads.clear()
+            self.path = path
+        log.info(f"Writing trace to {path}")
+
+    def stop(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps({"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": "sagelsp"}}))
+            self._file.write("\n]\n")
+            self._file.close()
+            self._file = None
+        log.info(f"Trace written to {self.path}")
+
+    def span(self, name: str, category: str = "sagelsp", **args: Any):
+        """Context manager recording a span, a no-op while tracing is disabled."""
+        if self._file is None:
+            return _NULL_SPAN
+        return _Span(self, name, category, args)
+
+    def traced(self, name: str, category: str = "sagelsp") -> Callable:
+        """Decorator recording a span for each call of a function."""
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if self._file is None:
+                    return func(*args, **kwargs)
+                with _Span(self, name, category, {}):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def emit(self, name: str, category: str, start: float, duration: float, args: Optional[dict] = None):
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": duration * 1e6,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+        }
+        if args:
+            event["args"] = args
+
+        with self._lock:
+            if self._file is None:
+                return
+            if thread.ident not in self._threads:
+                self._threads.add(thread.ident)
+                self._file.write(json.dumps({
+                    "name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread.ident, "args": {"name": thread.name},
+                }) + ",\n")
+            self._file.write(json.dumps(event, default=str) + ",\n")
+
+
+Tracer = SpanTracer()
@@ -15,6 +15,7 @@ def client():
     lsp = LSPClient([sys.executable, "-m", "sagelsp", "--log", "DEBUG"])
     lsp.start()
     lsp.initialize()  # Auto-initialize for all tests
+    lsp.wait_ready()  # Plugins are loaded in background after initialize
     
     yield lsp
     
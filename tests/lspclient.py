@@ -1,9 +1,73 @@
 from typing import Any, Dict
 from lspclientbase import LSPClientBase
 import sys
+import time
 
 
 class LSPClient(LSPClientBase):
+    def status(self) -> Dict[str, Any]:
+        """
+        Request readiness state of the server
+
+        Returns:
+            Status response result, e.g. {"state": "ready"}
+        """
+        request_id = self.send_request("sagelsp/status", {})
+
+        response = self.read_response(expected_id=request_id)
+        return response.get("result")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Request runtime statistics of the server
+
+        Returns:
+            Stats response result with per-plugin hook latencies
+        """
+        request_id = self.send_request("sagelsp/stats", {})
+
+        response = self.read_response(expected_id=request_id)
+        return response.get("result")
+
+    def memory(self, tracemalloc: str = None, limit: int = None) -> Dict[str, Any]:
+        """
+        Request memory usage of the server
+
+        Args:
+            tracemalloc: Optional tracemalloc action: start, stop, snapshot or diff
+            limit: Number of allocation sites to report
+
+        Returns:
+            Memory response result with cache sizes
+        """
+        params = {}
+        if tracemalloc is not None:
+            params["tracemalloc"] = tracemalloc
+        if limit is not None:
+            params["limit"] = limit
+        request_id = self.send_request("sagelsp/memory", params)
+
+        response = self.read_response(expected_id=request_id)
+        return response.get("result")
+
+    def wait_ready(self, timeout: float = 60, interval: float = 0.1):
+        """
+        Wait until the server finished loading plugins
+
+        Args:
+            timeout: Maximum seconds to wait
+            interval: Seconds between two status requests
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            state = self.status()["state"]
+            if state == "ready":
+                return
+            if state == "failed":
+                raise RuntimeError("Server failed to load plugins")
+            time.sleep(interval)
+        raise TimeoutError("Server is not ready")
+
     def hover(self, uri: str, line: int, character: int) -> Dict[str, Any]:
         """
         Request hover information
@@ -94,6 +158,32 @@ class LSPClient(LSPClientBase):
         response = self.read_response(expected_id=request_id)
         return response.get("result")
 
+    def on_type_formatting(self, uri: str, line: int, character: int, ch: str):
+        """
+        Request formatting after a character is typed
+
+        Args:
+            uri: Document URI
+            line: Line number (0-based) of the position after the character
+            character: Character offset (0-based) of the position after the character
+            ch: Typed character
+
+        Returns:
+            List of TextEdits for formatting
+        """
+        request_id = self.send_request("textDocument/onTypeFormatting", {
+            "textDocument": {"uri": uri},
+            "position": {"line": line, "character": character},
+            "ch": ch,
+            "options": {
+                "tabSize": 4,
+                "insertSpaces": True
+            }
+        })
+
+        response = self.read_response(expected_id=request_id)
+        return response.get("result")
+
     def definition(self, uri: str, line: int, character: int):
         """
         Request definition locations
@@ -56,7 +56,7 @@ class LSPClientBase:
             "id": self.request_id,
             "method": method,
         }
-        if params:
+        if params is not None:  # Check for None instead of truthiness
             request["params"] = params
         
         content = json.dumps(request)
@@ -1,4 +1,9 @@
+import autopep8
 import pytest
+import statistics
+import time
+from types import SimpleNamespace
+from lsprotocol import types
 from pygls.workspace import TextDocument
 
 # Code containing multiple pycodestyle errors
@@ -24,5 +29,204 @@ def test_pycodestyle_diagnostics(client):
     )
 
 
+class FormatConfig:
+    def __init__(self, **sagelsp):
+        self.sagelsp = sagelsp
+
+    def get_autopep8_config(self, line_range=None):
+        return {} if line_range is None else {"line_range": line_range}
+
+    def get_sagelsp_config(self):
+        return self.sagelsp
+
+
+def apply_edits(text, edits):
+    """Apply LSP edits of an ASCII text."""
+    lines = text.splitlines(keepends=True)
+
+    def offset(position):
+        return sum(len(line) for line in lines[:position.line]) + position.character
+
+    for edit in sorted(edits, key=lambda edit: (edit.range.start.line, edit.range.start.character), reverse=True):
+        text = text[:offset(edit.range.start)] + edit.new_text + text[offset(edit.range.end):]
+    return text
+
+
+def test_minimal_edits():
+    """Formatting one line of a long document only edits the changed characters"""
+    from sagelsp.plugins.autopep8_format import sagelsp_format_document
+
+    source = "".join(f"x{i} = {i}\n" for i in range(1200)) + "y=1\n"
+    doc = TextDocument(uri="file:///minimal_edits.py", source=source)
+
+    edits = sagelsp_format_document(doc=doc, config=FormatConfig(), notebook=False)
+    assert [(edit.range.start.line, edit.range.start.character, edit.range.end.character, edit.new_text) for edit in edits] == [(1200, 1, 2, " = ")]
+    assert apply_edits(source, edits) == source.replace("y=1", "y = 1")
+
+    # Above the cap, the document is replaced as a whole
+    edits = sagelsp_format_document(doc=doc, config=FormatConfig(format_diff_max_lines=1000), notebook=False)
+    assert len(edits) == 1 and edits[0].range.end.line == 1201
+    assert edits[0].new_text == source.replace("y=1", "y = 1")
+
+
+def test_minimal_edits_lines():
+    """Inserted, deleted and reordered lines give edits reproducing the new source"""
+    from sagelsp.plugins.autopep8_format import minimal_edits
+
+    source = "import os\ndef f():\n    return 1\nx = [1,2]\n\n\ny = 2"
+    new_source = "import os\n\n\ndef f():\n    return 1\n\n\nx = [1, 2]\n\ny = 2\n"
+    assert apply_edits(source, minimal_edits(source, new_source)) == new_source
+    assert minimal_edits(source, source) == []
+
+
+def test_format_range_region():
+    """Range formatting only formats the statements around the selection"""
+    from sagelsp.plugins.autopep8_format import sagelsp_format_range
+
+    source = """\
+import os
+def f( x ):
+    s = \"\"\"
+a=1
+\"\"\"
+    if x :
+        return  x
+    else:
+        return 2
+""" + "".join(f"x{i}=[{i},{i}]\n" for i in range(1000))
+    doc = TextDocument(uri="file:///format_range.py", source=source)
+
+    def format_lines(start, end):
+        edits = sagelsp_format_range(doc=doc, start_line=start, end_line=end, config=FormatConfig(), notebook=False)
+        return [(edit.range.start.line, edit.range.start.character, edit.range.end.line, edit.range.end.character, edit.new_text) for edit in edits]
+
+    # Inside a string
+    assert format_lines(3, 3) == []
+    assert format_lines(6, 6) == [(6, 15, 6, 16, "")]
+    assert format_lines(5, 8) == [(5, 8, 5, 9, ""), (6, 15, 6, 16, "")]
+    assert format_lines(509, 509) == [(509, 4, 509, 10, " = [500, ")]
+
+
+def test_format_range_blank_lines():
+    """Blank lines above the first selected statement are fixed like in the whole document"""
+    from sagelsp.plugins.autopep8_format import sagelsp_format_range
+
+    def format_lines(source, start, end):
+        doc = TextDocument(uri="file:///format_range_blank_lines.py", source=source)
+        edits = sagelsp_format_range(doc=doc, start_line=start, end_line=end, config=FormatConfig(), notebook=False)
+        return [(edit.range.start.line, edit.range.start.character, edit.range.end.line, edit.range.end.character, edit.new_text) for edit in edits]
+
+    assert format_lines("x = 1\ndef f():\n    pass\n", 1, 2) == [(1, 0, 1, 0, "\n\n")]
+    assert format_lines("x = 1\n\n\n\n\ndef f():\n    pass\n", 5, 6) == [(3, 0, 5, 0, "")]
+    assert format_lines("def f():\n    pass\nx = 1\n", 2, 2) == [(2, 0, 2, 0, "\n\n")]
+    # The statement before is left as it is
+    assert format_lines("x=1\ndef f():\n    pass\n", 1, 1) == [(1, 0, 1, 0, "\n\n")]
+    assert format_lines("x = 1\nimport os\n", 1, 1) == []
+
+    # The diff of a fix may reach outside the selected lines
+    source = "def f( a ):\n    return  a\n\n\n\ndef f( a ):\n    return  a\nx=1\ndef f( a ):\n    return  a\n\n"
+    doc = TextDocument(uri="file:///format_range_blank_lines.py", source=source)
+    edits = sagelsp_format_range(doc=doc, start_line=5, end_line=9, config=FormatConfig(), notebook=False)
+    assert apply_edits(source, edits) == autopep8.fix_code(source, options={"line_range": [6, 10]})
+
+
+def test_format_cache():
+    """Formatting the same content with the same options again is answered from the cache"""
+    from sagelsp.plugins.autopep8_format import FormatCache, sagelsp_format_document, sagelsp_format_range
+
+    FormatCache.clear()
+    source = "x=1\ny = 2\n"
+    doc = TextDocument(uri="file:///format_cache.py", source=source)
+    edits = sagelsp_format_document(doc=doc, config=FormatConfig(), notebook=False)
+    hits = FormatCache.hits
+    assert sagelsp_format_document(doc=doc, config=FormatConfig(), notebook=False) == edits
+    assert FormatCache.hits == hits + 1
+
+    # Already formatted content is stored as unchanged
+    formatted = TextDocument(uri="file:///format_cache.py", source=apply_edits(source, edits))
+    assert sagelsp_format_document(doc=formatted, config=FormatConfig(), notebook=False) == []
+    assert sagelsp_format_document(doc=formatted, config=FormatConfig(), notebook=False) == []
+    assert FormatCache.hits == hits + 2
+
+    # Options and line ranges are part of the key
+    sagelsp_format_range(doc=doc, start_line=1, end_line=1, config=FormatConfig(), notebook=False)
+    assert FormatCache.hits == hits + 2
+    assert len(FormatCache) == 3
+
+
+def test_on_type_formatting(client):
+    """A newline or the colon of a block header formats the completed logical line only"""
+    uri = "file:///test_on_type.sage"
+    client.did_open(uri=uri, text="def f( x ) :\n    y=x+1\n    z = [1,\n", language_id="sagemath", version=1)
+
+    edits = client.on_type_formatting(uri, 1, 0, "\n")
+    assert [(edit["range"]["start"]["line"], edit["newText"]) for edit in edits] == [(0, "x)")]
+    assert [edit["newText"] for edit in client.on_type_formatting(uri, 2, 0, "\n")] == [" = "]
+    # The list is not closed
+    assert client.on_type_formatting(uri, 3, 0, "\n") == []
+
+
+def test_on_type_formatting_latency(tmp_path, monkeypatch):
+    """Benchmark: formatting on type stays under 10ms on a 5k lines document"""
+    import pycodestyle
+    from sagelsp.config import StyleConfig
+    from sagelsp.document_state import DocumentStates
+    from sagelsp.plugins.autopep8_format import sagelsp_format_on_type
+
+    # Default options, whatever the user configured globally
+    monkeypatch.setattr(pycodestyle, "USER_CONFIG", str(tmp_path / "pycodestyle"))
+    config = StyleConfig(SimpleNamespace(root_path=None))
+    uri = "file:///on_type_latency.py"
+    lines = [line for i in range(1000) for line in (f"def f{i}(x):\n", f"    y = x + {i}\n", "    return y\n", "\n", "\n")]
+    state = DocumentStates.get_or_create(uri)
+    state.reset_edits(0)
+    doc = TextDocument(uri=uri, source="".join(lines), version=0)
+    sagelsp_format_on_type(doc=doc, position=types.Position(line=2, character=0), ch="\n", config=config, notebook=False)
+
+    timings = []
+    for version in range(1, 41):
+        # Type a statement and a newline in the body of a function
+        line = (version * 97) % 1000 * 5 + 2
+        lines.insert(line, "    z=1\n")
+        start = types.Position(line=line, character=0)
+        state.record_changes(version, [SimpleNamespace(range=types.Range(start=start, end=start), text="    z=1\n")])
+        doc = TextDocument(uri=uri, source="".join(lines), version=version)
+
+        begin = time.perf_counter()
+        edits = sagelsp_format_on_type(doc=doc, position=types.Position(line=line + 1, character=0), ch="\n", config=config, notebook=False)
+        timings.append(time.perf_counter() - begin)
+        assert [(edit.range.start.line, edit.new_text) for edit in edits] == [(line, " = ")]
+
+    DocumentStates.evict(uri)
+    assert statistics.median(timings) < 0.010
+
+
+def test_on_type_options(tmp_path, monkeypatch):
+    """The StyleGuide of format on type follows the configuration, and autopep8 internals are optional"""
+    import pycodestyle
+    from sagelsp.config import StyleConfig
+    from sagelsp.plugins import autopep8_format
+    from sagelsp.plugins.autopep8_format import _fix_lines
+
+    monkeypatch.setattr(pycodestyle, "USER_CONFIG", str(tmp_path / "pycodestyle"))
+    (tmp_path / "setup.cfg").write_text("[pycodestyle]\nindent-size = 2\nmax-doc-length = 72\n")
+    config = StyleConfig(SimpleNamespace(root_path=str(tmp_path)))
+
+    options, style = config.get_autopep8_options()
+    assert options.indent_size == 2
+    assert (style.options.indent_size, style.options.max_doc_length) == (2, 72)
+    assert "max_doc_length" not in config.get_autopep8_config()
+
+    assert _fix_lines(["if x :\n", "  y=1\n"], options, style) == ["if x:\n", "  y = 1\n"]
+
+    # `FixPEP8._fix_source` changed
+    def changed(source, options, style):
+        raise AttributeError("'FixPEP8' object has no attribute '_fix_source'")
+
+    monkeypatch.setattr(autopep8_format, "_fix_source", changed)
+    assert _fix_lines(["if x :\n", "  y=1\n"], options, style) == ["if x:\n", "  y = 1\n"]
+    assert _fix_lines(["y = 1\n"], options, style) is None
+
+
 if __name__ == "__main__":
     pytest.main([__file__])
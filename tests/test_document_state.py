@@ -0,0 +1,85 @@
+import time
+import pytest
+
+from sagelsp.document_state import DocumentStateStore
+from sagelsp.memory_budget import MemoryBudget
+
+
+def test_evict_on_close():
+    store = DocumentStateStore(max_documents=4)
+    state = store.get_or_create("file:///a.sage")
+    state.update_names({"Foo": "sage.foo"}, {"ZZ": "sage.rings.integer_ring"}, {})
+
+    assert store.get("file:///a.sage").all_names == {"Foo": "sage.foo", "ZZ": "sage.rings.integer_ring"}
+    assert store.evict("file:///a.sage")
+    assert store.get("file:///a.sage") is None
+    assert not store.evict("file:///a.sage")
+
+
+def test_lru_bound():
+    store = DocumentStateStore(max_documents=2)
+    store.get_or_create("file:///a.sage")
+    store.get_or_create("file:///b.sage")
+    store.get("file:///a.sage")         # a is now the most recently used
+    store.get_or_create("file:///c.sage")
+
+    assert "file:///a.sage" in store
+    assert "file:///b.sage" not in store
+    assert store.occupancy() == {"documents": 2, "open": 0, "max_documents": 2, "evictions": 1}
+
+    store.resize(1)
+    assert len(store) == 1
+    assert "file:///c.sage" in store
+
+
+
+def test_open_documents_are_kept():
+    budget = MemoryBudget(max_bytes=1, idle_trim=0.01)
+    store = DocumentStateStore(max_documents=2)
+    budget.register("document_states", store)
+    store.open("file:///open.sage").update_names({"QQ": "sage.all"}, {}, {})
+    store.get_or_create("file:///a.sage")
+
+    store.resize(1)
+    assert "file:///a.sage" not in store
+
+    store.resize(2)
+    store.get_or_create("file:///a.sage")
+    assert budget.enforce() == 1
+    assert "file:///a.sage" not in store
+
+    store.get_or_create("file:///a.sage")
+    time.sleep(0.001)
+    budget.touch()
+    time.sleep(0.02)
+    assert budget.trim_if_idle()
+    assert "file:///a.sage" not in store
+    assert store.get("file:///open.sage").undefined_names == {"QQ": "sage.all"}
+
+    # Closed documents can be evicted again
+    store.evict("file:///open.sage")
+    store.get_or_create("file:///open.sage")
+    assert budget.enforce() == 1
+
+
+def test_sizes_measured_once(monkeypatch):
+    from sagelsp import document_state
+
+    measured = []
+    monkeypatch.setattr(document_state, "approx_size", lambda state: measured.append(state) or 100)
+    store = DocumentStateStore(max_documents=4)
+    store.get_or_create("file:///a.sage")
+    store.get_or_create("file:///b.sage")
+
+    assert store.budget_info()["bytes"] == 200
+    assert store.budget_info()["bytes"] == 200
+    assert len(measured) == 2
+
+    # Only the state used since is measured again
+    store.get("file:///a.sage")
+    assert store.budget_info()["bytes"] == 200
+    assert len(measured) == 3
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -31,5 +31,24 @@ def test_lsp(client):
         text=doc.source,
     )
 
+    stats = client.stats()
+    assert stats["state"] == "ready"
+    assert stats["hooks"]["sagelsp_lint"]["pycodestyle"]["count"] == 2
+    assert stats["loop"]["pending_client_requests"] >= 0
+    # the stats request itself is being handled
+    assert stats["loop"]["incoming_in_flight"] == 1
+    assert stats["loop"]["max_incoming_in_flight"] >= 1
+    # the change didn't alter the text, its diagnostics are not sent again
+    assert stats["skipped_publishes"] == 1
+
+    memory = client.memory(tracemalloc="snapshot", limit=5)
+    assert memory["caches"]["workspace"]["text_documents"] == 1
+    assert memory["caches"]["document_states"]["documents"] == 1
+    assert len(memory["top"]) <= 5
+    assert memory["tracemalloc"]["tracing"]
+
+    memory = client.memory(tracemalloc="diff")
+    assert all("size_diff" in site for site in memory["top"])
+
 if __name__ == "__main__":
     pytest.main([__file__])
\ No newline at end of file
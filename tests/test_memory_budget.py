@@ -0,0 +1,81 @@
+import time
+import pytest
+
+from sagelsp.memory_budget import LRUCache, MemoryBudget, cached
+
+
+def sizeof(value):
+    return len(value)
+
+
+def test_lru_cache():
+    cache = LRUCache("test", maxsize=2, sizeof=sizeof, register=False)
+    cache.put("a", "x" * 10)
+    cache.put("b", "x" * 20)
+    assert cache.get("a") == "x" * 10
+    cache.put("c", "x" * 30)
+
+    assert "b" not in cache
+    assert cache.budget_info()["bytes"] == 40
+    assert cache.budget_info()["evictions"] == 1
+
+
+def test_evict_least_recently_used_across_caches():
+    budget = MemoryBudget(max_bytes=100)
+    first = LRUCache("first", sizeof=sizeof, register=False)
+    second = LRUCache("second", sizeof=sizeof, register=False)
+    budget.register("first", first)
+    budget.register("second", second)
+
+    first.put("old", "x" * 50)
+    time.sleep(0.001)
+    second.put("new", "x" * 50)
+    time.sleep(0.001)
+    first.put("newest", "x" * 50)
+
+    assert budget.enforce() == 1
+    assert "old" not in first
+    assert "new" in second and "newest" in first
+    assert budget.report()["total_bytes"] == 100
+
+
+def test_idle_trim():
+    budget = MemoryBudget(idle_trim=0.01)
+    cache = LRUCache("cache", sizeof=sizeof, register=False)
+    budget.register("cache", cache)
+    cache.put("a", "x")
+    time.sleep(0.001)
+    budget.touch()
+
+    assert not budget.trim_if_idle()
+    time.sleep(0.02)
+    assert budget.trim_if_idle()
+    assert len(cache) == 0
+    assert not budget.trim_if_idle()
+
+
+def test_cached_function():
+    calls = []
+
+    @cached("test.square", maxsize=4)
+    def square(x):
+        calls.append(x)
+        return x * x
+
+    assert square(3) == 9
+    assert square(3) == 9
+    assert calls == [3]
+    assert square.cache_info().hits == 1
+    assert square.cache_info().currsize == 1
+
+    @cached("test.sized", maxsize=4, sizeof=lambda result, x: x)
+    def sized(x):
+        return [None] * x
+
+    sized(10)
+    sized(20)
+    assert sized.cache.budget_info()["bytes"] == 30
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
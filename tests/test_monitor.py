@@ -0,0 +1,73 @@
+from concurrent.futures import Future
+import asyncio
+import logging
+import time
+import pytest
+
+from sagelsp.monitor import LoopMonitor
+
+
+class FakeProtocol:
+    def __init__(self):
+        done = Future()
+        done.set_result(None)
+        self._request_futures = {1: Future(), 2: done}
+
+
+class FakeServer:
+    def __init__(self):
+        self.protocol = FakeProtocol()
+
+
+def test_loop_lag(caplog):
+    monitor = LoopMonitor(FakeServer(), interval=0.01, lag_warning=50)
+
+    async def main():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.1)     # block the event loop
+        await asyncio.sleep(0.05)
+        monitor.stop()
+
+    with caplog.at_level(logging.WARNING, logger="sagelsp.monitor"):
+        asyncio.run(main())
+
+    report = monitor.report()
+    assert report["lag"]["count"] >= 2
+    assert report["lag"]["max"] >= 50
+    assert report["pending_client_requests"] == 1
+    assert "Event loop blocked" in caplog.text
+
+
+def test_track_incoming(caplog):
+    monitor = LoopMonitor(FakeServer(), lag_warning=50)
+    in_flight = []
+
+    @monitor.track
+    def handler(params):
+        in_flight.append(monitor.incoming)
+        return params
+
+    @monitor.track
+    async def async_handler(params):
+        await asyncio.sleep(0.01)
+        in_flight.append(monitor.incoming)
+        return params
+
+    async def main():
+        return await asyncio.gather(async_handler(1), async_handler(2))
+
+    assert handler(0) == 0
+    assert asyncio.run(main()) == [1, 2]
+    assert in_flight == [1, 2, 1]
+    assert monitor.report()["incoming_in_flight"] == 0
+    assert monitor.report()["max_incoming_in_flight"] == 2
+
+    with caplog.at_level(logging.WARNING, logger="sagelsp.monitor"):
+        monitor.sample(0.1)
+    assert "3 messages handled since the last sample" in caplog.text
+    assert monitor.handled == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
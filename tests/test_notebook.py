@@ -0,0 +1,196 @@
+import ast
+import re
+
+import pytest
+from pygls.workspace import Workspace
+from lsprotocol import types
+
+from sagelsp.notebook import JupyterNotebook
+
+NOTEBOOK_URI = "file:///test.ipynb"
+
+
+class FakeServer:
+    def __init__(self):
+        self.workspace = Workspace(None)
+
+
+def cell_uri(i):
+    return f"vscode-notebook-cell:/test.ipynb#{i}"
+
+
+def open_notebook(ls, sources):
+    ls.workspace.put_notebook_document(types.DidOpenNotebookDocumentParams(
+        notebook_document=types.NotebookDocument(
+            uri=NOTEBOOK_URI,
+            notebook_type="jupyter-notebook",
+            version=0,
+            cells=[types.NotebookCell(kind=types.NotebookCellKind.Code, document=cell_uri(i)) for i in range(len(sources))],
+        ),
+        cell_text_documents=[
+            types.TextDocumentItem(uri=cell_uri(i), language_id="sagemath", version=0, text=source)
+            for i, source in enumerate(sources)
+        ],
+    ))
+    return ls.workspace.get_notebook_document(notebook_uri=NOTEBOOK_URI)
+
+
+def edit_cell(ls, i, version, text):
+    ls.workspace.update_notebook_document(types.DidChangeNotebookDocumentParams(
+        notebook_document=types.VersionedNotebookDocumentIdentifier(uri=NOTEBOOK_URI, version=version),
+        change=types.NotebookDocumentChangeEvent(
+            cells=types.NotebookDocumentCellChanges(
+                text_content=[types.NotebookDocumentCellContentChanges(
+                    document=types.VersionedTextDocumentIdentifier(uri=cell_uri(i), version=version),
+                    changes=[types.TextDocumentContentChangeWholeDocument(text=text)],
+                )],
+            ),
+        ),
+    ))
+    return ls.workspace.get_notebook_document(notebook_uri=NOTEBOOK_URI)
+
+
+def test_incremental_virtual_document():
+    ls = FakeServer()
+    nb = open_notebook(ls, ["a = 1\nb = 2", "", "c = a + b"])
+    notebook = JupyterNotebook(ls, nb)
+
+    assert notebook.virtual_document.source == "a = 1\nb = 2\n\nc = a + b\n"
+    assert notebook.offsets == [0, 2, 3]
+    assert notebook.map_position(types.Position(line=3, character=4)) == (cell_uri(2), types.Position(line=0, character=4))
+    assert notebook.map_position(types.Position(line=4, character=0)) is None
+
+    nb = edit_cell(ls, 1, 1, "x = 1\ny = 2\n")
+    assert notebook.update(nb) == [cell_uri(1)]
+    assert notebook.virtual_document.version == 1
+    assert notebook.virtual_document.source == "a = 1\nb = 2\nx = 1\ny = 2\nc = a + b\n"
+    assert notebook.offsets == [0, 2, 4]
+    assert notebook.map_position(types.Position(line=3, character=0)) == (cell_uri(1), types.Position(line=1, character=0))
+    assert notebook.to_virtual_position(cell_uri(2), types.Position(line=0, character=4)) == types.Position(line=4, character=4)
+
+
+def test_style_cache():
+    ls = FakeServer()
+    nb = open_notebook(ls, ["a=1", "b=2"])
+    notebook = JupyterNotebook(ls, nb)
+
+    linted = []
+
+    def lint(cell_doc):
+        linted.append(cell_doc.uri)
+        return [types.Diagnostic(range=types.Range(start=types.Position(0, 1), end=types.Position(0, 2)), message="E225")]
+
+    def lint_all(config_hash):
+        return {uri: notebook.style_diagnostics(ls.workspace.get_text_document(uri), config_hash, lint) for uri in notebook.cell_uris}
+
+    lint_all("config")
+    assert linted == [cell_uri(0), cell_uri(1)]
+
+    notebook.update(edit_cell(ls, 1, 1, "b=3"))
+    lint_all("config")
+    assert linted[2:] == [cell_uri(1)]
+
+    lint_all("other config")
+    assert linted[3:] == [cell_uri(0), cell_uri(1)]
+
+
+def test_semantic_engine():
+    from sagelsp.plugins.pyflakes_notebook import NotebookSemantics
+
+    ls = FakeServer()
+    nb = open_notebook(ls, ["import os\nimport sys", "def f():\n    return later", "print(x)", "later = 1\nprint(y)"])
+    notebook = JupyterNotebook(ls, nb)
+    engine = NotebookSemantics.of(notebook)
+
+    def messages():
+        return {uri: [diag.message for diag in diags] for uri, diags in engine.lint().items()}
+
+    assert messages() == {
+        cell_uri(0): ["'os' imported but unused", "'sys' imported but unused"],
+        cell_uri(1): [],
+        cell_uri(2): ["undefined name 'x'"],
+        cell_uri(3): ["undefined name 'y'"],
+    }
+    assert len(engine.checked) == 4
+
+    # Defining x only affects the cell using it
+    notebook.update(edit_cell(ls, 1, 1, "def f():\n    return later\nx = os.sep"))
+    assert messages()[cell_uri(2)] == []
+    assert engine.checked == [cell_uri(1)]
+    assert engine.relinted == [cell_uri(0), cell_uri(1), cell_uri(2)]
+    assert engine.results[cell_uri(0)].diagnostics[0].message == "'sys' imported but unused"
+
+    # Diagnostics are shifted to the virtual document without touching the cached ones
+    virtual = engine.virtual_diagnostics(engine.lint())
+    assert [diag.range.start.line for diag in virtual] == [1, 7]
+    assert engine.results[cell_uri(3)].diagnostics[0].range.start.line == 1
+    assert engine.checked == [] and engine.relinted == []
+
+
+@pytest.mark.parametrize("sources", [
+    ["from math import *", "print(sqrt(2))"],
+    ["def f():\n    return sqrt(2)", "from math import *"],
+    ["import os", "os = 1", "print(os)"],
+    ["import os\nprint(os)", "import os"],
+    ["import os", "def f(os):\n    return os"],
+    ["__all__ = ['a', 'b']", "a = 1"],
+    ["import os", "__all__ = ['os']"],
+    ["x = 1", "del x", "print(x)"],
+    ["def f():\n    global g\n    g = 1", "print(g)"],
+    ["import os", "def f():\n    print(os)\n    os = 1"],
+    ["from __future__ import annotations", "def q() -> os:\n    pass"],
+    ["def q(a: later):\n    x: later = 1", "from __future__ import annotations", "later = 1"],
+])
+def test_semantic_engine_matches_pyflakes(sources):
+    from pyflakes import checker
+    from sagelsp.plugins.pyflakes_notebook import NotebookSemantics
+
+    ls = FakeServer()
+    notebook = JupyterNotebook(ls, open_notebook(ls, sources))
+
+    # Same messages as pyflakes on the whole notebook, except lines in the text are in cells
+    def without_lines(message):
+        return re.sub(r"line \d+", "line", message)
+
+    expected = sorted(
+        (message.lineno - 1, message.col, without_lines(message.message % message.message_args))
+        for message in checker.Checker(ast.parse(notebook.virtual_document.source)).messages
+    )
+    engine = NotebookSemantics.of(notebook)
+    assert sorted(
+        (diag.range.start.line, diag.range.start.character, without_lines(diag.message))
+        for diag in engine.virtual_diagnostics(engine.lint())
+    ) == expected
+
+
+def test_annotations_future_rechecks_cells():
+    from sagelsp.plugins.pyflakes_notebook import NotebookSemantics
+
+    ls = FakeServer()
+    notebook = JupyterNotebook(ls, open_notebook(ls, ["", "def q() -> T:\n    pass", "T = int"]))
+    engine = NotebookSemantics.of(notebook)
+    assert [diag.message for diag in engine.lint()[cell_uri(1)]] == ["undefined name 'T'"]
+
+    # Annotations below the future import are postponed, so `T` is defined when they are checked
+    notebook.update(edit_cell(ls, 0, 1, "from __future__ import annotations"))
+    assert engine.lint()[cell_uri(1)] == []
+    assert engine.checked == [cell_uri(0), cell_uri(1), cell_uri(2)]
+
+    notebook.update(edit_cell(ls, 0, 2, ""))
+    assert [diag.message for diag in engine.lint()[cell_uri(1)]] == ["undefined name 'T'"]
+
+
+def test_cross_cell_definition():
+    from sagelsp.plugins.definition import sagelsp_definition
+
+    ls = FakeServer()
+    nb = open_notebook(ls, ["def foo():\n    return 1", "foo()"])
+    notebook = JupyterNotebook(ls, nb)
+
+    position = notebook.to_virtual_position(cell_uri(1), types.Position(line=0, character=1))
+    locations = notebook.map_locations(sagelsp_definition(doc=notebook.virtual_document, position=position))
+    assert [(loc.uri, loc.range.start.line) for loc in locations] == [(cell_uri(0), 0)]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,282 @@
+import pytest
+import pycodestyle
+import threading
+import time
+from types import SimpleNamespace
+from lsprotocol import types
+from pygls.workspace import TextDocument
+
+from sagelsp import hookimpl
+from sagelsp.plugins.manager import create_plugin_manager, LazyPlugin, _scan_hookimpls
+
+
+code_text = """\
+x=1
+"""
+
+
+class EmptyConfig:
+    def get_pycodestyle_config(self):
+        return {}
+
+    def get_pycodestyle_style(self, notebook=False):
+        return pycodestyle.StyleGuide()
+
+
+def test_lazy_plugin_loaded_on_first_call():
+    pm = create_plugin_manager()
+    assert isinstance(pm.get_plugin("pycodestyle"), LazyPlugin)
+
+    doc = TextDocument(uri="file:///test.py", source=code_text)
+    diagnostics = pm.hook.sagelsp_style_lint(doc=doc, config=EmptyConfig(), notebook=False)
+
+    assert [diag.code for diags in diagnostics for diag in diags] == ["E225"]
+    plugin = pm.get_plugin("pycodestyle")
+    assert not isinstance(plugin, LazyPlugin)
+    assert plugin.__name__ == "sagelsp.plugins.pycodestyle_lint"
+
+    pm.load_lazy_plugins()
+    assert not any(isinstance(plugin, LazyPlugin) for plugin in pm.get_plugins())
+
+
+PLUGIN_SOURCES = {
+    "plain_plugin": "from sagelsp import hookimpl\n\n@hookimpl(tryfirst=True)\ndef sagelsp_folding_range(doc):\n    return []\n",
+    "attr_plugin": "import sagelsp\n\n@sagelsp.hookimpl\ndef sagelsp_folding_range(doc):\n    return []\n",
+    "alias_plugin": "from sagelsp import hookimpl as impl\n\n@impl\ndef sagelsp_folding_range(doc):\n    return []\n",
+    "async_plugin": "from sagelsp import hookimpl\n\n@hookimpl\nasync def sagelsp_folding_range(doc):\n    return []\n",
+    "empty_plugin": "def sagelsp_folding_range(doc):\n    return []\n",
+    "local_plugin": "def hookimpl(f):\n    return f\n\n@hookimpl\ndef sagelsp_folding_range(doc):\n    return []\n",
+    "star_plugin": "from sagelsp import *\n\n@hookimpl\ndef sagelsp_folding_range(doc):\n    return []\n",
+    "wrapped_plugin": "import sagelsp as s\n\n@functools.wraps(s.hookimpl)\ndef sagelsp_folding_range(doc):\n    return []\n",
+}
+
+
+def test_unrecognised_hookimpls_are_imported(tmp_path, monkeypatch):
+    from importlib import metadata
+    from sagelsp.plugins import manager
+
+    for name, source in PLUGIN_SOURCES.items():
+        (tmp_path / f"{name}.py").write_text(source)
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    assert _scan_hookimpls("plain_plugin") == {"sagelsp_folding_range": {"argnames": ["doc"], "opts": {"tryfirst": True}}}
+    # Decorators are resolved against the imports
+    for name in ["attr_plugin", "alias_plugin"]:
+        assert _scan_hookimpls(name) == {"sagelsp_folding_range": {"argnames": ["doc"], "opts": {}}}
+    for name in ["async_plugin", "empty_plugin", "local_plugin", "star_plugin", "wrapped_plugin"]:
+        assert _scan_hookimpls(name) is None
+
+    # Plugins that can't be scanned are imported and registered as they are
+    entry_points = [metadata.EntryPoint(name, name, "sagelsp") for name in ["plain_plugin", "async_plugin"]]
+    monkeypatch.setattr(manager.metadata, "entry_points", lambda group: entry_points)
+    pm = create_plugin_manager()
+    assert isinstance(pm.get_plugin("plain_plugin"), LazyPlugin)
+    assert pm.get_plugin("async_plugin").__name__ == "async_plugin"
+    assert len(pm.hook.sagelsp_folding_range.get_hookimpls()) == 2
+
+
+def test_disabled_plugins():
+    pm = create_plugin_manager(["folding"])
+    assert pm.is_blocked("folding")
+
+    doc = TextDocument(uri="file:///test.py", source=code_text)
+    assert pm.hook.sagelsp_folding_range(doc=doc) == []
+
+
+class BrokenPlugin:
+    @hookimpl
+    def sagelsp_folding_range(self, doc):
+        raise RuntimeError("broken")
+
+
+def test_hook_stats_and_failure_isolation():
+    pm = create_plugin_manager()
+    pm.register(BrokenPlugin(), name="broken")
+
+    doc = TextDocument(uri="file:///test.py", source="def f():\n    pass\n")
+    ranges = pm.hook.sagelsp_folding_range(doc=doc)
+    assert len(ranges) == 1
+
+    report = pm.stats.report()["sagelsp_folding_range"]
+    assert report["broken"]["count"] == 1
+    assert report["broken"]["errors"] == 1
+    assert report["folding"]["count"] == 1
+    assert report["folding"]["errors"] == 0
+    assert report["folding"]["p50"] <= report["folding"]["p99"] <= report["folding"]["max"]
+
+
+class SlowPlugin:
+    @hookimpl
+    def sagelsp_folding_range(self, doc):
+        time.sleep(0.5)
+        return []
+
+
+def test_timeout_and_circuit_breaker():
+    pm = create_plugin_manager()
+    pm.register(SlowPlugin(), name="slow")
+    pm.configure_timeouts(plugin_timeouts={"slow.sagelsp_folding_range": 0.05}, breaker_threshold=2, breaker_cooldown=60)
+
+    doc = TextDocument(uri="file:///test.py", source="def f():\n    pass\n")
+    for _ in range(3):
+        assert len(pm.hook.sagelsp_folding_range(doc=doc)) == 1
+        # wait for the timed out call, the plugin is skipped until it returns
+        while pm._is_stuck("slow"):
+            time.sleep(0.01)
+
+    report = pm.stats.report()["sagelsp_folding_range"]["slow"]
+    # the third call is skipped by the open breaker
+    assert report["count"] == 2
+    assert report["timeouts"] == 2
+    assert "slow.sagelsp_folding_range" in pm.breaker.report()
+
+
+class HungPlugin:
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+        self.running = 0
+        self.overlapped = False
+
+    @hookimpl
+    def sagelsp_folding_range(self, doc):
+        self.calls += 1
+        self.running += 1
+        self.overlapped |= self.running > 1
+        self.release.wait(5)
+        self.running -= 1
+        return []
+
+
+def test_hung_plugin_skipped_until_it_returns():
+    pm = create_plugin_manager(["folding"])
+    plugin = HungPlugin()
+    pm.register(plugin, name="hung")
+    pm.configure_timeouts(plugin_timeouts={"hung": 0.05}, breaker_threshold=10)
+
+    doc = TextDocument(uri="file:///test.py", source="")
+    assert pm.hook.sagelsp_folding_range(doc=doc) == []
+
+    # The timed out call still runs, the next one doesn't start a second one
+    start = time.perf_counter()
+    assert pm.hook.sagelsp_folding_range(doc=doc) == []
+    assert time.perf_counter() - start < 0.05
+    assert plugin.calls == 1
+    assert pm.stats.report()["sagelsp_folding_range"]["hung"]["timeouts"] == 1
+    assert pm._worker("hung").thread.daemon
+
+    plugin.release.set()
+    for _ in range(100):
+        if plugin.running == 0:
+            break
+        time.sleep(0.01)
+    assert pm.hook.sagelsp_folding_range(doc=doc) == [[]]
+    assert plugin.calls == 2
+    assert not plugin.overlapped
+
+
+class DelayedPlugin:
+    def __init__(self, delay, ranges):
+        self.delay = delay
+        self.ranges = ranges
+
+    @hookimpl
+    def sagelsp_folding_range(self, doc):
+        time.sleep(self.delay)
+        return self.ranges
+
+
+def test_call_concurrent():
+    pm = create_plugin_manager(["folding"])
+    pm.register(DelayedPlugin(0.3, ["slow"]), name="slow")
+    pm.register(DelayedPlugin(0.0, ["fast"]), name="fast")
+
+    finished = []
+    start = time.perf_counter()
+    results = pm.call_concurrent(
+        "sagelsp_folding_range",
+        {"doc": TextDocument(uri="file:///test.py", source="")},
+        lambda plugin_name, result: finished.append((plugin_name, time.perf_counter() - start)),
+    )
+
+    assert results == pm.hook.sagelsp_folding_range(doc=TextDocument(uri="file:///test.py", source=""))
+    assert [name for name, _ in finished] == ["fast", "slow"]
+    assert finished[0][1] < 0.3
+
+
+class RecordingPlugin:
+    def __init__(self, calls):
+        self.calls = calls
+
+    @hookimpl
+    def sagelsp_folding_range(self, doc):
+        start = time.perf_counter()
+        time.sleep(0.05)
+        self.calls.append((threading.current_thread().name, start, time.perf_counter()))
+        return []
+
+
+def test_shared_worker(monkeypatch):
+    """Plugins sharing a worker never run at the same time, with or without a deadline"""
+    from sagelsp.plugins import manager
+
+    monkeypatch.setitem(manager.SHARED_WORKERS, "first", "shared")
+    monkeypatch.setitem(manager.SHARED_WORKERS, "second", "shared")
+    pm = create_plugin_manager(["folding"])
+    calls = []
+    pm.register(RecordingPlugin(calls), name="first")
+    pm.register(RecordingPlugin(calls), name="second")
+
+    doc = TextDocument(uri="file:///test.py", source="")
+    pm.call_concurrent("sagelsp_folding_range", {"doc": doc})
+    pm.configure_timeouts(hook_timeout=1.0)
+    pm.call_concurrent("sagelsp_folding_range", {"doc": doc})
+
+    assert {name for name, _, _ in calls} == {"sagelsp-shared"}
+    calls.sort(key=lambda call: call[1])
+    assert all(end <= next_start for (_, _, end), (_, next_start, _) in zip(calls, calls[1:]))
+
+    # Other work, like the jedi preloading of the warm-up, can run on a shared worker
+    assert pm.submit("shared", lambda: threading.current_thread().name).result() == "sagelsp-shared"
+    assert pm._worker("jedi") is pm._worker("hover")
+
+
+class FailingLint:
+    def __init__(self):
+        self.fail = False
+
+    @hookimpl
+    def sagelsp_lint(self, doc, config, notebook):
+        if self.fail:
+            raise RuntimeError("lint failed")
+        return [types.Diagnostic(range=types.Range(start=types.Position(0, 0), end=types.Position(0, 1)), message="stale")]
+
+
+def test_concurrent_lint():
+    from sagelsp.server import lint_document_concurrently
+
+    pm = create_plugin_manager(["pyflakes"])
+    failing = FailingLint()
+    pm.register(failing, name="failing")
+
+    published = []
+    ls = SimpleNamespace(
+        pm=pm, StyleConfig=EmptyConfig(), plugin_diagnostics={},
+        publish_diagnostics=lambda uri, diagnostics, version: published.append([diag.message for diag in diagnostics]),
+    )
+    doc = TextDocument(uri="file:///test.py", source=code_text)
+
+    # Lazy plugins first loaded from the thread pool are all registered
+    lint_document_concurrently(ls, doc)
+    assert not any(isinstance(method.plugin, LazyPlugin) for method in pm.hook.sagelsp_lint.get_hookimpls())
+    assert sorted(published[-1]) == ["E225 missing whitespace around operator", "stale"]
+
+    # Diagnostics of a failing plugin are not kept from its previous run
+    failing.fail = True
+    lint_document_concurrently(ls, doc)
+    assert published[-1] == ["E225 missing whitespace around operator"]
+    assert set(ls.plugin_diagnostics[doc.uri]) == {"pycodestyle"}
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
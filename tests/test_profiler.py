@@ -0,0 +1,45 @@
+import json
+import time
+import pytest
+from lsprotocol import types
+
+from sagelsp.profiler import RequestProfiler
+
+
+def slow_handler(params):
+    time.sleep(0.02)
+    return "done"
+
+
+def fast_handler(params):
+    return "done"
+
+
+def test_profile_slow_requests(tmp_path):
+    profiler = RequestProfiler(tmp_path, threshold=10)
+    params = types.HoverParams(
+        text_document=types.TextDocumentIdentifier(uri="file:///test.sage"),
+        position=types.Position(line=0, character=0),
+    )
+
+    assert profiler.wrap("textDocument/hover", fast_handler)(params) == "done"
+    assert list(tmp_path.glob("*.prof")) == []
+
+    assert profiler.wrap("textDocument/hover", slow_handler)(params) == "done"
+    profiles = list(tmp_path.glob("*.prof"))
+    assert len(profiles) == 1
+
+    info = json.loads(profiles[0].with_suffix(".json").read_text())
+    assert info["method"] == "textDocument/hover"
+    assert info["uri"] == "file:///test.sage"
+    assert info["duration_ms"] >= 10
+
+
+def test_profiler_disabled(tmp_path):
+    profiler = RequestProfiler(tmp_path)
+    assert profiler.wrap("textDocument/hover", slow_handler)(None) == "done"
+    assert not tmp_path.exists() or list(tmp_path.iterdir()) == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
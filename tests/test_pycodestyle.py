@@ -64,5 +64,93 @@ def _test_pycodestyle_direct():
     assert len(diagnostics) > 0, "Expected at least one style issue to be detected"
 
 
+def test_style_guide_reuse():
+    """StyleGuide is built once per configuration and notebook flag"""
+    from pygls.workspace import Workspace
+    from sagelsp.config import StyleConfig
+    from sagelsp.plugins.pycodestyle_lint import sagelsp_lint
+
+    config = StyleConfig(Workspace(None))
+    style = config.get_pycodestyle_style()
+    assert config.get_pycodestyle_style() is style
+    assert config.get_pycodestyle_style(notebook=True) is not style
+    assert StyleConfig(Workspace(None)).get_pycodestyle_style() is not style
+
+    doc = TextDocument(uri="file:///test_direct.sage", source="a=1\n", language_id="sagemath", version=1)
+    assert [diag.code for diag in sagelsp_lint(doc, config, False)] == ["E225"]
+
+
+def test_incremental_lint():
+    """Only the statements around edited lines are checked again, other diagnostics are shifted"""
+    from lsprotocol import types
+    from pygls.workspace import Workspace
+    from sagelsp.config import StyleConfig
+    from sagelsp.document_state import DocumentStates
+    from sagelsp.plugins.pycodestyle_lint import sagelsp_lint, _check
+
+    uri = "file:///test_incremental.py"
+    config = StyleConfig(Workspace(None))
+    workspace = Workspace(None)
+    workspace.put_text_document(types.TextDocumentItem(
+        uri=uri, language_id="python", version=0,
+        text="import os\n\n\ndef f():\n    return os.sep\n\n\ndef g():\n    return 1\n\n\ny=2\n",
+    ))
+    state = DocumentStates.get_or_create(uri)
+    state.reset_edits(0)
+    sagelsp_lint(workspace.get_text_document(uri), config, False)
+
+    # Insert a badly formatted line in f
+    change = types.TextDocumentContentChangePartial(
+        range=types.Range(start=types.Position(line=4, character=0), end=types.Position(line=4, character=0)),
+        text="    x=1\n",
+    )
+    workspace.update_text_document(types.VersionedTextDocumentIdentifier(uri=uri, version=1), change)
+    state.record_changes(1, [change])
+    doc = workspace.get_text_document(uri)
+    diagnostics = sagelsp_lint(doc, config, False)
+
+    assert state.analysis["pycodestyle"].passes == 1
+    full, _, _ = _check(uri, doc.source.splitlines(keepends=True), config.get_pycodestyle_style())
+    assert [(diag.code, diag.range.start.line) for diag in diagnostics] == [("E225", 4), ("E225", 12)]
+    assert sorted((diag.code, diag.range.start.line) for diag in full) == [("E225", 4), ("E225", 12)]
+    DocumentStates.evict(uri)
+
+
+@pytest.mark.parametrize("text, edits", [
+    # Tabs change the indent char used by E101 for the lines below
+    ("if w:\n    pass\nx = 1\ny = 2\nz = 3\nif y:\n    z = 2\n", [(1, 2, "\tpass\n"), (1, 2, "    pass\n")]),
+    # A group of one-liners is found by reading down from a decorator
+    ("x = 0\n@dec\ny = 1\n\n\nz = 2\ndef f(): pass\nw = 3\n", [(6, 7, ""), (6, 6, "def g(): pass\n")]),
+    ("def f(): pass\ndef g(): pass\n\n\nx = 1\n", [(1, 1, "@dec\n"), (3, 3, "    y = 2\n")]),
+])
+def test_incremental_lint_matches_full_check(text, edits):
+    """Incremental passes give the diagnostics of a full check"""
+    from lsprotocol import types
+    from pygls.workspace import Workspace
+    from sagelsp.config import StyleConfig
+    from sagelsp.document_state import DocumentStates
+    from sagelsp.plugins.pycodestyle_lint import sagelsp_lint, _check
+
+    uri = "file:///test_incremental_full.py"
+    config = StyleConfig(Workspace(None))
+    workspace = Workspace(None)
+    workspace.put_text_document(types.TextDocumentItem(uri=uri, language_id="python", version=0, text=text))
+    state = DocumentStates.get_or_create(uri)
+    state.reset_edits(0)
+    sagelsp_lint(workspace.get_text_document(uri), config, False)
+
+    for version, (start, end, new_text) in enumerate(edits, 1):
+        change = types.TextDocumentContentChangePartial(
+            range=types.Range(start=types.Position(line=start, character=0), end=types.Position(line=end, character=0)),
+            text=new_text,
+        )
+        workspace.update_text_document(types.VersionedTextDocumentIdentifier(uri=uri, version=version), change)
+        state.record_changes(version, [change])
+        doc = workspace.get_text_document(uri)
+        full, _, _ = _check(uri, doc.source.splitlines(keepends=True), config.get_pycodestyle_style())
+        assert sagelsp_lint(doc, config, False) == sorted(full, key=lambda diag: (diag.range.start.line, diag.range.start.character))
+    DocumentStates.evict(uri)
+
+
 if __name__ == "__main__":
     pytest.main([__file__])
@@ -44,5 +44,41 @@ def _test_pyflakes_direct():
     for diag in diagnostics:
         print(f"Diagnostic: {diag}")
 
+def test_shared_tree():
+    """pyflakes and import extraction share one tree, imported names are reused while imports don't change"""
+    from sagelsp.document_state import DocumentState
+    from sagelsp.plugins.pyflakes_lint import DiagnosticReporter, check, _cached_imported_names
+
+    text = "from sage.all import (\n    ZZ,\n    QQ)\nimport os\nx = ZZ\n"
+    reporter = DiagnosticReporter(text.split("\n"))
+    tree = check(text, "test.py", reporter)
+    assert [diag.code for diag in reporter.diagnostics] == ["UnusedImport", "UnusedImport"]
+
+    state = DocumentState("file:///shared_tree.py")
+    names = _cached_imported_names(state, tree)
+    assert names == {"ZZ": "sage.all", "QQ": "sage.all"}
+
+    # Only a statement changed, the names are reused
+    edited = text + "y = QQ\n"
+    assert _cached_imported_names(state, check(edited, "test.py", DiagnosticReporter(edited.split("\n")))) is names
+
+    # A syntax error keeps the last names
+    broken = edited + "z = (\n"
+    reporter = DiagnosticReporter(broken.split("\n"))
+    assert check(broken, "test.py", reporter) is None
+    assert reporter.diagnostics[0].message.startswith("Syntax error")
+    assert _cached_imported_names(state, None) is names
+
+    # An import inside the parentheses changed
+    edited = edited.replace("QQ)", "RR)")
+    assert _cached_imported_names(state, check(edited, "test.py", DiagnosticReporter(edited.split("\n")))) == {"ZZ": "sage.all", "RR": "sage.all"}
+
+    # Uncommenting an import changes the names, an import in a comment or a string doesn't
+    edited = edited + "# from sage.all import GF\ns = 'from sage.all import CC'\n"
+    assert _cached_imported_names(state, check(edited, "test.py", DiagnosticReporter(edited.split("\n")))) == {"ZZ": "sage.all", "RR": "sage.all"}
+    edited = edited.replace("# from", "from")
+    assert _cached_imported_names(state, check(edited, "test.py", DiagnosticReporter(edited.split("\n")))) == {"ZZ": "sage.all", "RR": "sage.all", "GF": "sage.all"}
+
+
 if __name__ == "__main__":
-    pytest.main([__file__])
\ No newline at end of file
+    pytest.main([__file__])
@@ -1,6 +1,6 @@
 import pytest
 
-from sagelsp.symbols_cache import Symbol, SymbolStatus, SymbolsCache
+from sagelsp.symbols_cache import Symbol, SymbolStatus, SymbolsCache, SymbolsCacheBase
 
 
 def test_insert_and_lookup():
@@ -24,5 +24,65 @@ def test_get_caches_not_found_symbol():
     assert found.status == SymbolStatus.NOT_FOUND
     assert found.import_path == ""
 
+
+def test_export_and_import_artifact(tmp_path):
+    source = SymbolsCacheBase(tmp_path / "source.db")
+    source._insert(Symbol(name="IntegerRing_class", status=SymbolStatus.NEED_IMPORT, import_path="sage.rings.integer_ring"))
+    source._insert(Symbol(name="funccccccccc", status=SymbolStatus.NOT_FOUND))
+
+    artifact = tmp_path / "symbols.json.gz"
+    assert source.export_artifact(artifact) == 2
+
+    target = SymbolsCacheBase(tmp_path / "target.db")
+    target._insert(Symbol(name="funccccccccc", status=SymbolStatus.AUTO_IMPORT, import_path="sage.all"))
+    assert target.import_artifact(artifact) == 1
+
+    found = target._lookup("IntegerRing_class")
+    assert found is not None
+    assert found.status == SymbolStatus.NEED_IMPORT
+    assert found.import_path == "sage.rings.integer_ring"
+
+    # Symbols resolved locally are kept
+    assert target._lookup("funccccccccc").status == SymbolStatus.AUTO_IMPORT
+
+
+def test_malformed_artifact(tmp_path):
+    import gzip
+    import json
+    import sagelsp
+    from sagelsp.symbols_cache import ARTIFACT_FORMAT, CACHE_VERSION
+
+    cache = SymbolsCacheBase(tmp_path / "cache.db")
+    artifact = tmp_path / "symbols.json.gz"
+    for symbols in [
+        [["a", "", 1], ["b", 2]], [["a", "", 1], 3], [["a", "", {"status": 1}]],
+        [["a", "", 1], ["b", "", 5]], [["a", "", 1], ["b", "", "1"]], [["a", None, 1]],
+    ]:
+        with gzip.open(artifact, "wt", encoding="utf-8") as f:
+            json.dump({
+                "format": ARTIFACT_FORMAT, "cache_version": CACHE_VERSION,
+                "sage_version": sagelsp.SageVersion, "symbols": symbols,
+            }, f)
+        assert cache.import_artifact(artifact) == 0
+        assert cache._lookup("a") is None
+
+    artifact.write_bytes(gzip.compress(b"[]"))
+    assert cache.import_artifact(artifact) == 0
+
+
+def test_export_replaces_leftover_tmp(tmp_path):
+    cache = SymbolsCacheBase(tmp_path / "cache.db")
+    cache._insert(Symbol(name="funccccccccc", status=SymbolStatus.NOT_FOUND))
+
+    artifact = tmp_path / "symbols.json.gz"
+    leftover = tmp_path / "symbols.json.gz.tmp"
+    leftover.write_bytes(b"partial")
+    leftover.chmod(0o444)
+
+    assert cache.export_artifact(artifact) == 1
+    assert cache.export_artifact(artifact) == 1
+    assert not leftover.exists()
+
+
 if __name__ == "__main__":
     pytest.main([__file__])
\ No newline at end of file
@@ -0,0 +1,34 @@
+import json
+import pytest
+
+from sagelsp.tracing import SpanTracer
+
+
+def test_chrome_trace(tmp_path):
+    tracer = SpanTracer()
+    path = tmp_path / "trace.json"
+
+    with tracer.span("disabled"):
+        pass
+
+    tracer.start(path)
+
+    @tracer.traced("traced", "test")
+    def work():
+        with tracer.span("inner", "test", size=3):
+            return 1
+
+    assert work() == 1
+    tracer.stop()
+
+    events = json.loads(path.read_text())
+    spans = {e["name"]: e for e in events if e["ph"] == "X"}
+    assert set(spans) == {"traced", "inner"}
+    assert spans["inner"]["args"] == {"size": 3}
+    assert spans["traced"]["ts"] <= spans["inner"]["ts"]
+    assert spans["traced"]["dur"] >= spans["inner"]["dur"]
+    assert any(e["ph"] == "M" and e["name"] == "thread_name" for e in events)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])